@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Fetches the output of many TCP agents concurrently
+
+A single process opens up to max_concurrent non-blocking connections
+at the same time and multiplexes them with poll(). This way the time
+needed for contacting many slow agents overlaps instead of adding up.
+Only the raw agent output is fetched here. Decryption, parsing and
+caching is done by the caller exactly as for a single host."""
+
+import errno
+import os
+import select
+import socket
+import time
+
+import cmk.log
+logger = cmk.log.get_logger(__name__)
+
+_POLL_READ  = select.POLLIN | select.POLLPRI
+_POLL_WRITE = select.POLLOUT
+_POLL_ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+
+class _Connection(object):
+    def __init__(self, hostname, ipaddress, port, family, connect_timeout):
+        self.hostname        = hostname
+        self.ipaddress       = ipaddress
+        self.port            = port
+        self.family          = family
+        self.connect_timeout = connect_timeout
+        self.sock            = None
+        self.connected       = False
+        self.chunks          = []
+        self.deadline        = None
+
+
+    def start(self, now):
+        self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+        self.deadline = now + self.connect_timeout
+        logger.debug("Connecting via TCP to %s:%d." % (self.ipaddress, self.port))
+        result = self.sock.connect_ex((self.ipaddress, self.port))
+        if result not in [ 0, errno.EINPROGRESS, errno.EWOULDBLOCK ]:
+            raise socket.error(result, os.strerror(result))
+
+
+    def error_message(self, reason):
+        return "Cannot get data from TCP port %s:%d: %s" % (self.ipaddress, self.port, reason)
+
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+# Contacts the agents of all given hosts and returns a pair of two
+# dictionaries: The first one maps the host name to the raw agent
+# output, the second one maps it to an error message.
+#
+# jobs is a list of tuples (hostname, ipaddress, port, family, connect_timeout).
+# The connect_timeout is applied per host, just as with a single blocking
+# connect. read_timeout (seconds, None means unlimited) limits the time
+# an agent may take to send its output after the connection has been
+# established.
+def fetch_agent_outputs(jobs, max_concurrent=50, read_timeout=None):
+    outputs, errors = {}, {}
+    pending = list(reversed(jobs))
+    active = {} # fileno -> _Connection
+    poller = select.poll()
+    max_concurrent = max(1, max_concurrent)
+
+    def finish(conn, error=None):
+        fd = conn.sock.fileno()
+        poller.unregister(fd)
+        del active[fd]
+        conn.close()
+        if error is not None:
+            errors[conn.hostname] = conn.error_message(error)
+        else:
+            outputs[conn.hostname] = "".join(conn.chunks)
+
+    while pending or active:
+        now = time.time()
+        while pending and len(active) < max_concurrent:
+            conn = _Connection(*pending.pop())
+            try:
+                conn.start(now)
+            except socket.error, e:
+                conn.close()
+                errors[conn.hostname] = conn.error_message(e)
+                continue
+            active[conn.sock.fileno()] = conn
+            poller.register(conn.sock, _POLL_WRITE | _POLL_ERROR)
+
+        if not active:
+            break
+
+        timeout = max(0, min([ c.deadline for c in active.values()
+                               if c.deadline is not None ] or [ now + 1 ]) - now)
+        try:
+            events = poller.poll(timeout * 1000)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd, event in events:
+            conn = active.get(fd)
+            if conn is None:
+                continue
+
+            if not conn.connected:
+                err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    finish(conn, socket.error(err, os.strerror(err)))
+                    continue
+                conn.connected = True
+                conn.deadline = read_timeout is not None and time.time() + read_timeout or None
+                poller.modify(fd, _POLL_READ | _POLL_ERROR)
+                continue
+
+            if event & (_POLL_READ | select.POLLHUP):
+                try:
+                    data = conn.sock.recv(65536)
+                except socket.error, e:
+                    if e.args[0] in [ errno.EAGAIN, errno.EINTR ]:
+                        continue
+                    finish(conn, e)
+                    continue
+
+                if data:
+                    conn.chunks.append(data)
+                else:
+                    finish(conn)
+
+            elif event & _POLL_ERROR:
+                finish(conn, "connection error")
+
+        now = time.time()
+        for conn in active.values():
+            if conn.deadline is not None and now >= conn.deadline:
+                finish(conn, "timed out")
+
+    return outputs, errors
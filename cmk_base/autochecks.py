@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Precompiled caches of the autochecks files
+
+The autochecks files (var/check_mk/autochecks/<host>.mk) are Python
+source files which are edited by WATO and remain the only source of
+truth. Evaluating them is slow, so each file is compiled once into a
+cache file (see cmk_base.cache_file) holding these blocks:
+
+    "key"      device, inode, size and mtime of the autochecks file
+    "entries"  the list of entries, if the file is a plain literal, or
+               the compiled code object evaluating to the list
+               (e.g. when parameters refer to default levels of checks)
+               or None, if the file cannot be compiled
+    "table"    the list of (check_type, item, paramstring) as needed
+               for rewriting the file or None, if the file cannot be
+               parsed line by line
+    "names"    the identifiers used in the file, for loading the check
+               plugins referenced by the file
+
+A cache is only used when the key matches the autochecks file. Since
+the autochecks are always replaced by renaming a new file, a changed
+file always results in a new key."""
+
+import ast
+import os
+import re
+
+import cmk_base.cache_file as cache_file
+
+_name_regex = re.compile("[A-Za-z][A-Za-z0-9_]*")
+
+
+class AutochecksLineError(Exception):
+    def __init__(self, lineno, reason):
+        super(AutochecksLineError, self).__init__("Invalid line %d: %s" % (lineno, reason))
+        self.lineno = lineno
+
+
+# Returns the key identifying the current version of a file. Raises
+# OSError if the file does not exist.
+def file_key(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime
+
+
+# Returns the cached blocks of the given names for an autochecks file.
+# The cache is created or updated if it is missing or outdated. Raises
+# OSError or IOError if the autochecks file does not exist.
+def load(path, cache_path, names):
+    return _load(path, cache_path, names)[1]
+
+
+def _load(path, cache_path, names):
+    key = file_key(path)
+    try:
+        blocks = cache_file.load_blocks(cache_path, [ "key" ] + names)
+        if blocks[0] == key:
+            return key, blocks[1:]
+    except (IOError, cache_file.MKCacheFormatError):
+        pass
+
+    blocks = compile_file(path, key)
+    try:
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        cache_file.save(cache_path, blocks.items())
+    except Exception:
+        pass # not writable, e.g. by the apache process. Just compile it again next time.
+    return key, [ blocks[name] for name in names ]
+
+
+# Reads the blocks of all autochecks files of a directory in one pass.
+# Returns a dictionary from the host name to the pair of the key and
+# the list of blocks. Files vanishing while reading are skipped.
+def load_all(directory, cache_dir, names):
+    result = {}
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        return result
+
+    for filename in filenames:
+        if not filename.endswith(".mk"):
+            continue
+        hostname = filename[:-3]
+        try:
+            result[hostname] = _load(directory + "/" + filename,
+                                     cache_dir + "/" + hostname, names)
+        except (IOError, OSError):
+            continue
+    return result
+
+
+# Computes all blocks of the cache of an autochecks file
+def compile_file(path, key):
+    source = open(path).read()
+
+    try:
+        entries = compile_entries(source, path)
+    except (SyntaxError, TypeError):
+        entries = None
+
+    try:
+        table = parse_table(source)
+    except AutochecksLineError:
+        table = None
+
+    return {
+        "key"     : key,
+        "entries" : entries,
+        "table"   : table,
+        "names"   : referenced_names(source),
+    }
+
+
+# Returns the entries of an autochecks file if the file is a plain literal,
+# which is true for nearly all files. Otherwise the compiled code is returned,
+# which needs to be evaluated in the context of the configuration.
+# Raises SyntaxError for invalid files.
+def compile_entries(source, path):
+    try:
+        return ast.literal_eval(source)
+    except (ValueError, SyntaxError, TypeError):
+        return compile(source, path, "eval")
+
+
+def referenced_names(source):
+    return sorted(set(_name_regex.findall(source)))
+
+
+# Parses the entries of an autochecks file line by line without evaluating
+# the parameters. Returns a list of (check_type, item, paramstring). Items
+# are returned as found in the file (str or unicode). Raises
+# AutochecksLineError for lines that cannot be parsed.
+def parse_table(source):
+    table = []
+    for lineno, line in enumerate(source.splitlines(), 1):
+        try:
+            line = line.strip()
+            if not line.startswith("("):
+                continue
+
+            # drop everything after potential '#' (from older versions)
+            i = line.rfind('#')
+            if i > 0: # make sure # is not contained in string
+                rest = line[i:]
+                if '"' not in rest and "'" not in rest:
+                    line = line[:i].strip()
+
+            if line.endswith(","):
+                line = line[:-1]
+            line = line[1:-1] # drop brackets
+
+            # First try old format - with hostname
+            parts = []
+            while line is not None:
+                part, line = _split_python_tuple(line)
+                parts.append(part)
+            if len(parts) == 4:
+                parts = parts[1:] # drop hostname, legacy format with host in first column
+            elif len(parts) != 3:
+                raise Exception("Invalid number of parts: %d (%r)" % (len(parts), parts))
+
+            checktypestring, itemstring, paramstring = parts
+            table.append((ast.literal_eval(checktypestring), ast.literal_eval(itemstring),
+                          paramstring))
+        except Exception, e:
+            raise AutochecksLineError(lineno, e)
+    return table
+
+
+# Splits off the first element of a comma separated list of Python
+# literals. Returns the element and the rest after the comma (or None).
+def _split_python_tuple(line):
+    quote = None
+    bracklev = 0
+    backslash = False
+    for i, c in enumerate(line):
+        if backslash:
+            backslash = False
+            continue
+        elif c == '\\':
+            backslash = True
+        elif c == quote:
+            quote = None # end of quoted string
+        elif c in [ '"', "'" ] and not quote:
+            quote = c # begin of quoted string
+        elif quote:
+            continue
+        elif c in [ '(', '{', '[' ]:
+            bracklev += 1
+        elif c in [ ')', '}', ']' ]:
+            bracklev -= 1
+        elif bracklev > 0:
+            continue
+        elif c == ',':
+            value = line[0:i]
+            rest = line[i+1:]
+            return value.strip(), rest
+
+    return line.strip(), None
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Binary format of cache files holding Python data structures
+
+A cache file starts with a fixed header, followed by an index and
+the data blocks:
+
+    "CMKCACHE", version (uint16), number of blocks (uint32)
+    per block: name length (uint16), name, offset (uint64), length (uint64)
+    the marshal encoded data blocks
+
+Offsets are relative to the start of the file. The index makes it
+possible to decode a single block of a file without touching the other
+blocks. Files are read via mmap, so only the pages really needed are
+read from disk. In contrast to the former repr()/eval() based files no
+code is executed while loading a cache file."""
+
+import marshal
+import mmap
+import os
+import struct
+
+import cmk.store as store
+from cmk.exceptions import MKGeneralException
+
+MAGIC           = "CMKCACHE"
+VERSION         = 1
+MARSHAL_VERSION = 2
+
+_header_struct  = struct.Struct("!8sHI")
+_name_struct    = struct.Struct("!H")
+_entry_struct   = struct.Struct("!QQ")
+
+
+class MKCacheFormatError(MKGeneralException):
+    pass
+
+
+# Encodes the given list of pairs (name, data) into a cache file
+def dumps(blocks):
+    encoded = [ (name, marshal.dumps(data, MARSHAL_VERSION)) for name, data in blocks ]
+
+    index_size = sum([ _name_struct.size + len(name) + _entry_struct.size
+                       for name, _unused_data in encoded ])
+    offset = _header_struct.size + index_size
+
+    parts = [ _header_struct.pack(MAGIC, VERSION, len(encoded)) ]
+    for name, data in encoded:
+        parts.append(_name_struct.pack(len(name)))
+        parts.append(name)
+        parts.append(_entry_struct.pack(offset, len(data)))
+        offset += len(data)
+
+    parts += [ data for _unused_name, data in encoded ]
+    return "".join(parts)
+
+
+# Returns the index of a cache file as dictionary from the name of
+# a block to the pair (offset, length). The data may be a string
+# or an mmap object.
+def read_index(data):
+    if len(data) < _header_struct.size:
+        raise MKCacheFormatError("Invalid cache file: too short")
+
+    magic, version, num_blocks = _header_struct.unpack(data[:_header_struct.size])
+    if magic != MAGIC:
+        raise MKCacheFormatError("Invalid cache file: unknown format")
+    elif version != VERSION:
+        raise MKCacheFormatError("Unsupported cache file version %d" % version)
+
+    index = {}
+    pos = _header_struct.size
+    try:
+        for _unused_nr in range(num_blocks):
+            name_len = _name_struct.unpack(data[pos:pos + _name_struct.size])[0]
+            pos += _name_struct.size
+            name = data[pos:pos + name_len]
+            pos += name_len
+            offset, length = _entry_struct.unpack(data[pos:pos + _entry_struct.size])
+            pos += _entry_struct.size
+            if offset + length > len(data):
+                raise MKCacheFormatError("Invalid cache file: block %s is truncated" % name)
+            index[name] = offset, length
+    except struct.error, e:
+        raise MKCacheFormatError("Invalid cache file index: %s" % e)
+
+    return index
+
+
+# Decodes one block of a cache file. If name is None, all blocks are
+# decoded and returned as dictionary.
+def loads(data, name=None):
+    index = read_index(data)
+    try:
+        if name is not None:
+            if name not in index:
+                raise MKCacheFormatError("Missing block %s in cache file" % name)
+            offset, length = index[name]
+            return marshal.loads(data[offset:offset + length])
+
+        blocks = {}
+        for block_name, (offset, length) in index.items():
+            blocks[block_name] = marshal.loads(data[offset:offset + length])
+        return blocks
+    except (ValueError, EOFError, TypeError), e:
+        raise MKCacheFormatError("Invalid cache file data: %s" % e)
+
+
+# Reads one block (or all blocks if name is None) from a cache file.
+# Raises IOError if the file does not exist.
+def load(path, name=None):
+    return load_mapped(path, lambda data: loads(data, name))
+
+
+# Reads the given blocks from a cache file and returns them as list
+# in the order of the names
+def load_blocks(path, names):
+    def decode(data):
+        index = read_index(data)
+        blocks = []
+        for name in names:
+            if name not in index:
+                raise MKCacheFormatError("Missing block %s in cache file" % name)
+            offset, length = index[name]
+            try:
+                blocks.append(marshal.loads(data[offset:offset + length]))
+            except (ValueError, EOFError, TypeError), e:
+                raise MKCacheFormatError("Invalid cache file data: %s" % e)
+        return blocks
+
+    return load_mapped(path, decode)
+
+
+# Calls the decode function with the content of the cache file mapped to
+# memory and returns its result. The mapping is only valid during the call.
+def load_mapped(path, decode):
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise MKCacheFormatError("Invalid cache file: empty")
+
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            return decode(data)
+        finally:
+            data.close()
+    finally:
+        f.close()
+
+
+# Atomically replaces the cache file with the given blocks
+def save(path, blocks):
+    store.save_file(path, dumps(blocks))
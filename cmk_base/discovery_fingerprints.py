@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Reuse of discovery results for unchanged sections
+
+The periodic discovery check discovers all services of a host again,
+although the agent sections are nearly always the same as last time.
+For each check type the result of the discovery is stored together with
+a fingerprint of the sections it has been computed from. As long as the
+fingerprint is unchanged, the stored result is used instead of calling
+the parse and discovery functions again.
+
+The stored results of a host are kept in a cache file (see
+cmk_base.cache_file) with these blocks:
+
+    "config"   digest of the configuration and the check plugins the
+               results have been computed with
+    "results"  dictionary from the check type to the pair of the
+               fingerprint of the sections and the discovered services"""
+
+import hashlib
+import marshal
+
+import cmk_base.cache_file as cache_file
+
+
+# Returns the fingerprint of the info of the given sections. The sections
+# are given as list of pairs of the section name and the info of the
+# section as returned by get_realhost_info().
+def fingerprint(sections):
+    digest = hashlib.md5()
+    for section_name, info in sections:
+        digest.update(section_name)
+        digest.update("\0")
+        try:
+            digest.update(marshal.dumps(info))
+        except ValueError: # info containing objects marshal cannot encode
+            digest.update(repr(info))
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+# Returns the results stored for a host, if they have been computed with
+# the current configuration. Otherwise no results are returned.
+def load(path, config_digest):
+    try:
+        stored_digest, results = cache_file.load_blocks(path, [ "config", "results" ])
+    except (IOError, cache_file.MKCacheFormatError):
+        return {}
+
+    if stored_digest != config_digest:
+        return {}
+    return results
+
+
+def save(path, config_digest, results):
+    cache_file.save(path, [ ("config", config_digest), ("results", results) ])
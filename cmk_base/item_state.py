@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Persisted item states (counters) of a host
+
+The item states of a host are stored in a log file of binary records:
+
+    "CMKSTATE", version (uint16)
+    per record: type (uint8), length of the payload (uint32), payload
+
+A record either sets the state of a key (payload: the marshal encoded
+pair of key and state, or the pickled pair for states marshal cannot
+encode) or deletes a key (payload: the marshal encoded key). Loading
+the file replays the records in order.
+
+Saving only appends the records of the changed and deleted keys. When
+the log has grown much larger than the states it holds, it is compacted
+by writing a new file with one record per key and renaming it over the
+old one. A record truncated by a crash while appending is ignored on
+loading and removed by the next compaction.
+
+Files of the former format, the repr() of the dictionary of states, are
+still read and are replaced by the new format on the next save."""
+
+import ast
+import cPickle
+import marshal
+import os
+import struct
+import tempfile
+
+MAGIC           = "CMKSTATE"
+VERSION         = 1
+MARSHAL_VERSION = 2
+
+SET         = 1
+SET_PICKLED = 2
+DELETE      = 3
+
+_header_struct = struct.Struct("!8sH")
+_record_struct = struct.Struct("!BI")
+
+# The log is compacted when it is larger than this factor times the size
+# of the states it holds (plus some slack for small files)
+COMPACTION_FACTOR = 2
+COMPACTION_SLACK  = 4096
+
+
+def _encode_record(record_type, payload):
+    return _record_struct.pack(record_type, len(payload)) + payload
+
+
+def encode_state(key, state):
+    try:
+        return _encode_record(SET, marshal.dumps((key, state), MARSHAL_VERSION))
+    except ValueError:
+        return _encode_record(SET_PICKLED, cPickle.dumps((key, state), 2))
+
+
+def encode_delete(key):
+    return _encode_record(DELETE, marshal.dumps(key, MARSHAL_VERSION))
+
+
+# Decodes the records of a log file. Returns the dictionary of the states,
+# the dictionary from the keys to their encoded records and the size of
+# the valid part of the data.
+def decode_log(data):
+    states, records = {}, {}
+    pos = _header_struct.size
+    while pos + _record_struct.size <= len(data):
+        record_type, length = _record_struct.unpack_from(data, pos)
+        end = pos + _record_struct.size + length
+        if end > len(data):
+            break # truncated record
+
+        payload = data[pos + _record_struct.size:end]
+        try:
+            if record_type in [ SET, SET_PICKLED ]:
+                key, state = record_type == SET and marshal.loads(payload) \
+                                                 or cPickle.loads(payload)
+                states[key] = state
+                records[key] = data[pos:end]
+            elif record_type == DELETE:
+                key = marshal.loads(payload)
+                states.pop(key, None)
+                records.pop(key, None)
+            else:
+                break
+        except Exception:
+            break # garbage, e.g. from an incomplete write
+
+        pos = end
+    return states, records, pos
+
+
+class ItemStateFile(object):
+    def __init__(self, path):
+        self.path     = path
+        self._records = {}   # key -> encoded record, as found in the file
+        self._size    = None # size of the file, None if it needs to be rewritten
+        self._inode   = None
+
+
+    # Returns the dictionary of the item states stored in the file
+    def load(self):
+        self._records, self._size = {}, None
+        try:
+            f = open(self.path, "rb")
+            self._inode = os.fstat(f.fileno()).st_ino
+            data = f.read()
+            f.close()
+        except (IOError, OSError):
+            return {}
+
+        if data.startswith(MAGIC):
+            if _header_struct.unpack_from(data)[1] != VERSION:
+                return {}
+            states, self._records, valid_size = decode_log(data)
+            if valid_size == len(data):
+                self._size = valid_size
+            return states
+
+        try:
+            states = ast.literal_eval(data)
+            if type(states) != dict:
+                return {}
+        except Exception:
+            return {}
+        self._records = dict([ (key, encode_state(key, state))
+                               for key, state in states.iteritems() ])
+        return states
+
+
+    # Writes the changes of the given item states compared to the states
+    # loaded or saved last
+    def save(self, states):
+        records = {}
+        changes = []
+        for key, state in states.iteritems():
+            record = encode_state(key, state)
+            records[key] = record
+            if self._records.get(key) != record:
+                changes.append(record)
+
+        for key in self._records:
+            if key not in states:
+                changes.append(encode_delete(key))
+
+        states_size = sum(map(len, records.itervalues()))
+        if self._size is None \
+           or self._size + sum(map(len, changes)) > COMPACTION_FACTOR * states_size + COMPACTION_SLACK \
+           or not self._append(changes):
+            self._rewrite(records.values())
+            self._size = _header_struct.size + states_size
+            self._inode = os.stat(self.path).st_ino
+
+        self._records = records
+
+
+    # Appends the records to the file, if the file is still the one
+    # loaded or saved last
+    def _append(self, changes):
+        if not changes:
+            return True
+
+        data = "".join(changes)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            return False
+
+        try:
+            st = os.fstat(fd)
+            if st.st_ino != self._inode or st.st_size != self._size:
+                return False
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+
+        self._size += len(data)
+        return True
+
+
+    def _rewrite(self, records):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                        prefix=".%s.new" % os.path.basename(self.path))
+        try:
+            os.chmod(tmp_path, 0660)
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(_header_struct.pack(MAGIC, VERSION) + "".join(records))
+            finally:
+                f.close()
+            os.rename(tmp_path, self.path)
+        except:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
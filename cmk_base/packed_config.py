@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Packed configuration of the Check_MK helper processes
+
+The configuration variables needed by the helpers are packed into a
+cache file (see cmk_base.cache_file) holding one marshalled block per
+variable. Loading the configuration therefore only unmarshals data
+instead of executing a huge generated Python module which builds every
+dict and list item by item.
+
+Values marshal can not handle (e.g. instances of dict subclasses) are
+stored as Python source compiled into the block "__source__", which is
+executed after the other variables have been set. The block "__deleted__"
+lists variables which need to be removed from the namespace.
+
+The checksums of the loaded blocks are returned to the caller. When
+they are handed over on the next load, variables which did not change
+since then are not decoded again. A helper reloading its configuration
+after a configuration change only pays for the changed variables."""
+
+import marshal
+import zlib
+
+import cmk_base.cache_file as cache_file
+
+SOURCE_BLOCK  = "__source__"
+DELETED_BLOCK = "__deleted__"
+
+
+def is_marshallable(value):
+    try:
+        marshal.dumps(value, cache_file.MARSHAL_VERSION)
+        return True
+    except ValueError:
+        return False
+
+
+# Writes the given variables (list of pairs of name and value) to a packed
+# config file. The variables listed in deleted are removed on loading.
+def save(path, variables, deleted):
+    blocks, source = [], []
+    for varname, value in variables:
+        if is_marshallable(value):
+            blocks.append((varname, value))
+        else:
+            source.append("%s = %r\n" % (varname, value))
+
+    blocks.append((DELETED_BLOCK, list(deleted)))
+    blocks.append((SOURCE_BLOCK, compile("".join(source), "<packed config>", "exec")))
+    cache_file.save(path, blocks)
+
+
+# Loads the variables of a packed config file into the given namespace and
+# returns a dict of the checksums of the loaded variables. Variables having
+# the same checksum in known_checksums and already existing in the namespace
+# are left untouched. When varnames is given, only these variables are
+# loaded and the deleted and source blocks are not processed.
+def load(path, namespace, known_checksums=None, varnames=None):
+    known_checksums = known_checksums or {}
+
+    def decode(data):
+        index = cache_file.read_index(data)
+        if SOURCE_BLOCK not in index or DELETED_BLOCK not in index:
+            raise cache_file.MKCacheFormatError("Invalid packed config: %s" % path)
+
+        checksums = {}
+        try:
+            for varname, (offset, length) in index.items():
+                if varname in [ SOURCE_BLOCK, DELETED_BLOCK ] \
+                   or (varnames is not None and varname not in varnames):
+                    continue
+
+                raw = data[offset:offset + length]
+                checksum = zlib.crc32(raw)
+                checksums[varname] = checksum
+                if known_checksums.get(varname) != checksum or varname not in namespace:
+                    namespace[varname] = marshal.loads(raw)
+
+            if varnames is None:
+                offset, length = index[DELETED_BLOCK]
+                for varname in marshal.loads(data[offset:offset + length]):
+                    namespace.pop(varname, None)
+
+                offset, length = index[SOURCE_BLOCK]
+                source_code = marshal.loads(data[offset:offset + length])
+        except (ValueError, EOFError, TypeError), e:
+            raise cache_file.MKCacheFormatError("Invalid packed config data: %s" % e)
+
+        if varnames is None:
+            exec source_code in namespace
+        return checksums
+
+    return cache_file.load_mapped(path, decode)
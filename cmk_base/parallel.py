@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Distribution of work across forked worker processes
+
+The items to process are split into contiguous shards, one per worker.
+Each worker is forked from the calling process, so it inherits the
+loaded configuration and needs no initialization of its own. The
+workers send their results back pickled through a pipe. The results
+are returned in the order of the shards, which makes merging them
+independent of the order the workers finish in.
+
+Exceptions raised by a worker (including SystemExit) are raised again
+in the calling process. Exceptions which can not be transferred are
+raised as MKGeneralException with the same message."""
+
+import cPickle
+import os
+import select
+import sys
+
+from cmk.exceptions import MKGeneralException
+
+
+# Splits the items into at most num_shards contiguous shards of nearly
+# the same size
+def shards(items, num_shards):
+    items = list(items)
+    num_shards = max(1, min(num_shards, len(items)))
+    size, rest = divmod(len(items), num_shards)
+    result, start = [], 0
+    for nr in range(num_shards):
+        end = start + size + (nr < rest and 1 or 0)
+        result.append(items[start:end])
+        start = end
+    return result
+
+
+# Calls func with each shard of the items and returns the list of the
+# results. With num_processes > 1 the shards are processed in parallel
+# by forked worker processes, otherwise in the current process.
+def map_shards(func, items, num_processes):
+    the_shards = shards(items, num_processes)
+    if num_processes <= 1 or len(the_shards) <= 1:
+        return [ func(shard) for shard in the_shards ]
+
+    # Prevent output buffered before forking from being written twice
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    workers = []
+    try:
+        for shard in the_shards:
+            workers.append(_start_worker(func, shard))
+        outputs = _read_outputs([ fd for _unused_pid, fd in workers ])
+    finally:
+        for pid, fd in workers:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+            os.waitpid(pid, 0)
+
+    results = []
+    for output in outputs:
+        try:
+            success, result = cPickle.loads(output)
+        except Exception, e:
+            raise MKGeneralException("Invalid result of worker process: %s" % e)
+        if not success:
+            if type(result) in [ str, unicode ]:
+                raise MKGeneralException(result)
+            raise result
+        results.append(result)
+    return results
+
+
+def _start_worker(func, shard):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        return pid, read_fd
+
+    # Worker process: never return to the caller
+    try:
+        os.close(read_fd)
+        try:
+            output = cPickle.dumps((True, func(shard)), cPickle.HIGHEST_PROTOCOL)
+        except (Exception, SystemExit), e:
+            # Not all exceptions can be unpickled, e.g. when their
+            # constructor needs other arguments than they store
+            try:
+                output = cPickle.dumps((False, e), cPickle.HIGHEST_PROTOCOL)
+                cPickle.loads(output)
+            except Exception:
+                output = cPickle.dumps((False, "%s" % e), cPickle.HIGHEST_PROTOCOL)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        while output:
+            written = os.write(write_fd, output)
+            output = output[written:]
+    finally:
+        os._exit(0)
+
+
+# Reads the pipes of all workers in parallel. A worker blocks while
+# its pipe is full, so they can not be read one after another.
+def _read_outputs(fds):
+    chunks = dict([ (fd, []) for fd in fds ])
+    open_fds = list(fds)
+    while open_fds:
+        readable = select.select(open_fds, [], [])[0]
+        for fd in readable:
+            chunk = os.read(fd, 65536)
+            if chunk:
+                chunks[fd].append(chunk)
+            else:
+                open_fds.remove(fd)
+    return [ "".join(chunks[fd]) for fd in fds ]
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Concurrent execution of the commands of the parent scan
+
+The parent scan runs a traceroute for each host and then pings the
+gateways found, one after the other, until a reachable one is found.
+Each host is scanned by a task: a generator yielding the command lines
+to execute (as lists of arguments). The generator receives the pair of
+the exit code and the output of each command.
+
+All tasks are driven by one poll() loop which runs up to max_concurrent
+commands at the same time. Commands are only executed once per run:
+Tasks yielding a command already executed (or being executed) get the
+same result. This way a gateway shared by many hosts, e.g. of the same
+subnet, is only pinged once."""
+
+import collections
+import errno
+import os
+import select
+import socket
+import subprocess
+import threading
+
+_POLL_READ = select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP
+
+_START = object()
+
+
+class _Process(object):
+    def __init__(self, command):
+        self.command = command
+        self.chunks  = []
+        devnull = open(os.devnull)
+        try:
+            self._proc = subprocess.Popen(command, stdin=devnull, stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT, close_fds=True)
+        finally:
+            devnull.close()
+
+
+    def fileno(self):
+        return self._proc.stdout.fileno()
+
+
+    def read(self):
+        try:
+            data = os.read(self.fileno(), 65536)
+        except OSError, e:
+            if e.errno in [ errno.EAGAIN, errno.EINTR ]:
+                return True
+            raise
+
+        if data:
+            self.chunks.append(data)
+            return True
+        return False
+
+
+    def result(self):
+        self._proc.stdout.close()
+        return self._proc.wait(), "".join(self.chunks)
+
+
+    def kill(self):
+        try:
+            self._proc.kill()
+            self._proc.wait()
+        except OSError:
+            pass
+
+
+# Runs the given tasks until all of them are finished. Commands which
+# cannot be executed at all result in the exit code 127 and the error
+# message as output, just like when executed by a shell.
+def run_tasks(tasks, max_concurrent=50):
+    max_concurrent = max(1, max_concurrent)
+    results = {} # command -> (exit code, output)
+    waiting = {} # command -> tasks waiting for the result
+    queue   = collections.deque() # commands not started yet
+    running = {} # fd -> _Process
+    poller  = select.poll()
+
+    # Runs the task until it yields a command whose result is not known yet
+    def advance(task, result):
+        while True:
+            try:
+                if result is _START:
+                    command = task.next()
+                else:
+                    command = task.send(result)
+            except StopIteration:
+                return
+
+            key = tuple(command)
+            if key in results:
+                result = results[key]
+                continue
+
+            if key not in waiting:
+                waiting[key] = []
+                queue.append(key)
+            waiting[key].append(task)
+            return
+
+    def finish(key, result):
+        results[key] = result
+        for task in waiting.pop(key):
+            advance(task, result)
+
+    try:
+        for task in tasks:
+            advance(task, _START)
+
+        while queue or running:
+            while queue and len(running) < max_concurrent:
+                key = queue.popleft()
+                try:
+                    process = _Process(list(key))
+                except OSError, e:
+                    finish(key, (127, "%s: %s\n" % (key[0], e.strerror)))
+                    continue
+                running[process.fileno()] = process
+                poller.register(process.fileno(), _POLL_READ)
+
+            if not running:
+                continue
+
+            try:
+                events = poller.poll()
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, _unused_event in events:
+                process = running[fd]
+                if not process.read():
+                    poller.unregister(fd)
+                    del running[fd]
+                    finish(tuple(process.command), process.result())
+    finally:
+        for process in running.values():
+            process.kill()
+
+
+# Looks up the DNS names of the given IP addresses concurrently. Returns
+# a dictionary from the IP address to the name or None, if the address
+# cannot be resolved.
+def reverse_lookups(ipaddresses, max_concurrent=50):
+    names = {}
+    pending = list(set(ipaddresses))
+    lock = threading.Lock()
+
+    def resolve():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                ipaddress = pending.pop()
+
+            try:
+                names[ipaddress] = socket.gethostbyaddr(ipaddress)[0]
+            except Exception:
+                names[ipaddress] = None
+
+    threads = [ threading.Thread(target=resolve)
+                for _unused_nr in range(min(max(1, max_concurrent), len(pending))) ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return names
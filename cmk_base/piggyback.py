@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Store of the piggyback data with indexes
+
+The piggyback data a source host delivers for a backed host is stored in
+<piggyback_dir>/<backedhost>/<sourcehost> as before. To avoid listing
+and stat()ing these directories, two kinds of index files are kept:
+
+    <sources_dir>/<sourcehost>         one line "<backedhost> <timestamp>"
+                                       per host the source delivered data
+                                       for during its last run
+    <piggyback_dir>/<backedhost>/.index  one line per source host having
+                                       data for the backed host
+
+The source index is rewritten by each run of the source host. The index
+of a backed host only changes when a source starts or stops delivering
+data for it or when outdated data is removed. It is updated under a lock
+(the file .index.lock next to it), since several source hosts may deliver
+data for the same backed host. All files are replaced atomically by
+renaming, so reading them needs no lock.
+
+Data stored by versions without indexes is still found: When a backed
+host has no index, its directory is scanned once and the index is
+created. When a source host has no index, the age of the data is taken
+from the data file."""
+
+import os
+import tempfile
+import time
+
+import cmk.store
+
+INDEX_NAME = ".index"
+LOCK_NAME  = ".index.lock"
+
+
+def _save(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=".%s.new" % os.path.basename(path))
+    try:
+        os.write(fd, content)
+        os.close(fd)
+        os.chmod(tmp_path, 0660)
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _read_lines(path):
+    try:
+        return file(path).read().splitlines()
+    except IOError, e:
+        if e.errno == 2: # No such file or directory
+            return None
+        raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+class PiggybackStore(object):
+    def __init__(self, piggyback_dir, sources_dir):
+        self.piggyback_dir  = piggyback_dir
+        self.sources_dir    = sources_dir
+        self._source_index  = {}
+
+
+    def _backed_dir(self, backedhost):
+        return "%s/%s" % (self.piggyback_dir, backedhost)
+
+
+    def _index_path(self, backedhost):
+        return "%s/%s/%s" % (self.piggyback_dir, backedhost, INDEX_NAME)
+
+
+    def _source_index_path(self, sourcehost):
+        return "%s/%s" % (self.sources_dir, sourcehost)
+
+
+    # Returns a dictionary of the backed hosts of the last run of the
+    # source host and the time of their data or None, if the source
+    # host has no index (yet). Cached, since many backed hosts usually
+    # share a few source hosts.
+    def source_index(self, sourcehost):
+        try:
+            return self._source_index[sourcehost]
+        except KeyError:
+            pass
+
+        lines = _read_lines(self._source_index_path(sourcehost))
+        if lines is None:
+            index = None
+        else:
+            index = {}
+            for line in lines:
+                backedhost, timestamp = line.rsplit(" ", 1)
+                index[backedhost] = int(timestamp)
+
+        self._source_index[sourcehost] = index
+        return index
+
+
+    def _save_source_index(self, sourcehost, index):
+        if not os.path.exists(self.sources_dir):
+            os.makedirs(self.sources_dir)
+        _save(self._source_index_path(sourcehost),
+              "".join([ "%s %d\n" % entry for entry in sorted(index.items()) ]))
+        self._source_index[sourcehost] = index
+
+
+    # Returns the list of source hosts having data for the backed host
+    def sources_of(self, backedhost):
+        sources = _read_lines(self._index_path(backedhost))
+        if sources is not None:
+            return sources
+
+        # Backed host without index: Data of an old version or no data
+        if not os.path.exists(self._backed_dir(backedhost)):
+            return []
+        return self._update_sources(backedhost)
+
+
+    # Changes the index of the backed host under a lock. Without changes
+    # given, the index is created from the directory.
+    def _update_sources(self, backedhost, add=None, remove=None):
+        path = self._index_path(backedhost)
+        lock_path = "%s/%s" % (self._backed_dir(backedhost), LOCK_NAME)
+        cmk.store.aquire_lock(lock_path)
+        try:
+            sources = _read_lines(path) or []
+            if add is None and remove is None:
+                sources = [ f for f in os.listdir(self._backed_dir(backedhost))
+                            if not f.startswith(".") ]
+            else:
+                sources = [ s for s in sources if s != add and s != remove ]
+                if add:
+                    sources.append(add)
+
+            if sources:
+                _save(path, "".join([ "%s\n" % s for s in sorted(sources) ]))
+            else:
+                _remove(path)
+                _remove(lock_path)
+                try:
+                    os.rmdir(self._backed_dir(backedhost))
+                except OSError:
+                    pass
+        finally:
+            cmk.store.release_lock(lock_path)
+        return sources
+
+
+    # Returns the age in seconds of the data of the source host for the
+    # backed host or None, if there is no such data
+    def _age(self, sourcehost, backedhost, now):
+        index = self.source_index(sourcehost)
+        if index is not None:
+            if backedhost not in index:
+                return None
+            return now - index[backedhost]
+
+        try:
+            return now - os.stat("%s/%s" % (self._backed_dir(backedhost), sourcehost)).st_mtime
+        except OSError:
+            return None
+
+
+    # Returns the pairs of source host and path of the piggyback files of
+    # the backed host not older than max_age and the triples of source
+    # host, path and seconds outdated of the older ones
+    def files_of(self, backedhost, max_age):
+        now = time.time()
+        files, outdated = [], []
+        for sourcehost in self.sources_of(backedhost):
+            age = self._age(sourcehost, backedhost, now)
+            if age is None:
+                continue
+            path = "%s/%s" % (self._backed_dir(backedhost), sourcehost)
+            if age > max_age:
+                outdated.append((sourcehost, path, age - max_age))
+            else:
+                files.append((sourcehost, path))
+        return files, outdated
+
+
+    # Removes an outdated piggyback file and its index entry
+    def remove_file(self, backedhost, sourcehost):
+        _remove("%s/%s" % (self._backed_dir(backedhost), sourcehost))
+        self._update_sources(backedhost, remove=sourcehost)
+
+
+    # Stores the piggyback data of one run of the source host. piggybacked
+    # is a dictionary of backed host to its lines. Returns the number of
+    # files removed of backed hosts not contained anymore.
+    def store(self, sourcehost, piggybacked):
+        previous = self.source_index(sourcehost)
+        now = int(time.time())
+
+        for backedhost, lines in piggybacked.items():
+            backed_dir = self._backed_dir(backedhost)
+            if not os.path.exists(backed_dir):
+                os.makedirs(backed_dir)
+            _save("%s/%s" % (backed_dir, sourcehost), "".join([ "%s\n" % l for l in lines ]))
+            # Not only checked against the source index: The source may
+            # have been removed from the index while its data was outdated
+            if sourcehost not in (_read_lines(self._index_path(backedhost)) or []):
+                self._update_sources(backedhost, add=sourcehost)
+
+        self._save_source_index(sourcehost, dict([ (b, now) for b in piggybacked ]))
+        return self._remove_stale(sourcehost, previous, piggybacked)
+
+
+    # Removes all piggyback data delivered by the source host. Returns
+    # the number of files removed.
+    def remove_source(self, sourcehost):
+        previous = self.source_index(sourcehost)
+        removed = self._remove_stale(sourcehost, previous, {})
+        _remove(self._source_index_path(sourcehost))
+        self._source_index[sourcehost] = None
+        return removed
+
+
+    def _remove_stale(self, sourcehost, previous, keep):
+        if previous is None:
+            # Source without index: Find its files the hard way, once
+            if os.path.exists(self.piggyback_dir):
+                backedhosts = os.listdir(self.piggyback_dir)
+            else:
+                backedhosts = []
+        else:
+            backedhosts = previous.keys()
+
+        removed = 0
+        for backedhost in backedhosts:
+            if backedhost in keep:
+                continue
+            if _remove("%s/%s" % (self._backed_dir(backedhost), sourcehost)):
+                removed += 1
+            if os.path.exists(self._index_path(backedhost)):
+                self._update_sources(backedhost, remove=sourcehost)
+            else:
+                try:
+                    os.rmdir(self._backed_dir(backedhost))
+                except OSError:
+                    pass
+        return removed
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Shared bytecode bundle for precompiled host checks
+
+Normally each precompiled host check contains the source code of the
+Check_MK base modules and of all check plugins needed by the host.
+Alternatively these files can be compiled once into a bundle shared by
+all precompiled host checks. The bundle is a cache file (see
+cmk_base.cache_file) holding the marshalled code object of each source
+file, named by the path of the file. A host check only executes the code
+objects of the files it needs. The bundle is read via mmap, so all host
+checks share its pages in the page cache.
+
+The name of the bundle is a hash of the Check_MK and Python versions and
+of the source files. A bundle is therefore never changed after it has
+been written."""
+
+import hashlib
+import sys
+
+import cmk
+import cmk_base.cache_file as cache_file
+
+
+def bundle_id(filenames):
+    digest = hashlib.md5()
+    digest.update("%s\0%s\0" % (cmk.__version__, sys.version))
+    for filename in filenames:
+        digest.update("%s\0%s\0" % (filename, file(filename).read()))
+    return digest.hexdigest()
+
+
+# Compiles the given source files into a bundle file
+def build(path, filenames):
+    blocks = []
+    for filename in filenames:
+        source = file(filename).read()
+        blocks.append((filename, compile(source + "\n", filename, "exec")))
+    cache_file.save(path, blocks)
+
+
+# Executes the code of the given source files in the namespace. This
+# is what precompiled host checks do instead of containing the code.
+def execute(path, filenames, namespace):
+    for code in cache_file.load_blocks(path, filenames):
+        exec code in namespace
@@ -24,9 +24,18 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
-"""Code for predictive monitoring / anomaly detection"""
+"""Code for predictive monitoring / anomaly detection
+
+The prediction of a time group is stored in a binary file: a header
+(MAGIC, VERSION, number of points, step) followed by one record per
+point with the columns average, min, max and stdev as doubles. Points
+without data are stored as NaN. get_levels() only reads the record of
+the current point. Keep the reader in web/htdocs/prediction.py in sync.
+
+The slices are consolidated column-wise with NumPy, if available."""
 
 import os
+import struct
 import time
 import math
 
@@ -34,6 +43,7 @@ import livestatus
 
 import cmk.paths
 import cmk.debug
+import cmk.store
 
 from cmk.exceptions import MKGeneralException
 
@@ -45,29 +55,90 @@ logger = cmk.log.get_logger(__name__)
 # TODO: IMPORTANT: Until we have a central library, keep this function in sync with
 # the function get_rrd_data() from web/prediction.py.
 def get_rrd_data(hostname, service_description, varname, cf, fromtime, untiltime):
+    return fetch_rrd_data(hostname, service_description,
+                          [ (varname, cf, fromtime, untiltime) ])[0]
+
+
+# The connection to Livestatus is kept open for all queries of the process
+g_livestatus_connection = None
+
+def livestatus_connection():
+    global g_livestatus_connection
+    if g_livestatus_connection is None:
+        g_livestatus_connection = livestatus.SingleSiteConnection(
+                    "unix:%s" % cmk.paths.livestatus_unix_socket, persist=True)
+    return g_livestatus_connection
+
+
+# Fetch the RRD historic metrics data of several time ranges and metrics
+# of a service with a single query. queries is a list of (varname, cf,
+# fromtime, untiltime). Returns the list of (step, [value1, value2, ...])
+# in the same order.
+def fetch_rrd_data(hostname, service_description, queries):
     step = 1
-    rpn = "%s.%s" % (varname, cf.lower()) # "MAX" -> "max"
+    columns = []
+    for nr, (varname, cf, fromtime, untiltime) in enumerate(queries):
+        rpn = "%s.%s" % (varname, cf.lower()) # "MAX" -> "max"
+        columns.append("rrddata:m%d:%s:%d:%d:%d" % (nr + 1, rpn, fromtime, untiltime, step))
 
     lql = "GET services\n" \
-          "Columns: rrddata:m1:%s:%d:%d:%d\n" \
+          "Columns: %s\n" \
           "OutputFormat: python\n" \
           "Filter: host_name = %s\n" \
           "Filter: description = %s\n" % (
-             rpn, fromtime, untiltime, step, hostname, service_description)
+             " ".join(columns), hostname, service_description)
 
     try:
-        connection = livestatus.SingleSiteConnection("unix:%s" % cmk.paths.livestatus_unix_socket)
-        response = connection.query_value(lql)
+        row = livestatus_connection().query_row(lql)
     except Exception, e:
         if cmk.debug.enabled():
             raise
         raise MKGeneralException("Cannot get historic metrics via Livestatus: %s" % e)
 
-    if not response:
-        raise MKGeneralException("Got no historic metrics")
-
-    step, values = response[2], response[3:]
-    return step, values
+    results = []
+    for response in row:
+        if not response:
+            raise MKGeneralException("Got no historic metrics")
+        results.append((response[2], response[3:]))
+    return results
+
+
+# The historic metrics data fetched for computing predictions. Only the
+# data of the service currently being checked is kept, since the
+# predictions of all metrics of a service are usually computed one after
+# the other.
+g_rrd_data_cache         = {} # (varname, cf, fromtime, untiltime) -> (step, values)
+g_rrd_data_cache_service = None
+
+# Returns the data of the metric for the given time ranges. The data of
+# the metrics in prefetch_dsnames for the same time ranges is fetched
+# with the same query and cached for their predictions.
+def get_rrd_data_of_ranges(hostname, service_description, dsname, cf, ranges,
+                           prefetch_dsnames=()):
+    global g_rrd_data_cache_service
+    if g_rrd_data_cache_service != (hostname, service_description):
+        g_rrd_data_cache.clear()
+        g_rrd_data_cache_service = (hostname, service_description)
+
+    missing = [ (dsname, cf, fromtime, untiltime) for fromtime, untiltime in ranges
+                if (dsname, cf, fromtime, untiltime) not in g_rrd_data_cache ]
+    if missing:
+        prefetch = [ (varname, cf, fromtime, untiltime)
+                     for varname in prefetch_dsnames
+                     for fromtime, untiltime in ranges
+                     if (varname, cf, fromtime, untiltime) not in g_rrd_data_cache ]
+        try:
+            results = fetch_rrd_data(hostname, service_description, missing + prefetch)
+            g_rrd_data_cache.update(zip(missing + prefetch, results))
+        except MKGeneralException:
+            if not prefetch:
+                raise
+            # Maybe one of the other metrics does not exist anymore
+            g_rrd_data_cache.update(zip(missing,
+                                        fetch_rrd_data(hostname, service_description, missing)))
+
+    return [ g_rrd_data_cache[(dsname, cf, fromtime, untiltime)]
+             for fromtime, untiltime in ranges ]
 
 
 daynames = [ "monday", "tuesday", "wednesday", "thursday",
@@ -133,11 +204,12 @@ def get_prediction_timegroup(t, period_info):
     return timegroup, from_time, until_time, rel_time
 
 
-def compute_prediction(hostname, service_description, pred_file, timegroup, params, period_info, from_time, dsname, cf):
+def compute_prediction(hostname, service_description, pred_file, timegroup, params, period_info, from_time, dsname, cf,
+                       prefetch_dsnames=()):
     # Collect all slices back into the past until the time horizon
     # is reached
     begin = from_time
-    slices = []
+    ranges = []
     absolute_begin = from_time - params["horizon"] * 86400
 
     # The resolutions of the different time ranges differ. We interpolate
@@ -149,54 +221,235 @@ def compute_prediction(hostname, service_description, pred_file, timegroup, para
     # DST and non-DST during are computation. We need to compensate for
     # those. DST swaps within slices are being ignored. The DST flag
     # is checked against the beginning of the slice.
-    smallest_step = None
     while begin >= absolute_begin:
         tg, fr, un = get_prediction_timegroup(begin, period_info)[:3]
         if tg == timegroup:
-            step, data = get_rrd_data(hostname, service_description,
-                                      dsname, cf, fr, un-1)
-            if smallest_step == None:
-                smallest_step = step
-            slices.append((fr, step / smallest_step, data))
+            ranges.append((fr, un-1))
         begin -= period_info["slice"]
 
+    # Fetch the data of all slices at once
+    smallest_step = None
+    slices = []
+    for (fr, _unused_un), (step, data) in zip(ranges,
+            get_rrd_data_of_ranges(hostname, service_description, dsname, cf,
+                                   ranges, prefetch_dsnames)):
+        if smallest_step == None:
+            smallest_step = step
+        slices.append((fr, step / smallest_step, data))
+
     # Now we have all the RRD data we need. The next step is to consolidate
     # all that data into one new array.
     num_points = len(slices[0][2])
-    consolidated = []
-    for i in xrange(num_points):
-        point_line = []
-        for from_time, scale, data in slices:
-            idx = int(i / float(scale))
-            if idx < len(data):
-                d = data[idx]
-                if d != None:
-                    point_line.append(d)
-            # else:
-            #     date_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(fr + ((un - fr) * i / float(num_points))))
-            #     print "Keine Daten fur %s / %d/%s/ %.2f " % (date_str, i, float(scale),i/float(scale))
+    result = {
+        "num_points" : num_points,
+        "step"       : smallest_step,
+        "columns"    : COLUMNS,
+        "points"     : consolidate_slices(slices, num_points),
+    }
+    return result
 
+
+# Returns the average, min, max and stdev of the slices for each of the
+# num_points points or [None, None, None, None] for points without data.
+# The data of a slice with scale n (n times the step of the finest
+# slice) is stretched by repeating each value n times.
+def consolidate_slices(slices, num_points):
+    numpy = _import_numpy()
+    if numpy is not None:
+        return _consolidate_slices_numpy(numpy, slices, num_points)
+    return _consolidate_slices_python(slices, num_points)
+
+
+# NumPy is only imported when a prediction is computed, not by each
+# check process that loads this module
+_numpy = False
+
+def _import_numpy():
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def _consolidate_slices_numpy(numpy, slices, num_points):
+    indexes = numpy.arange(num_points)
+    table = numpy.empty((len(slices), num_points))
+    table.fill(numpy.nan)
+    for row, (_unused_from_time, scale, data) in enumerate(slices):
+        data_indexes = indexes / scale
+        valid = data_indexes < len(data)
+        table[row, valid] = numpy.array(data, dtype=float)[data_indexes[valid]]
+
+    present = ~numpy.isnan(table)
+    counts = present.sum(axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        averages = numpy.where(present, table, 0.0).sum(axis=0) / counts
+        minima = numpy.where(present, table, numpy.inf).min(axis=0)
+        maxima = numpy.where(present, table, -numpy.inf).max(axis=0)
+        stdevs = numpy.sqrt(numpy.where(present, (table - averages) ** 2, 0.0).sum(axis=0) / counts)
+
+    points = numpy.column_stack((averages, minima, maxima, stdevs)).tolist()
+    for index in numpy.flatnonzero(counts == 0):
+        points[index] = [None, None, None, None]
+    return points
+
+
+def _consolidate_slices_python(slices, num_points):
+    rows = []
+    for _unused_from_time, scale, data in slices:
+        if scale == 1:
+            row = data[:num_points]
+        else:
+            row = [ data[i / scale] for i in xrange(min(num_points, len(data) * scale)) ]
+        rows.append(row + [None] * (num_points - len(row)))
+
+    points = []
+    for point_line in zip(*rows):
+        point_line = [ p for p in point_line if p != None ]
         if point_line:
             average = sum(point_line) / len(point_line)
-            consolidated.append([
+            points.append([
                  average,
                  min(point_line),
                  max(point_line),
                  stdev(point_line, average),
             ])
         else:
-            consolidated.append([None, None, None, None])
+            points.append([None, None, None, None])
+    return points
 
-    result = {
+
+def stdev(point_line, average):
+    return math.sqrt(sum((p-average)**2 for p in point_line) / len(point_line))
+
+
+MAGIC   = "CMKPRED"
+VERSION = 1
+COLUMNS = [ "average", "min", "max", "stdev" ]
+
+_header_struct = struct.Struct("!7sHII")
+_point_struct  = struct.Struct("!4d")
+
+
+def encode_prediction(prediction):
+    header = _header_struct.pack(MAGIC, VERSION, prediction["num_points"], prediction["step"])
+    points = [ [ (v if v is not None else float("nan")) for v in point ]
+               for point in prediction["points"] ]
+    numpy = _import_numpy()
+    if numpy is not None:
+        return header + numpy.array(points, dtype=">f8").reshape(-1).tostring()
+    return header + "".join([ _point_struct.pack(*point) for point in points ])
+
+
+def _decode_point(data):
+    return [ (v if v == v else None) for v in _point_struct.unpack(data) ] # NaN -> None
+
+
+def save_prediction(path, prediction):
+    cmk.store.save_file(path, encode_prediction(prediction))
+
+
+# Reads the whole prediction. Returns None if the file does not
+# contain a prediction of the current format.
+def load_prediction(path):
+    data = file(path).read()
+    if len(data) < _header_struct.size:
+        return None
+
+    magic, version, num_points, step = _header_struct.unpack(data[:_header_struct.size])
+    if magic != MAGIC or version != VERSION \
+       or len(data) != _header_struct.size + num_points * _point_struct.size:
+        return None
+
+    offsets = xrange(_header_struct.size, len(data), _point_struct.size)
+    return {
         "num_points" : num_points,
-        "step"       : smallest_step,
-        "columns"    : [ "average", "min", "max", "stdev" ],
-        "points"     : consolidated,
+        "step"       : step,
+        "columns"    : COLUMNS,
+        "points"     : [ _decode_point(data[o:o + _point_struct.size]) for o in offsets ],
     }
-    return result
 
-def stdev(point_line, average):
-    return math.sqrt(sum([ (p-average)**2 for p in point_line ]) / len(point_line))
+
+# Reads only the point at rel_time seconds after the beginning of the
+# time group. Returns a dictionary of the columns, or None, if the file
+# does not contain a prediction of the current format.
+def load_prediction_point(path, rel_time):
+    with file(path) as f:
+        header = f.read(_header_struct.size)
+        if len(header) < _header_struct.size:
+            return None
+
+        magic, version, num_points, step = _header_struct.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            return None
+
+        index = int(rel_time / step)
+        if index >= num_points:
+            return dict.fromkeys(COLUMNS)
+
+        f.seek(_header_struct.size + index * _point_struct.size)
+        data = f.read(_point_struct.size)
+    if len(data) < _point_struct.size:
+        return None
+    return dict(zip(COLUMNS, _decode_point(data)))
+
+
+# Returns the reason why the prediction with the given info has to be
+# recomputed or None, if it is still valid
+def outdated_reason(info, params, period_info, now):
+    for k, v in params.items():
+        if info.get(k) != v:
+            return "Prediction parameters of %s have changed"
+
+    if info["time"] + period_info["valid"] * period_info["slice"] < now:
+        return "Prediction of %s outdated"
+
+
+# Returns the names of the other metrics of the service whose prediction
+# of the time group has to be recomputed, too. Their data is fetched
+# together with the data of the current metric. Only metrics predicted
+# with the same parameters and consolidation function are returned, since
+# their data is needed for the same slices. Their names are taken from the
+# info files, the directory names are cleaned up by pnp_cleanup().
+def outdated_predictions_of(service_dir, dsname, timegroup, params, period_info, now, cf):
+    dsnames = []
+    for name in os.listdir(service_dir):
+        if name == pnp_cleanup(dsname):
+            continue
+
+        info = _load_any_prediction_info("%s/%s" % (service_dir, name), timegroup)
+        if info is None or info.get("cf") != cf or "dsname" not in info \
+           or [ k for k, v in params.items() if info.get(k) != v ]:
+            continue
+
+        if info["timegroup"] == timegroup and not outdated_reason(info, params, period_info, now):
+            continue # Still valid
+
+        dsnames.append(info["dsname"])
+    return dsnames
+
+
+# Returns the info of the time group or, if it has not been predicted yet,
+# any other info of the metric (with "timegroup" set to its time group)
+def _load_any_prediction_info(dir, timegroup):
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return None
+
+    names = sorted([ n[:-5] for n in names if n.endswith(".info") ],
+                   key=lambda n: n != timegroup)
+    for name in names:
+        try:
+            info = eval(file("%s/%s.info" % (dir, name)).read())
+        except Exception:
+            continue # Broken info file, handled by the check of the metric
+        info["timegroup"] = name
+        return info
 
 
 # cf: consilidation function (MAX, MIN, AVERAGE)
@@ -239,24 +492,24 @@ def get_levels(hostname, service_description, dsname, params, cf, levels_factor=
     # - the prediction from the last time has done with other parameters
     try:
         last_info = eval(file(info_file).read())
-        for k, v in params.items():
-            if last_info.get(k) != v:
-                logger.verbose("Prediction parameters have changed")
-                last_info = None
-                break
+        reason = outdated_reason(last_info, params, period_info, now)
+        if reason:
+            logger.verbose(reason, timegroup)
+            last_info = None
     except IOError:
         logger.verbose("No previous prediction for group %s available.", timegroup)
         last_info = None
 
-    if last_info and last_info["time"] + period_info["valid"] * period_info["slice"] < now:
-        logger.verbose("Prediction of %s outdated", timegroup)
-        last_info = None
-
+    reference = None
     if last_info:
-        # TODO: faster file format. Binary encoded?
-        prediction = eval(file(pred_file).read())
-
-    else:
+        try:
+            reference = load_prediction_point(pred_file, rel_time)
+            if reference is None:
+                logger.verbose("Prediction of %s has an old format", timegroup)
+        except IOError:
+            logger.verbose("Prediction of %s is missing", timegroup)
+
+    if reference is None:
         # Remove all prediction files that result from other
         # prediction periods. This is e.g. needed if the user switches
         # the parameter from 'wday' to 'day'.
@@ -273,7 +526,9 @@ def get_levels(hostname, service_description, dsname, params, cf, levels_factor=
 
         logger.verbose("Computing prediction for time group %s", timegroup)
         prediction = compute_prediction(hostname, service_description, pred_file, timegroup,
-                                        params, period_info, from_time, dsname, cf)
+                                        params, period_info, from_time, dsname, cf,
+                                        outdated_predictions_of(os.path.dirname(dir), dsname,
+                                                                timegroup, params, period_info, now, cf))
 
         info = {
             "time"         : now,
@@ -284,15 +539,13 @@ def get_levels(hostname, service_description, dsname, params, cf, levels_factor=
         }
         info.update(params)
 
-        file(info_file, "w").write("%r\n" % info)
-        file(pred_file, "w").write("%r\n" % prediction)
+        save_prediction(pred_file, prediction)
+        cmk.store.save_file(info_file, "%r\n" % info)
+
+        # Find reference value in prediction
+        index = int(rel_time / prediction["step"])
+        reference = dict(zip(prediction["columns"], prediction["points"][index]))
 
-    # Find reference value in prediction
-    index = int(rel_time / prediction["step"])
-    # print "rel_time: %d, step: %d, Index: %d, num_points: %d" % (rel_time, prediction["step"], index, prediction["num_points"])
-    # print prediction.keys()
-    reference = dict(zip(prediction["columns"], prediction["points"][index]))
-    # print "Reference: %s" % reference
     ref_value = reference["average"]
     stdev = reference["stdev"]
     levels = []
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+
+"""Buffered submission of check results to the core
+
+Instead of writing each check result to the core on its own, the results
+are collected in a buffer, already encoded, and written at once when the
+buffer is flushed. For the command pipe the buffer is split into writes
+of at most PIPE_BUF bytes, each containing only complete commands.
+Writes of that size are atomic, so the commands can not be interleaved
+with the ones of other processes writing to the pipe. A single command
+larger than PIPE_BUF is written on its own. Check result files are
+written with one write per flush.
+
+The time stamps of the results are set when flushing. Each buffer keeps
+statistics about the submitted results, including the latency: the
+time the oldest result of a flush has been waiting in the buffer."""
+
+import select
+import time
+
+PIPE_BUF = getattr(select, "PIPE_BUF", 512)
+
+
+class ResultBuffer(object):
+    # max_write_size: None means: write everything at once
+    def __init__(self, max_write_size=None):
+        self.max_write_size = max_write_size
+        self.size           = 0 # number of bytes buffered (without the time stamps)
+        self._entries       = []
+        self._oldest        = None
+        self.stats          = {
+            "results"     : 0,
+            "writes"      : 0,
+            "bytes"       : 0,
+            "flushes"     : 0,
+            "max_latency" : 0.0,
+            "sum_latency" : 0.0,
+        }
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def _add(self, entry, size):
+        if not self._entries:
+            self._oldest = time.time()
+        self._entries.append(entry)
+        self.size += size
+
+
+    def clear(self):
+        self._entries, self.size = [], 0
+
+
+    # Returns the encoded result as it is written to the core
+    def _render(self, entry, now):
+        raise NotImplementedError()
+
+
+    # Writes all buffered results using the given function, which gets
+    # the data to write and returns the number of bytes written (like
+    # os.write())
+    def flush(self, write):
+        if not self._entries:
+            return
+
+        now = time.time()
+        entries, self._entries, self.size = self._entries, [], 0
+        for chunk in self._chunks([ self._render(entry, now) for entry in entries ]):
+            while chunk:
+                written = write(chunk)
+                chunk = chunk[written:]
+                self.stats["writes"] += 1
+                self.stats["bytes"]  += written
+
+        latency = now - self._oldest
+        self.stats["results"]     += len(entries)
+        self.stats["flushes"]     += 1
+        self.stats["sum_latency"] += latency
+        self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+
+
+    # Joins the rendered results to as few writes as possible
+    def _chunks(self, rendered):
+        if self.max_write_size is None:
+            return [ "".join(rendered) ]
+
+        chunks, parts, size = [], [], 0
+        for data in rendered:
+            if parts and size + len(data) > self.max_write_size:
+                chunks.append("".join(parts))
+                parts, size = [], 0
+            parts.append(data)
+            size += len(data)
+        if parts:
+            chunks.append("".join(parts))
+        return chunks
+
+
+# PROCESS_SERVICE_CHECK_RESULT commands for the command pipe of the core
+class CommandPipeBuffer(ResultBuffer):
+    def __init__(self, max_write_size=PIPE_BUF):
+        super(CommandPipeBuffer, self).__init__(max_write_size)
+
+
+    # All arguments are expected to be encoded already
+    def add(self, host, service, state, output):
+        # [<timestamp>] PROCESS_SERVICE_CHECK_RESULT;<host_name>;<svc_description>;<return_code>;<plugin_output>
+        entry = "] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (host, service, state, output)
+        self._add(entry, len(entry))
+
+
+    def _render(self, entry, now):
+        return "[%d%s" % (now, entry)
+
+
+# Check results for a check result file of the core
+class CheckResultFileBuffer(ResultBuffer):
+    def add(self, host, service, state, output):
+        entry = ("host_name=%s\n"
+                 "service_description=%s\n"
+                 "check_type=1\n"
+                 "check_options=0\n"
+                 "reschedule_check\n"
+                 "latency=0.0\n" % (host, service),
+                 "return_code=%d\n"
+                 "output=%s\n"
+                 "\n" % (state, output))
+        self._add(entry, len(entry[0]) + len(entry[1]))
+
+
+    def _render(self, entry, now):
+        return "%sstart_time=%.1f\nfinish_time=%.1f\n%s" % (entry[0], now, now, entry[1])
+
+
+# Returns a one line summary of the statistics of the given buffers
+def format_stats(buffers):
+    stats = dict([ (key, 0) for key in [ "results", "writes", "bytes", "flushes" ] ])
+    max_latency, sum_latency = 0.0, 0.0
+    for result_buffer in buffers:
+        for key in stats:
+            stats[key] += result_buffer.stats[key]
+        max_latency = max(max_latency, result_buffer.stats["max_latency"])
+        sum_latency += result_buffer.stats["sum_latency"]
+
+    avg_latency = stats["flushes"] and sum_latency / stats["flushes"] or 0.0
+    return "%d results submitted with %d writes (%d bytes), latency avg %.2f sec, max %.2f sec" % \
+           (stats["results"], stats["writes"], stats["bytes"], avg_latency, max_latency)
@@ -0,0 +1,991 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Built-in SNMP client engine
+
+Speaks SNMP v1, v2c and v3 (USM) directly via UDP instead of executing
+the net-snmp command line tools for each OID to be walked.
+
+Session.walk() fetches many table columns at once: each request asks for
+the next entries of several columns (GETBULK for bulkwalk hosts, GETNEXT
+otherwise) and all requests of a round are sent at once over the same
+socket before the answers are collected. This way a table with 20
+columns needs a few round trips instead of 20 processes.
+
+The values are returned as pairs of BER type and Python value.
+format_value() converts them into the text the command line tools
+output, so the callers can process them exactly like the output of the
+classic SNMP implementation.
+
+SNMPv3 privacy (DES, AES) needs the module Crypto (pycrypto)."""
+
+import hashlib
+import hmac
+import random
+import select
+import socket
+import struct
+import time
+
+from cmk.exceptions import MKGeneralException
+
+# BER types
+INTEGER          = 0x02
+OCTET_STRING     = 0x04
+NULL             = 0x05
+OBJECT_ID        = 0x06
+SEQUENCE         = 0x30
+IP_ADDRESS       = 0x40
+COUNTER32        = 0x41
+GAUGE32          = 0x42
+TIMETICKS        = 0x43
+OPAQUE           = 0x44
+COUNTER64        = 0x46
+NO_SUCH_OBJECT   = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW  = 0x82
+
+# PDU types
+GET_REQUEST      = 0xa0
+GET_NEXT_REQUEST = 0xa1
+RESPONSE         = 0xa2
+GET_BULK_REQUEST = 0xa5
+REPORT           = 0xa8
+
+# Error status values
+ERROR_NO_ERROR     = 0
+ERROR_TOO_BIG      = 1
+ERROR_NO_SUCH_NAME = 2
+
+_error_status_texts = {
+    1  : "tooBig",
+    2  : "noSuchName",
+    3  : "badValue",
+    4  : "readOnly",
+    5  : "genErr",
+    6  : "noAccess",
+    16 : "authorizationError",
+}
+
+# SNMPv3 message flags
+FLAG_AUTH       = 0x01
+FLAG_PRIV       = 0x02
+FLAG_REPORTABLE = 0x04
+
+USM_SECURITY_MODEL = 3
+MAX_MESSAGE_SIZE   = 65507
+
+_report_texts = {
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 1, 0) : "Unsupported security level",
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 2, 0) : "Not in time window",
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 3, 0) : "Unknown user name",
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 4, 0) : "Unknown engine ID",
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 5, 0) : "Wrong digest (authentication failure)",
+    (1, 3, 6, 1, 6, 3, 15, 1, 1, 6, 0) : "Decryption error",
+}
+_NOT_IN_TIME_WINDOW = (1, 3, 6, 1, 6, 3, 15, 1, 1, 2, 0)
+
+
+class SNMPError(MKGeneralException):
+    pass
+
+
+class SNMPTimeout(SNMPError):
+    pass
+
+
+#.
+#   .--BER-----------------------------------------------------------------.
+#   |                         ____  _____ ____                             |
+#   |                        | __ )| ____|  _ \                            |
+#   |                        |  _ \|  _| | |_) |                           |
+#   |                        | |_) | |___|  _ <                            |
+#   |                        |____/|_____|_| \_\                           |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | Encoding and decoding of the basic encoding rules used by SNMP       |
+#   '----------------------------------------------------------------------'
+
+def oid_to_tuple(oid):
+    try:
+        return tuple([ int(arc) for arc in oid.strip(".").split(".") ])
+    except ValueError:
+        raise SNMPError("Invalid OID %s" % oid)
+
+
+def tuple_to_oid(arcs):
+    return "." + ".".join(map(str, arcs))
+
+
+def encode_length(length):
+    if length < 0x80:
+        return chr(length)
+
+    encoded = ""
+    while length:
+        encoded = chr(length & 0xff) + encoded
+        length >>= 8
+    return chr(0x80 | len(encoded)) + encoded
+
+
+def encode_tlv(tag, content):
+    return chr(tag) + encode_length(len(content)) + content
+
+
+def encode_integer(value, tag=INTEGER):
+    content = ""
+    while True:
+        content = chr(value & 0xff) + content
+        value >>= 8
+        if (value == 0 and not ord(content[0]) & 0x80) \
+           or (value == -1 and ord(content[0]) & 0x80):
+            break
+    return encode_tlv(tag, content)
+
+
+def encode_oid(oid):
+    arcs = oid_to_tuple(oid)
+    if len(arcs) < 2:
+        raise SNMPError("Invalid OID %s" % oid)
+
+    content = _encode_arc(arcs[0] * 40 + arcs[1])
+    for arc in arcs[2:]:
+        content += _encode_arc(arc)
+    return encode_tlv(OBJECT_ID, content)
+
+
+def _encode_arc(arc):
+    encoded = chr(arc & 0x7f)
+    arc >>= 7
+    while arc:
+        encoded = chr(0x80 | (arc & 0x7f)) + encoded
+        arc >>= 7
+    return encoded
+
+
+def encode_value(tag, value):
+    if tag in [ INTEGER, COUNTER32, GAUGE32, TIMETICKS, COUNTER64 ]:
+        return encode_integer(value, tag)
+    elif tag in [ OCTET_STRING, OPAQUE ]:
+        return encode_tlv(tag, value)
+    elif tag == OBJECT_ID:
+        return encode_oid(value)
+    elif tag == IP_ADDRESS:
+        return encode_tlv(tag, socket.inet_aton(value))
+    else:
+        return encode_tlv(tag, "") # NULL and the exception values
+
+
+# Returns the type and content of the element at the given position
+# and the position of the next element
+def decode_tlv(data, pos):
+    try:
+        tag = ord(data[pos])
+        length = ord(data[pos + 1])
+        pos += 2
+        if length & 0x80:
+            num_bytes = length & 0x7f
+            if pos + num_bytes > len(data):
+                raise IndexError()
+            length = 0
+            for c in data[pos:pos + num_bytes]:
+                length = (length << 8) | ord(c)
+            pos += num_bytes
+    except IndexError:
+        raise SNMPError("Truncated SNMP message")
+
+    end = pos + length
+    if end > len(data):
+        raise SNMPError("Truncated SNMP message")
+    return tag, data[pos:end], end
+
+
+def decode_sequence(content):
+    elements = []
+    pos = 0
+    while pos < len(content):
+        tag, value, pos = decode_tlv(content, pos)
+        elements.append((tag, value))
+    return elements
+
+
+def decode_integer(content, signed=True):
+    value = 0
+    for c in content:
+        value = (value << 8) | ord(c)
+    if signed and content and ord(content[0]) & 0x80:
+        value -= 1 << (8 * len(content))
+    return value
+
+
+def decode_oid(content):
+    arcs = []
+    arc = 0
+    for c in content:
+        byte = ord(c)
+        arc = (arc << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+
+    if not arcs:
+        raise SNMPError("Invalid empty OID")
+
+    if arcs[0] < 80:
+        return (arcs[0] / 40, arcs[0] % 40) + tuple(arcs[1:])
+    else:
+        return (2, arcs[0] - 80) + tuple(arcs[1:])
+
+
+def decode_value(tag, content):
+    if tag == INTEGER:
+        return decode_integer(content)
+    elif tag in [ COUNTER32, GAUGE32, TIMETICKS, COUNTER64 ]:
+        return decode_integer(content, signed=False)
+    elif tag in [ OCTET_STRING, OPAQUE ]:
+        return content
+    elif tag == OBJECT_ID:
+        return tuple_to_oid(decode_oid(content))
+    elif tag == IP_ADDRESS:
+        return ".".join([ str(ord(c)) for c in content ])
+    else:
+        return None
+
+
+class PDU(object):
+    # varbinds is a list of triples of OID, BER type and value. In
+    # GETBULK requests error_status and error_index are non-repeaters
+    # and max-repetitions.
+    def __init__(self, pdu_type, varbinds, request_id=0, error_status=0, error_index=0):
+        self.pdu_type     = pdu_type
+        self.varbinds     = varbinds
+        self.request_id   = request_id
+        self.error_status = error_status
+        self.error_index  = error_index
+
+
+    def encode(self):
+        varbinds = "".join([ encode_tlv(SEQUENCE, encode_oid(oid) + encode_value(tag, value))
+                             for oid, tag, value in self.varbinds ])
+        return encode_tlv(self.pdu_type, encode_integer(self.request_id)
+                                       + encode_integer(self.error_status)
+                                       + encode_integer(self.error_index)
+                                       + encode_tlv(SEQUENCE, varbinds))
+
+
+    @classmethod
+    def decode(cls, pdu_type, content):
+        elements = decode_sequence(content)
+        if len(elements) != 4:
+            raise SNMPError("Invalid SNMP PDU")
+
+        request_id, error_status, error_index = [ decode_integer(c) for _unused_tag, c in elements[:3] ]
+        varbinds = []
+        for _unused_tag, varbind in decode_sequence(elements[3][1]):
+            varbind = decode_sequence(varbind)
+            if len(varbind) != 2 or varbind[0][0] != OBJECT_ID:
+                raise SNMPError("Invalid variable binding in SNMP PDU")
+            (_unused_tag, oid), (tag, value) = varbind
+            varbinds.append((tuple_to_oid(decode_oid(oid)), tag, decode_value(tag, value)))
+
+        return cls(pdu_type, varbinds, request_id, error_status, error_index)
+
+
+    def error_text(self):
+        return _error_status_texts.get(self.error_status, "error %d" % self.error_status)
+
+
+def encode_community_message(version, community, pdu):
+    return encode_tlv(SEQUENCE, encode_integer(version)
+                              + encode_tlv(OCTET_STRING, community)
+                              + pdu.encode())
+
+
+# Returns the version, community and PDU of a SNMP v1/v2c message
+def decode_community_message(data):
+    elements = decode_sequence(_message_content(data))
+    if len(elements) != 3:
+        raise SNMPError("Invalid SNMP message")
+    pdu_type, pdu = elements[2]
+    return decode_integer(elements[0][1]), elements[1][1], PDU.decode(pdu_type, pdu)
+
+
+def message_version(data):
+    elements = decode_sequence(_message_content(data))
+    if not elements or elements[0][0] != INTEGER:
+        raise SNMPError("Invalid SNMP message")
+    return decode_integer(elements[0][1])
+
+
+# Returns the request ID of a SNMP message without decoding the message
+# completely. For SNMPv3 messages this is the message ID. Returns None
+# for invalid messages.
+def message_request_id(data):
+    try:
+        content = _message_content(data)
+        _unused_tag, version, pos = decode_tlv(content, 0)
+        if decode_integer(version) == 3:
+            header = decode_tlv(content, pos)[1]
+            return decode_integer(decode_tlv(header, 0)[1])
+
+        pos = decode_tlv(content, pos)[2] # community
+        pdu = decode_tlv(content, pos)[1]
+        return decode_integer(decode_tlv(pdu, 0)[1])
+    except SNMPError:
+        return None
+
+
+def _message_content(data):
+    tag, content, _unused_end = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise SNMPError("Invalid SNMP message")
+    return content
+
+
+#.
+#   .--USM-----------------------------------------------------------------.
+#   |                         _   _ ____  __  __                           |
+#   |                        | | | / ___||  \/  |                          |
+#   |                        | | | \___ \| |\/| |                          |
+#   |                        | |_| |___) | |  | |                          |
+#   |                         \___/|____/|_|  |_|                          |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | The user based security model of SNMPv3 (RFC 3414, RFC 3826)         |
+#   '----------------------------------------------------------------------'
+
+_hash_functions = {
+    "md5" : hashlib.md5,
+    "sha" : hashlib.sha1,
+}
+
+
+def password_to_key(password, hash_function):
+    if not password:
+        raise SNMPError("Empty SNMPv3 password")
+    repeated = password * (1048576 / len(password) + 1)
+    return hash_function(repeated[:1048576]).digest()
+
+
+def localize_key(key, engine_id, hash_function):
+    return hash_function(key + engine_id + key).digest()
+
+
+class USMUser(object):
+    # credentials are given like in the Check_MK configuration:
+    # (level, user), (level, auth protocol, user, auth password)
+    # or (level, auth protocol, user, auth password, priv protocol,
+    # priv password)
+    def __init__(self, credentials):
+        if len(credentials) == 2:
+            self.level, self.user = credentials
+            auth_protocol, self.auth_password = None, None
+            self.priv_protocol, self.priv_password = None, None
+        elif len(credentials) == 4:
+            self.level, auth_protocol, self.user, self.auth_password = credentials
+            self.priv_protocol, self.priv_password = None, None
+        elif len(credentials) == 6:
+            self.level, auth_protocol, self.user, self.auth_password, \
+                self.priv_protocol, self.priv_password = credentials
+        else:
+            raise SNMPError("Invalid SNMPv3 credentials %r" % (credentials,))
+
+        self.use_auth = self.level in [ "authNoPriv", "authPriv" ]
+        self.use_priv = self.level == "authPriv"
+
+        self.hash_function = None
+        if self.use_auth:
+            try:
+                self.hash_function = _hash_functions[auth_protocol.lower()]
+            except (KeyError, AttributeError):
+                raise SNMPError("Unsupported SNMPv3 authentication protocol %r" % auth_protocol)
+
+        if self.use_priv:
+            if (self.priv_protocol or "").upper() not in [ "DES", "AES" ]:
+                raise SNMPError("Unsupported SNMPv3 privacy protocol %r" % self.priv_protocol)
+            self.priv_protocol = self.priv_protocol.upper()
+
+        self._keys = {}
+        self._salt = random.randint(0, 0xffffffff)
+
+
+    def flags(self):
+        return (self.use_auth and FLAG_AUTH or 0) | (self.use_priv and FLAG_PRIV or 0)
+
+
+    # Returns the keys for authentication and privacy, localized for
+    # the given engine
+    def keys(self, engine_id):
+        try:
+            return self._keys[engine_id]
+        except KeyError:
+            pass
+
+        auth_key, priv_key = None, None
+        if self.use_auth:
+            auth_key = localize_key(password_to_key(self.auth_password, self.hash_function),
+                                    engine_id, self.hash_function)
+        if self.use_priv:
+            priv_key = localize_key(password_to_key(self.priv_password, self.hash_function),
+                                    engine_id, self.hash_function)
+        self._keys[engine_id] = auth_key, priv_key
+        return auth_key, priv_key
+
+
+    def encode_message(self, msg_id, flags, engine_id, boots, engine_time, scoped_pdu):
+        auth_key, priv_key = self.keys(engine_id)
+        use_auth = flags & FLAG_AUTH
+        use_priv = flags & FLAG_PRIV
+
+        priv_params = ""
+        if use_priv:
+            self._salt = (self._salt + 1) & 0xffffffff
+            scoped_pdu, priv_params = self._encrypt(priv_key, boots, engine_time, scoped_pdu)
+            scoped_pdu = encode_tlv(OCTET_STRING, scoped_pdu)
+
+        version = encode_integer(3)
+        header = encode_tlv(SEQUENCE, encode_integer(msg_id)
+                                    + encode_integer(MAX_MESSAGE_SIZE)
+                                    + encode_tlv(OCTET_STRING, chr(flags))
+                                    + encode_integer(USM_SECURITY_MODEL))
+        usm_head = encode_tlv(OCTET_STRING, engine_id) \
+                 + encode_integer(boots) \
+                 + encode_integer(engine_time) \
+                 + encode_tlv(OCTET_STRING, self.user)
+        usm_content = usm_head \
+                    + encode_tlv(OCTET_STRING, use_auth and "\0" * 12 or "") \
+                    + encode_tlv(OCTET_STRING, priv_params)
+        usm = encode_tlv(SEQUENCE, usm_content)
+        security_parameters = encode_tlv(OCTET_STRING, usm)
+        body = version + header + security_parameters + scoped_pdu
+        message = encode_tlv(SEQUENCE, body)
+
+        if use_auth:
+            # Position of the zeroed authentication parameters
+            offset = message.find(usm) + len(usm) - len(usm_content) + len(usm_head) + 2
+            digest = hmac.new(auth_key, message, self.hash_function).digest()[:12]
+            message = message[:offset] + digest + message[offset + 12:]
+
+        return message
+
+
+    # Decodes a SNMPv3 message. Returns a dictionary with the header fields
+    # and the PDU. Authentication and decryption are only done when the
+    # message is flagged accordingly.
+    def decode_message(self, data):
+        elements = decode_sequence(_message_content(data))
+        if len(elements) != 4:
+            raise SNMPError("Invalid SNMPv3 message")
+
+        header = [ value for _unused_tag, value in decode_sequence(elements[1][1]) ]
+        if len(header) != 4 or not header[2]:
+            raise SNMPError("Invalid SNMPv3 message header")
+        msg_id = decode_integer(header[0])
+        flags = ord(header[2][0])
+
+        usm = [ value for _unused_tag, value in decode_sequence(decode_tlv(elements[2][1], 0)[1]) ]
+        if len(usm) != 6:
+            raise SNMPError("Invalid SNMPv3 security parameters")
+        engine_id, user, auth_params, priv_params = usm[0], usm[3], usm[4], usm[5]
+        boots, engine_time = decode_integer(usm[1]), decode_integer(usm[2])
+
+        if flags & FLAG_AUTH:
+            if not self.use_auth:
+                raise SNMPError("Unexpected authenticated SNMPv3 message")
+            auth_key = self.keys(engine_id)[0]
+            self._verify(data, auth_key, auth_params)
+
+        scoped_tag, scoped_pdu = elements[3]
+        if flags & FLAG_PRIV:
+            if not self.use_priv or scoped_tag != OCTET_STRING:
+                raise SNMPError("Unexpected encrypted SNMPv3 message")
+            priv_key = self.keys(engine_id)[1]
+            scoped_tag, scoped_pdu, _unused_end = decode_tlv(
+                self._decrypt(priv_key, boots, engine_time, priv_params, scoped_pdu), 0)
+
+        scoped = decode_sequence(scoped_pdu)
+        if scoped_tag != SEQUENCE or len(scoped) != 3:
+            raise SNMPError("Invalid SNMPv3 scoped PDU")
+
+        return {
+            "msg_id"       : msg_id,
+            "flags"        : flags,
+            "engine_id"    : engine_id,
+            "boots"        : boots,
+            "engine_time"  : engine_time,
+            "user"         : user,
+            "context_name" : scoped[1][1],
+            "pdu"          : PDU.decode(*scoped[2]),
+        }
+
+
+    def _verify(self, data, auth_key, auth_params):
+        if len(auth_params) != 12:
+            raise SNMPError("Invalid SNMPv3 authentication parameters")
+        offset = data.find(encode_tlv(OCTET_STRING, auth_params)) + 2
+        zeroed = data[:offset] + "\0" * 12 + data[offset + 12:]
+        if hmac.new(auth_key, zeroed, self.hash_function).digest()[:12] != auth_params:
+            raise SNMPError("SNMPv3 authentication failure")
+
+
+    def _encrypt(self, priv_key, boots, engine_time, plaintext):
+        if self.priv_protocol == "DES":
+            priv_params = struct.pack("!II", boots, self._salt)
+            iv = _xor(priv_key[8:16], priv_params)
+            padded = plaintext + "\0" * (-len(plaintext) % 8)
+            return _cipher("DES", priv_key, iv).encrypt(padded), priv_params
+
+        priv_params = struct.pack("!II", self._salt, self._salt ^ 0x5a5a5a5a)
+        iv = struct.pack("!II", boots, engine_time) + priv_params
+        # CFB: the prefix of the ciphertext does not depend on the padding
+        padded = plaintext + "\0" * (-len(plaintext) % 16)
+        return _cipher("AES", priv_key, iv).encrypt(padded)[:len(plaintext)], priv_params
+
+
+    def _decrypt(self, priv_key, boots, engine_time, priv_params, ciphertext):
+        if len(priv_params) != 8:
+            raise SNMPError("Invalid SNMPv3 privacy parameters")
+
+        if self.priv_protocol == "DES":
+            if len(ciphertext) % 8:
+                raise SNMPError("Invalid length of encrypted SNMPv3 PDU")
+            iv = _xor(priv_key[8:16], priv_params)
+            return _cipher("DES", priv_key, iv).decrypt(ciphertext)
+
+        iv = struct.pack("!II", boots, engine_time) + priv_params
+        padded = ciphertext + "\0" * (-len(ciphertext) % 16)
+        return _cipher("AES", priv_key, iv).decrypt(padded)[:len(ciphertext)]
+
+
+_discovery_user = USMUser(("noAuthNoPriv", ""))
+
+
+def _xor(a, b):
+    return "".join([ chr(ord(x) ^ ord(y)) for x, y in zip(a, b) ])
+
+
+def _cipher(protocol, key, iv):
+    try:
+        from Crypto.Cipher import AES, DES
+    except ImportError:
+        raise SNMPError("SNMPv3 privacy needs the Python module Crypto (pycrypto)")
+
+    if protocol == "DES":
+        return DES.new(key[:8], DES.MODE_CBC, iv)
+    return AES.new(key[:16], AES.MODE_CFB, iv, segment_size=128)
+
+
+#.
+#   .--Session-------------------------------------------------------------.
+#   |                  ____                _                               |
+#   |                 / ___|  ___  ___ ___(_) ___  _ __                    |
+#   |                 \___ \ / _ \/ __/ __| |/ _ \| '_ \                   |
+#   |                  ___) |  __/\__ \__ \ | (_) | | | |                  |
+#   |                 |____/ \___||___/___/_|\___/|_| |_|                  |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | Requests to one SNMP agent                                           |
+#   '----------------------------------------------------------------------'
+
+class Session(object):
+    # credentials is a community string (SNMP v1/v2c, depending on
+    # version) or a tuple of SNMPv3 credentials (see USMUser)
+    def __init__(self, address, credentials, version=2, port=161, context_name=None,
+                 timeout=1.0, retries=5, use_bulk=False, max_repetitions=10, max_columns=10):
+        self.address         = address
+        self.port            = port
+        self.timeout         = timeout
+        self.retries         = retries
+        self.max_repetitions = max_repetitions
+        self.max_columns     = max_columns
+        self.context_name    = context_name or ""
+
+        if type(credentials) == tuple:
+            self.version   = 3
+            self.community = None
+            self.usm_user  = USMUser(credentials)
+            self.use_bulk  = use_bulk
+        else:
+            self.version   = version == 1 and 1 or 2
+            self.community = credentials
+            self.usm_user  = None
+            self.use_bulk  = use_bulk and self.version == 2
+
+        # Engine of the agent, discovered with the first SNMPv3 request
+        self._engine_id   = None
+        self._boots       = 0
+        self._time_offset = 0
+
+        self.family = ":" in address and socket.AF_INET6 or socket.AF_INET
+        self._socket = None # opened with the first request
+        self._request_id = random.randint(1, 0x3fffffff)
+
+
+    def close(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+
+    # Returns a dictionary from the requested OIDs to pairs of BER type
+    # and value. OIDs not existing on the agent are missing. Up to
+    # max_columns OIDs are requested per PDU, all PDUs are sent at once.
+    def get(self, oids):
+        values = {}
+        for varbind in self._request_each(GET_REQUEST, oids):
+            if varbind is not None \
+               and varbind[1] not in [ NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW ]:
+                values[varbind[0]] = varbind[1:]
+        return values
+
+
+    # Returns the triple of OID, BER type and value following the given
+    # OID or None at the end of the MIB
+    def get_next(self, oid):
+        return self.get_next_many([ oid ]).get(oid)
+
+
+    # Returns a dictionary from the requested OIDs to the triples of OID,
+    # BER type and value following them. OIDs at the end of the MIB are
+    # missing.
+    def get_next_many(self, oids):
+        entries = {}
+        for oid, entry in zip(oids, self._request_each(GET_NEXT_REQUEST, oids)):
+            if entry is not None and entry[1] != END_OF_MIB_VIEW:
+                entries[oid] = entry
+        return entries
+
+
+    # Sends a request of the given type for each OID and returns the
+    # varbinds of the answers in the order of the OIDs. An SNMP v1 agent
+    # answers with noSuchName when one of the OIDs of a PDU does not
+    # exist. The varbind of this OID is None and the PDU is sent again
+    # without it.
+    def _request_each(self, pdu_type, oids):
+        results = [ None ] * len(oids)
+        chunks = [ range(index, min(index + self.max_columns, len(oids)))
+                   for index in range(0, len(oids), self.max_columns) ]
+        while chunks:
+            responses = self._exchange([ PDU(pdu_type, [ (oids[index], NULL, None) for index in chunk ])
+                                         for chunk in chunks ])
+            retry = []
+            for chunk, response in zip(chunks, responses):
+                if response.error_status == ERROR_NO_SUCH_NAME \
+                   and 1 <= response.error_index <= len(chunk): # SNMP v1
+                    del chunk[response.error_index - 1]
+                    if chunk:
+                        retry.append(chunk)
+                    continue
+                elif response.error_status:
+                    raise SNMPError("SNMP error: %s" % response.error_text())
+
+                for index, varbind in zip(chunk, response.varbinds):
+                    results[index] = varbind
+            chunks = retry
+        return results
+
+
+    # Walks the subtrees of the given OIDs at the same time, see TableWalk
+    def walk(self, oids):
+        table_walk = self.table_walk(oids)
+        while True:
+            requests = table_walk.next_requests()
+            if not requests:
+                break
+            table_walk.add_responses(self._exchange(requests))
+
+        self.max_repetitions = table_walk.max_repetitions
+        return table_walk.results
+
+
+    def table_walk(self, oids):
+        return TableWalk(oids, self.use_bulk, self.max_repetitions, self.max_columns)
+
+
+    def needs_engine_discovery(self):
+        return self.version == 3 and self._engine_id is None
+
+
+    # Sends the requests at once and returns the responses in the same
+    # order. Requests not answered within the timeout are sent again.
+    def _exchange(self, pdus):
+        if self.needs_engine_discovery():
+            self._discover_engine()
+
+        pending = {}
+        for index, pdu in enumerate(pdus):
+            pdu.request_id = self.next_request_id()
+            pending[pdu.request_id] = index, pdu
+
+        responses = [ None ] * len(pdus)
+        for _unused_attempt in range(self.retries + 1):
+            for request_id in sorted(pending):
+                self._send(pending[request_id][1])
+
+            for response in self._receive(pending):
+                request = pending[response.request_id][1]
+                if response.pdu_type == REPORT:
+                    self.handle_report(response, request)
+                    self._send(request)
+                    continue
+
+                index = pending.pop(response.request_id)[0]
+                responses[index] = response
+
+            if not pending:
+                return responses
+
+        raise SNMPTimeout("Timeout: No Response from %s" % self.address)
+
+
+    def _discover_engine(self):
+        request = PDU(GET_REQUEST, [], self.next_request_id())
+        for _unused_attempt in range(self.retries + 1):
+            self._send(request)
+            for _unused_response in self._receive({ request.request_id : request }):
+                if not self.needs_engine_discovery():
+                    return
+
+        raise SNMPTimeout("Timeout: No Response from %s (SNMPv3 engine discovery)" % self.address)
+
+
+    def _send(self, pdu):
+        if not self._socket:
+            self._socket = socket.socket(self.family, socket.SOCK_DGRAM)
+
+        try:
+            self._socket.sendto(self.encode_request(pdu), (self.address, self.port))
+        except socket.error, e:
+            raise SNMPError("Cannot send SNMP request to %s: %s" % (self.address, e))
+
+
+    # Yields the responses to the pending requests received within the
+    # timeout
+    def _receive(self, pending):
+        deadline = time.time() + self.timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([ self._socket ], [], [], remaining)[0]:
+                return
+
+            try:
+                data = self._socket.recvfrom(65535)[0]
+            except socket.error:
+                continue # e.g. ICMP port unreachable
+
+            response = self.decode_response(data)
+            if response is not None and response.request_id in pending:
+                yield response # and not garbage or late answer to a former request
+
+
+    def next_request_id(self):
+        self._request_id = self._request_id % 0x7ffffffe + 1
+        return self._request_id
+
+
+    # Returns the message to be sent for a request. As long as the SNMPv3
+    # engine of the agent is unknown, a discovery request is sent.
+    def encode_request(self, pdu):
+        if self.version != 3:
+            return encode_community_message(self.version - 1, self.community, pdu)
+
+        if self._engine_id is None:
+            user, flags, engine_id = _discovery_user, FLAG_REPORTABLE, ""
+            context_name, pdu = "", PDU(GET_REQUEST, [], pdu.request_id)
+        else:
+            user, flags, engine_id = self.usm_user, self.usm_user.flags() | FLAG_REPORTABLE, self._engine_id
+            context_name = self.context_name
+
+        scoped_pdu = encode_tlv(SEQUENCE, encode_tlv(OCTET_STRING, engine_id)
+                                        + encode_tlv(OCTET_STRING, context_name)
+                                        + pdu.encode())
+        return user.encode_message(pdu.request_id, flags, engine_id, self._boots,
+                                   self._engine_time(), scoped_pdu)
+
+
+    # Returns the received PDU or None if the message is invalid. The
+    # request ID of SNMPv3 reports is the message ID of the request.
+    def decode_response(self, data):
+        try:
+            if self.version != 3:
+                return decode_community_message(data)[2]
+
+            message = self.usm_user.decode_message(data)
+            if message["flags"] & FLAG_AUTH or self._engine_id is None:
+                self._set_engine(message["engine_id"], message["boots"], message["engine_time"])
+            pdu = message["pdu"]
+            pdu.request_id = message["msg_id"]
+            return pdu
+        except SNMPError:
+            return None
+
+
+    def _set_engine(self, engine_id, boots, engine_time):
+        if engine_id:
+            self._engine_id = engine_id
+            self._boots = boots
+            self._time_offset = engine_time - time.time()
+
+
+    def _engine_time(self):
+        return max(0, int(time.time() + self._time_offset))
+
+
+    # Reports are sent by SNMPv3 agents instead of responses. When we are
+    # not in the time window of the agent, the request can be sent again
+    # with the time of the agent, which has been updated meanwhile. All
+    # other reports are errors.
+    def handle_report(self, report, request):
+        oids = [ oid_to_tuple(oid) for oid, _unused_tag, _unused_value in report.varbinds ]
+        if _NOT_IN_TIME_WINDOW in oids and not getattr(request, "resent", False):
+            request.resent = True
+            return
+
+        texts = [ _report_texts.get(oid, tuple_to_oid(oid)) for oid in oids ]
+        raise SNMPError("SNMPv3 error: %s" % ", ".join(texts))
+
+
+# Walks the subtrees of several OIDs at the same time. The requests of
+# a round are returned by next_requests(), the responses of the round
+# are processed by add_responses(). When all subtrees are walked,
+# results is a dictionary from the OIDs to the lists of the triples of
+# OID, BER type and value found in the subtrees. Like snmpwalk does it,
+# the OID itself is fetched if there is nothing in its subtree.
+class TableWalk(object):
+    def __init__(self, oids, use_bulk, max_repetitions, max_columns):
+        self.use_bulk        = use_bulk
+        self.max_repetitions = max_repetitions
+        self.max_columns     = max_columns
+
+        self.oids = []
+        for oid in oids:
+            if oid not in self.oids:
+                self.oids.append(oid)
+
+        self.results    = dict([ (oid, []) for oid in self.oids ])
+        self._prefixes  = dict([ (oid, oid_to_tuple(oid)) for oid in self.oids ])
+        self._next_oids = dict([ (oid, oid) for oid in self.oids ])
+        self._seen      = dict([ (oid, set([])) for oid in self.oids ])
+        self._active    = list(self.oids)
+        self._groups    = []
+        self._missing   = None # OIDs to be fetched with GET after the walk
+
+
+    def next_requests(self):
+        if self._active:
+            self._groups = [ self._active[index:index + self.max_columns]
+                             for index in range(0, len(self._active), self.max_columns) ]
+            if self.use_bulk:
+                return [ PDU(GET_BULK_REQUEST, [ (self._next_oids[oid], NULL, None) for oid in group ],
+                             error_status=0, error_index=self.max_repetitions)
+                         for group in self._groups ]
+            else:
+                return [ PDU(GET_NEXT_REQUEST, [ (self._next_oids[oid], NULL, None) for oid in group ])
+                         for group in self._groups ]
+
+        if self._missing is None:
+            self._missing = [ oid for oid in self.oids if not self.results[oid] ]
+        if self._missing:
+            return [ PDU(GET_REQUEST, [ (oid, NULL, None) for oid in self._missing ]) ]
+        return []
+
+
+    def add_responses(self, responses):
+        if not self._active:
+            self._add_get_response(responses[0])
+            return
+
+        finished = set([])
+        for group, response in zip(self._groups, responses):
+            if response.error_status == ERROR_NO_SUCH_NAME \
+               and 1 <= response.error_index <= len(group): # end of MIB with SNMP v1
+                finished.add(group[response.error_index - 1])
+                continue
+            elif response.error_status == ERROR_TOO_BIG and self.max_repetitions > 1:
+                self.max_repetitions = max(1, self.max_repetitions / 2)
+                continue # try again with smaller responses
+            elif response.error_status:
+                raise SNMPError("SNMP error: %s" % response.error_text())
+
+            if not response.varbinds:
+                raise SNMPError("Got a response without variables")
+
+            # Agents may return less variables than requested to limit the
+            # size of the response (RFC 3416, 4.2.3). Columns without a
+            # variable are requested again in the next round.
+            for nr, (oid, tag, value) in enumerate(response.varbinds):
+                column = group[nr % len(group)]
+                if column in finished:
+                    continue
+
+                prefix = self._prefixes[column]
+                arcs = oid_to_tuple(oid)
+                if tag in [ END_OF_MIB_VIEW, NO_SUCH_OBJECT, NO_SUCH_INSTANCE ] \
+                   or len(arcs) <= len(prefix) or arcs[:len(prefix)] != prefix \
+                   or oid in self._seen[column]: # agent is looping
+                    finished.add(column)
+                    continue
+
+                self._seen[column].add(oid)
+                self.results[column].append((oid, tag, value))
+                self._next_oids[column] = oid
+
+        self._active = [ oid for oid in self._active if oid not in finished ]
+
+
+    def _add_get_response(self, response):
+        if response.error_status == ERROR_NO_SUCH_NAME \
+           and 1 <= response.error_index <= len(self._missing): # SNMP v1
+            del self._missing[response.error_index - 1]
+            return
+        elif response.error_status:
+            raise SNMPError("SNMP error: %s" % response.error_text())
+
+        for requested_oid, (oid, tag, value) in zip(self._missing, response.varbinds):
+            if tag not in [ NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW ]:
+                self.results[requested_oid].append((oid, tag, value))
+        self._missing = []
+
+
+# Formats a value like the net-snmp command line tools do it with the
+# options -OQ -OU -On -Ot: printable strings quoted, other strings as
+# quoted hex dump, numbers, IP addresses and OIDs plain.
+def format_value(tag, value):
+    if tag in [ OCTET_STRING, OPAQUE ]:
+        if tag == OCTET_STRING and _is_printable(value):
+            lines = value.replace("\\", "\\\\").replace('"', '\\"').split("\n")
+            return '"%s"' % " ".join([ lines[0] ] + [ line.strip() for line in lines[1:] ])
+        return '"%s"' % "".join([ "%02X " % ord(c) for c in value ])
+    elif value is None:
+        return ""
+    return "%s" % value
+
+
+def _is_printable(text):
+    for c in text:
+        if not (" " <= c <= "~" or c in "\t\n\r\f\v"):
+            return False
+    return True
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Walks the SNMP tables of many hosts concurrently
+
+All requests to up to max_concurrent hosts are kept in flight over a few
+shared UDP sockets. The answers are assigned to the hosts by their request
+IDs, which are unique within the poller. Each host has its own timeout and
+number of retries, just as when it is walked with a blocking
+snmp_engine.Session. Slow agents thus do not delay each other: polling
+many hosts takes about as long as polling the slowest one."""
+
+import errno
+import heapq
+import select
+import socket
+import time
+
+import cmk_base.snmp_engine as snmp_engine
+
+import cmk.log
+logger = cmk.log.get_logger(__name__)
+
+_SOCKETS_PER_FAMILY = 4
+_RECEIVE_BUFFER     = 4 * 1024 * 1024
+
+
+class _HostWalk(object):
+    def __init__(self, key, session, oids):
+        self.key        = key
+        self.session    = session
+        self.table_walk = session.table_walk(oids)
+        self.sock       = None
+        self.discovery  = False # waiting for the SNMPv3 engine discovery
+        self.round      = [] # requests of the current round
+        self.responses  = {} # request ID -> response of the current round
+
+
+    def request_finished(self, request_id):
+        return request_id in self.responses
+
+
+class Poller(object):
+    def __init__(self, max_concurrent=500):
+        self.max_concurrent = max(1, max_concurrent)
+        self.results        = {}
+        self.errors         = {}
+
+        self._sockets     = {} # family -> list of sockets
+        self._next_socket = 0
+        self._active      = set([])
+        self._requests    = {} # request ID -> (host walk, PDU, attempt)
+        self._deadlines   = [] # heap of (deadline, request ID, attempt)
+        self._request_id  = 0
+
+
+    # jobs is a list of triples of key, snmp_engine.Session and the list
+    # of OIDs to walk. Returns a pair of two dictionaries: The first one
+    # maps the keys to the walk results (see snmp_engine.TableWalk), the
+    # second one to error messages.
+    def walk(self, jobs):
+        pending = [ _HostWalk(*job) for job in reversed(jobs) ]
+        try:
+            while pending or self._active:
+                while pending and len(self._active) < self.max_concurrent:
+                    self._start(pending.pop())
+
+                self._receive(self._wait_time())
+                self._handle_timeouts()
+        finally:
+            for sockets in self._sockets.values():
+                for sock in sockets:
+                    sock.close()
+            self._sockets = {}
+
+        return self.results, self.errors
+
+
+    def _start(self, host):
+        sockets = self._sockets_of_family(host.session.family)
+        host.sock = sockets[self._next_socket % len(sockets)]
+        self._next_socket += 1
+        self._active.add(host)
+
+        if host.session.needs_engine_discovery():
+            host.discovery = True
+            host.round = [ snmp_engine.PDU(snmp_engine.GET_REQUEST, []) ]
+            self._send(host, host.round[0], 0)
+        else:
+            self._next_round(host)
+
+
+    def _sockets_of_family(self, family):
+        if family not in self._sockets:
+            sockets = []
+            for _unused_nr in range(_SOCKETS_PER_FAMILY):
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(0)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _RECEIVE_BUFFER)
+                except socket.error:
+                    pass
+                sockets.append(sock)
+            self._sockets[family] = sockets
+        return self._sockets[family]
+
+
+    def _next_round(self, host):
+        try:
+            host.round = host.table_walk.next_requests()
+        except snmp_engine.SNMPError, e:
+            self._finish(host, e)
+            return
+
+        if not host.round:
+            host.session.max_repetitions = host.table_walk.max_repetitions
+            self._finish(host)
+            return
+
+        host.responses = {}
+        for pdu in host.round:
+            self._send(host, pdu, 0)
+
+
+    def _send(self, host, pdu, attempt):
+        if attempt == 0:
+            self._request_id = self._request_id % 0x7ffffffe + 1
+            pdu.request_id = self._request_id
+
+        try:
+            host.sock.sendto(host.session.encode_request(pdu),
+                             (host.session.address, host.session.port))
+        except socket.error, e:
+            if e.args[0] not in [ errno.EAGAIN, errno.ENOBUFS ]:
+                self._finish(host, "Cannot send SNMP request to %s: %s" % (host.session.address, e))
+                return
+            # else: handled like a lost request
+
+        self._requests[pdu.request_id] = host, pdu, attempt
+        heapq.heappush(self._deadlines, (time.time() + host.session.timeout, pdu.request_id, attempt))
+
+
+    def _wait_time(self):
+        if not self._deadlines:
+            return 0
+        return max(0, self._deadlines[0][0] - time.time())
+
+
+    def _receive(self, timeout):
+        sockets = sum(self._sockets.values(), [])
+        try:
+            readable = select.select(sockets, [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for sock in readable:
+            while True:
+                try:
+                    data = sock.recv(65535)
+                except socket.error, e:
+                    if e.args[0] in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+                        break
+                    continue # e.g. ICMP port unreachable
+
+                request_id = snmp_engine.message_request_id(data)
+                if request_id not in self._requests:
+                    continue # garbage or late answer
+
+                host, request, attempt = self._requests[request_id]
+                response = host.session.decode_response(data)
+                if response is None or response.request_id != request_id:
+                    continue
+
+                del self._requests[request_id]
+                self._handle_response(host, request, attempt, response)
+
+
+    def _handle_response(self, host, request, attempt, response):
+        if host.discovery:
+            host.discovery = False
+            if host.session.needs_engine_discovery():
+                self._finish(host, "SNMPv3 engine discovery failed on %s" % host.session.address)
+            else:
+                self._next_round(host)
+            return
+
+        if response.pdu_type == snmp_engine.REPORT:
+            try:
+                host.session.handle_report(response, request)
+            except snmp_engine.SNMPError, e:
+                self._finish(host, e)
+                return
+            self._send(host, request, attempt + 1)
+            return
+
+        host.responses[request.request_id] = response
+        if len(host.responses) == len(host.round):
+            try:
+                host.table_walk.add_responses([ host.responses[pdu.request_id]
+                                                for pdu in host.round ])
+            except snmp_engine.SNMPError, e:
+                self._finish(host, e)
+                return
+            self._next_round(host)
+
+
+    def _handle_timeouts(self):
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _unused_deadline, request_id, attempt = heapq.heappop(self._deadlines)
+            entry = self._requests.get(request_id)
+            if entry is None or entry[2] != attempt:
+                continue # answered or sent again meanwhile
+
+            host, request = entry[:2]
+            if host not in self._active:
+                del self._requests[request_id]
+            elif attempt < host.session.retries:
+                self._send(host, request, attempt + 1)
+            else:
+                self._finish(host, "Timeout: No Response from %s" % host.session.address)
+
+
+    def _finish(self, host, error=None):
+        if host not in self._active:
+            return
+        self._active.remove(host)
+
+        for request in host.round:
+            self._requests.pop(request.request_id, None)
+
+        if error is None:
+            self.results[host.key] = host.table_walk.results
+        else:
+            logger.debug("SNMP error on %s: %s" % (host.session.address, error))
+            self.errors[host.key] = "%s" % error
+
+
+# Convenience wrapper, see Poller.walk()
+def walk_hosts(jobs, max_concurrent=500):
+    return Poller(max_concurrent).walk(jobs)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Sharing of SNMP walks between the tables of one host
+
+Many checks of a host walk the same subtrees of the agent, or subtrees
+of each other (e.g. a table entry and single columns of it). The walks
+needed by all checks are reduced to the subtrees not contained in other
+ones. The rows of a contained subtree are then taken from the walk of
+the containing one instead of walking it again."""
+
+
+# Returns the OID with a leading dot, the form used by the walked rows.
+# The OIDs are planned and looked up in this form only, so that OIDs
+# given with and without the leading dot are handled the same way.
+def normalize_oid(oid):
+    if oid.startswith("."):
+        return oid
+    return "." + oid
+
+
+# Returns the OIDs of the given ones which are not contained in the
+# subtree of another one, with a leading dot. The order of the OIDs
+# is kept.
+def covering_oids(oids):
+    oids = [ normalize_oid(oid) for oid in oids ]
+    covering = set([])
+    last_key = None
+    for key, oid in sorted([ (_oid_key(oid), oid) for oid in set(oids) ]):
+        # Sorted by the numeric arcs, the OIDs contained in the subtree
+        # of an OID directly follow it
+        if last_key is not None and key[:len(last_key)] == last_key:
+            continue
+        covering.add(oid)
+        last_key = key
+
+    result = []
+    for oid in oids:
+        if oid in covering and oid not in result:
+            result.append(oid)
+    return result
+
+
+# Returns the OID of the given ones whose subtree contains the given OID
+# or None, if there is no such OID. The given OIDs need to have a
+# leading dot, like the ones returned by covering_oids().
+def find_covering_oid(oid, oids):
+    oid = normalize_oid(oid)
+    while oid:
+        if oid in oids:
+            return oid
+        oid = oid[:oid.rfind(".")]
+    return None
+
+
+def _oid_key(oid):
+    return tuple([ int(arc) for arc in oid.split(".") if arc ])
+
+
+class Subtree(object):
+    """The rows of a walked subtree
+
+    The rows are pairs of OID and value. The rows of the contained
+    subtrees are looked up by the first arc below the walked OID, so
+    taking all columns of a walked table entry is done in linear time."""
+
+    def __init__(self, oid, rows):
+        super(Subtree, self).__init__()
+        self.oid      = oid
+        self.rows     = rows
+        self._by_arc  = None
+
+
+    # Returns the rows of the given OID, which must be the walked OID
+    # or an OID in its subtree, in the order they have been walked.
+    def rows_of(self, oid):
+        if oid == self.oid:
+            return self.rows
+
+        prefix = self.oid + "."
+        if not oid.startswith(prefix):
+            raise ValueError("OID %s is not in the subtree of %s" % (oid, self.oid))
+
+        sub_oid = oid[len(prefix):]
+        rows = self._rows_by_arc().get(sub_oid.split(".", 1)[0], [])
+        if "." not in sub_oid:
+            return rows
+
+        oid_prefix = oid + "."
+        return [ row for row in rows if row[0] == oid or row[0].startswith(oid_prefix) ]
+
+
+    def _rows_by_arc(self):
+        if self._by_arc is None:
+            prefix = self.oid + "."
+            prefix_length = len(prefix)
+            self._by_arc = {}
+            for row in self.rows:
+                if row[0].startswith(prefix):
+                    arc = row[0][prefix_length:].split(".", 1)[0]
+                    self._by_arc.setdefault(arc, []).append(row)
+        return self._by_arc
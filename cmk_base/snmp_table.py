@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Assembly of SNMP tables from the walked columns
+
+The columns of a table are walked one after the other. Some devices
+omit entries in some columns, so the end OIDs of all columns are
+collected and the gaps are filled with empty values before the columns
+are turned into rows. All of this is done in linear time (plus sorting,
+if the device does not return the OIDs in order), which matters for
+tables with tens of thousands of rows."""
+
+
+# columns is a list of triples of the fetch OID, the walked pairs of OID
+# and value and the value encoding. Returns a list of pairs of the values
+# of the columns - with the gaps filled - and the value encoding.
+def sanitize_columns(columns):
+    # First compute the complete list of end-oids appearing in the output
+    endoids, positions, column_endoids = _collect_endoids(columns)
+
+    # The list needs to be sorted to prevent problems when the first
+    # column has missing values in the middle of the tree. The columns
+    # are sorted, too, to make them comparable to the sorted list.
+    if len(endoids) > 1:
+        keys = [ _oid_key(endoid) for endoid in endoids ]
+        if not _is_ascending(keys):
+            key_of = dict(zip(endoids, keys))
+            column_endoids = [ _sort_column(fetchoid, column, endoids_of_column, key_of)
+                               for (fetchoid, column, _unused_value_encoding), endoids_of_column
+                               in zip(columns, column_endoids) ]
+
+            endoids = [ endoid for _unused_key, endoid in sorted(zip(keys, endoids),
+                                                                  key=lambda entry: entry[0]) ]
+            positions = dict([ (endoid, index) for index, endoid in enumerate(endoids) ])
+
+    num_endoids = len(endoids)
+    new_columns = []
+    for (_unused_fetchoid, column, value_encoding), endoids_of_column in zip(columns, column_endoids):
+        values = [ value for _unused_oid, value in column ]
+        if len(values) != num_endoids:
+            values = _fill_gaps(values, endoids_of_column, positions, num_endoids)
+        new_columns.append((values, value_encoding))
+
+    return new_columns
+
+
+# Returns the end OIDs of all columns in the order of their first
+# appearance, their positions in this list and the end OIDs per column
+def _collect_endoids(columns):
+    endoids = []
+    positions = {}
+    column_endoids = []
+    for fetchoid, column, _unused_value_encoding in columns:
+        endoids_of_column = _endoids_of_column(fetchoid, column)
+        column_endoids.append(endoids_of_column)
+        for endoid in endoids_of_column:
+            if endoid not in positions:
+                positions[endoid] = len(endoids)
+                endoids.append(endoid)
+    return endoids, positions, column_endoids
+
+
+def _endoids_of_column(fetchoid, column):
+    prefix_length = len(fetchoid)
+    return [ oid[prefix_length:].lstrip(".") for oid, _unused_value in column ]
+
+
+# Sorts the column by the OIDs in place and returns its sorted end OIDs.
+# When all OIDs are below the fetch OID, the order of the end OIDs is the
+# same and their already computed keys are used.
+def _sort_column(fetchoid, column, endoids_of_column, key_of):
+    prefix = fetchoid + "."
+    for oid, _unused_value in column:
+        if oid != fetchoid and not oid.startswith(prefix):
+            column.sort(key=lambda pair: _oid_key(pair[0].lstrip(".")))
+            return _endoids_of_column(fetchoid, column)
+
+    decorated = sorted(zip([ key_of[endoid] for endoid in endoids_of_column ],
+                           endoids_of_column, column), key=lambda entry: entry[0])
+    column[:] = [ pair for _unused_key, _unused_endoid, pair in decorated ]
+    return [ endoid for _unused_key, endoid, _unused_pair in decorated ]
+
+
+def _oid_key(oid):
+    if oid:
+        return tuple(map(int, oid.split(".")))
+    return ()
+
+
+def _is_ascending(keys):
+    for index in xrange(len(keys) - 1):
+        if keys[index] > keys[index + 1]: # == should never happen
+            return False
+    return True
+
+
+# Each value is put at the position of its end OID. Values which would
+# have to be put in front of their predecessor are appended behind all
+# end OIDs instead, just like the former implementation did it.
+def _fill_gaps(values, endoids_of_column, positions, num_endoids):
+    filled = []
+    index = 0
+    for value, endoid in zip(values, endoids_of_column):
+        position = positions[endoid]
+        if position < index:
+            position = num_endoids
+        if position > index:
+            filled.extend([""] * (position - index))
+            index = position
+        filled.append(value)
+        index += 1
+
+    if index < num_endoids:
+        filled.extend([""] * (num_endoids - index))
+    return filled
+
+
+# Turns the list of columns into a list of rows
+def construct_rows(columns):
+    if not columns:
+        return []
+
+    num_rows = len(columns[0])
+    for column in columns:
+        if len(column) != num_rows:
+            # The rows are defined by the first column. Fails on shorter
+            # columns, like the former implementation did.
+            return [ [ column[index] for column in columns ] for index in xrange(num_rows) ]
+
+    return map(list, zip(*columns))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; py-indent-offset: 4 -*-
+# +------------------------------------------------------------------+
+# |             ____ _               _        __  __ _  __           |
+# |            / ___| |__   ___  ___| | __   |  \/  | |/ /           |
+# |           | |   | '_ \ / _ \/ __| |/ /   | |\/| | ' /            |
+# |           | |___| | | |  __/ (__|   <    | |  | | . \            |
+# |            \____|_| |_|\___|\___|_|\_\___|_|  |_|_|\_\           |
+# |                                                                  |
+# | Copyright Mathias Kettner 2014             mk@mathias-kettner.de |
+# +------------------------------------------------------------------+
+#
+# This file is part of Check_MK.
+# The official homepage is at http://mathias-kettner.de/check_mk.
+#
+# check_mk is free software;  you can redistribute it and/or modify it
+# under the  terms of the  GNU General Public License  as published by
+# the Free Software Foundation in version 2.  check_mk is  distributed
+# in the hope that it will be useful, but WITHOUT ANY WARRANTY;  with-
+# out even the implied warranty of  MERCHANTABILITY  or  FITNESS FOR A
+# PARTICULAR PURPOSE. See the  GNU General Public License for more de-
+# tails. You should have  received  a copy of the  GNU  General Public
+# License along with GNU Make; see the file  COPYING.  If  not,  write
+# to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
+# Boston, MA 02110-1301 USA.
+
+"""Indexed access to stored SNMP walks
+
+A stored walk is a text file with one line per OID, as written by
+"cmk --snmpwalk". To look up OIDs without reading and parsing the whole
+file, an index is built once per walk file and stored in a separate
+file:
+
+    "CMKWALKX", version (uint16), size (uint64) and mtime (double) of
+    the walk file, number of entries (uint32)
+    per entry plus one: offset of the key in the key data (uint64)
+    per entry: offset of the line in the walk file (uint64)
+    the key data: the keys of all entries
+
+The key of an entry is its OID encoded as sequence of uint32 in network
+byte order. Comparing two keys is thus the same as comparing the OIDs
+numerically and the keys of the OIDs in a subtree all start with the key
+of the subtree. The entries are sorted by their keys. Both files are
+read via mmap, so a lookup only touches the pages it needs."""
+
+import mmap
+import os
+import struct
+
+import cmk.store as store
+
+MAGIC   = "CMKWALKX"
+VERSION = 1
+
+_header_struct = struct.Struct("!8sHQdI")
+_offset_struct = struct.Struct("!Q")
+
+
+class StoredWalk(object):
+    """A stored walk file together with its index
+
+    The index is read from index_path. If it is missing or does not
+    belong to the current walk file, it is built and written to
+    index_path. Raises IOError, if the walk file cannot be read."""
+
+    def __init__(self, path, index_path):
+        super(StoredWalk, self).__init__()
+        self._walk = _map_file(path)
+        stat = os.stat(path)
+
+        self._index = None
+        try:
+            self._index = _map_file(index_path)
+            if not self._is_valid_index(stat):
+                self._index.close()
+                self._index = None
+        except (IOError, OSError):
+            pass
+
+        if self._index is None:
+            data = build_index(self._walk, stat.st_size, stat.st_mtime)
+            try:
+                index_dir = os.path.dirname(index_path)
+                if not os.path.exists(index_dir):
+                    os.makedirs(index_dir)
+                store.save_file(index_path, data)
+            except Exception:
+                pass # e.g. not permitted to write the index, keep it in memory
+            self._index = data
+
+        self._num_entries = _header_struct.unpack_from(self._index, 0)[4]
+        self._key_offsets = _header_struct.size
+        self._line_offsets = self._key_offsets + (self._num_entries + 1) * _offset_struct.size
+        self._keys = self._line_offsets + self._num_entries * _offset_struct.size
+
+
+    def close(self):
+        for data in [ self._walk, self._index ]:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+    def _is_valid_index(self, stat):
+        if len(self._index) < _header_struct.size:
+            return False
+
+        magic, version, size, mtime, num_entries = _header_struct.unpack_from(self._index, 0)
+        if magic != MAGIC or version != VERSION or size != stat.st_size or mtime != stat.st_mtime:
+            return False
+
+        keys = _header_struct.size + (2 * num_entries + 1) * _offset_struct.size
+        return len(self._index) >= keys \
+           and len(self._index) == keys + _offset_struct.unpack_from(self._index,
+                        _header_struct.size + num_entries * _offset_struct.size)[0]
+
+
+    # Returns the lines of the OIDs in the subtree of the given OID as
+    # pairs of the OID and the rest of the line (including the line
+    # break). The OID itself is only included if include_oid is set.
+    def rows(self, oid, include_oid=True):
+        key = _valid_oid_key(oid)
+
+        rows = []
+        index = self._bisect(key)
+        while index < self._num_entries:
+            entry_key = self._key(index)
+            if not entry_key.startswith(key):
+                break
+            if include_oid or entry_key != key:
+                rows.append(self._line(index))
+            index += 1
+        return rows
+
+
+    # Returns the line of the first OID in the subtree below the given
+    # OID (the OID itself excluded) or None if there is no such OID
+    def first_row_below(self, oid):
+        key = _valid_oid_key(oid)
+
+        index = self._bisect(key)
+        if index < self._num_entries and self._key(index) == key:
+            index += 1
+        if index < self._num_entries and self._key(index).startswith(key):
+            return self._line(index)
+        return None
+
+
+    def _bisect(self, key):
+        low, high = 0, self._num_entries
+        while low < high:
+            middle = (low + high) / 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+    def _key(self, index):
+        pos = self._key_offsets + index * _offset_struct.size
+        start = _offset_struct.unpack_from(self._index, pos)[0]
+        end = _offset_struct.unpack_from(self._index, pos + _offset_struct.size)[0]
+        return self._index[self._keys + start:self._keys + end]
+
+
+    def _line(self, index):
+        start = _offset_struct.unpack_from(self._index, self._line_offsets
+                                                        + index * _offset_struct.size)[0]
+        end = self._walk.find("\n", start)
+        if end == -1:
+            end = len(self._walk)
+        else:
+            end += 1
+
+        parts = self._walk[start:end].split(None, 1)
+        if len(parts) > 1:
+            return parts[0], parts[1]
+        return parts[0], ""
+
+
+# Returns the key of an OID or None for invalid OIDs
+def oid_key(oid):
+    try:
+        arcs = map(int, oid.strip(".").split("."))
+        return struct.pack("!%dI" % len(arcs), *arcs)
+    except (ValueError, struct.error):
+        return None
+
+
+def _valid_oid_key(oid):
+    key = oid_key(oid)
+    if key is None:
+        raise ValueError("Invalid OID %s" % oid)
+    return key
+
+
+# Returns the index of the given walk data. Lines not starting with a
+# valid OID are skipped.
+def build_index(walk, size, mtime):
+    entries = []
+    offset = 0
+    while offset < len(walk):
+        end = walk.find("\n", offset)
+        if end == -1:
+            end = len(walk)
+
+        parts = walk[offset:end].split(None, 1)
+        if parts:
+            key = oid_key(parts[0])
+            if key is not None:
+                entries.append((key, offset))
+        offset = end + 1
+
+    # Python sorts stably, so duplicate OIDs keep the order of the file
+    entries.sort(key=lambda entry: entry[0])
+
+    key_offsets = [ 0 ]
+    for key, _unused_offset in entries:
+        key_offsets.append(key_offsets[-1] + len(key))
+
+    return "".join([ _header_struct.pack(MAGIC, VERSION, size, mtime, len(entries)),
+                     struct.pack("!%dQ" % len(key_offsets), *key_offsets),
+                     struct.pack("!%dQ" % len(entries), *[ o for _unused_key, o in entries ]) ]
+                   + [ key for key, _unused_offset in entries ])
+
+
+def _map_file(path):
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ""
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
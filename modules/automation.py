@@ -141,6 +141,7 @@ def do_automation(cmd, args):
         sys.stdout.write(pprint.pformat(result)+"\n")
     else:
         sys.stdout.write("%r\n" % (result,))
+    save_persistent_caches()
     output_profile()
     sys.exit(0)
 
@@ -251,6 +252,7 @@ def automation_get_autochecks(args):
     hostname = args[0]
     result = []
     for ct, item, paramstring in parse_autochecks_file(hostname):
+        load_check_plugins_referenced_by(paramstring)
         result.append((ct, item, eval(paramstring), paramstring))
     return result
 
@@ -849,12 +851,18 @@ def rename_host_files(oldname, newname):
     if rename_host_dir(cmk.paths.tmp_dir + "/piggyback/", oldname, newname):
         actions.append("piggyback-load")
 
-    # Rename piggy files *created* by the host
+    # Rename piggy files *created* by the host. The index of the piggyback
+    # directory is rebuilt on the next access.
     piggybase = cmk.paths.tmp_dir + "/piggyback/"
     if os.path.exists(piggybase):
         for piggydir in os.listdir(piggybase):
             if rename_host_file(piggybase + piggydir, oldname, newname):
                 actions.append("piggyback-pig")
+                try:
+                    os.remove(piggybase + piggydir + "/" + cmk_base.piggyback.INDEX_NAME)
+                except OSError:
+                    pass
+    rename_host_file(cmk.paths.tmp_dir + "/piggyback_sources/", oldname, newname)
 
     # Logwatch
     if rename_host_dir(cmk.paths.logwatch_dir, oldname, newname):
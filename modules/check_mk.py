@@ -44,6 +44,7 @@ import subprocess
 import fcntl
 import py_compile
 import inspect
+import hashlib
 
 from cStringIO import StringIO
 
@@ -58,6 +59,9 @@ import cmk.render as render
 import cmk.man_pages as man_pages
 
 import cmk_base.console as console
+import cmk_base.cache_file
+import cmk_base.packed_config
+import cmk_base.parent_scan
 
 #   .--Prelude-------------------------------------------------------------.
 #   |                  ____           _           _                        |
@@ -331,39 +335,33 @@ special_agent_info                 = {}
 # values user can override those variables in his configuration.
 # If a check or check.include is both found in local/ and in the
 # normal structure, then only the file in local/ must be read!
-def load_checks():
-    filelist = plugin_pathnames_in_directory(cmk.paths.local_checks_dir) \
-             + plugin_pathnames_in_directory(cmk.paths.checks_dir)
-
-    # read include files always first, but still in the sorted
-    # order with local ones last (possibly overriding variables)
-    filelist = [ f for f in filelist if f.endswith(".include") ] + \
-               [ f for f in filelist if not f.endswith(".include") ]
+#
+# With lazy=True the plugin files are not read here. Instead they are
+# loaded on demand, when one of the things they define is needed. This
+# is based on the check plugin index (see below). When the index is
+# outdated all plugins are loaded and the index is rebuilt.
+def load_checks(lazy=False):
+    filelist = check_plugin_filelist()
+    files_state = check_plugin_files_state(filelist)
+    index = read_check_plugin_index(files_state)
+
+    if lazy and index:
+        activate_lazy_check_loading(index)
+        return
 
-    varname = None
-    value = None
     ignored_variable_types = [ type(lambda: None), type(os) ]
 
     known_vars = set(globals().keys()) # track new configuration variables
 
-    loaded_files = set()
+    plugins = {}
     for f in filelist:
-        if not f.endswith("~"): # ignore emacs-like backup files
-            file_name = f.rsplit("/", 1)[-1]
-            if file_name not in loaded_files:
-                try:
-                    loaded_files.add(file_name)
-                    execfile(f, globals())
-                except Exception, e:
-                    sys.stderr.write("Error in plugin file %s: %s\n" % (f, e))
-                    if cmk.debug.enabled():
-                        raise
-                    # If we exit here, from a check_mk helper, check_mk will just
-                    # try to restart the helper. This causes a tight loop of helper
-                    # crashing and helper restarting that spams the log file and
-                    # causes high cpu load which is a bit pointless because an
-                    # invalid plugin file isn't going to fix itself
-                    #sys.exit(5)
+        if index is None:
+            before = check_plugin_namespace_snapshot()
+
+        load_check_plugin_file(f)
+
+        if index is None:
+            plugins[f] = check_plugin_definitions(f, before)
 
     for varname, value in globals().iteritems():
         if varname[0] != '_' \
@@ -375,6 +373,45 @@ def load_checks():
     convert_check_info()
     verify_checkgroup_members()
 
+    if index is None:
+        write_check_plugin_index(files_state, filelist, plugins)
+
+
+# Returns the plugin files in the order they are loaded
+def check_plugin_filelist():
+    filelist = plugin_pathnames_in_directory(cmk.paths.local_checks_dir) \
+             + plugin_pathnames_in_directory(cmk.paths.checks_dir)
+
+    # read include files always first, but still in the sorted
+    # order with local ones last (possibly overriding variables)
+    filelist = [ f for f in filelist if f.endswith(".include") ] + \
+               [ f for f in filelist if not f.endswith(".include") ]
+
+    loaded_files = set()
+    result = []
+    for f in filelist:
+        if not f.endswith("~"): # ignore emacs-like backup files
+            file_name = f.rsplit("/", 1)[-1]
+            if file_name not in loaded_files:
+                loaded_files.add(file_name)
+                result.append(f)
+    return result
+
+
+def load_check_plugin_file(f):
+    try:
+        execfile(f, globals())
+    except Exception, e:
+        sys.stderr.write("Error in plugin file %s: %s\n" % (f, e))
+        if cmk.debug.enabled():
+            raise
+        # If we exit here, from a check_mk helper, check_mk will just
+        # try to restart the helper. This causes a tight loop of helper
+        # crashing and helper restarting that spams the log file and
+        # causes high cpu load which is a bit pointless because an
+        # invalid plugin file isn't going to fix itself
+        #sys.exit(5)
+
 
 def checks_by_checkgroup():
     groups = {}
@@ -412,6 +449,339 @@ def verify_checkgroup_members():
                                      "Without item: %s)" % (group_name, ", ".join(with_item), ", ".join(without_item)))
 
 
+#.
+#   .--Plugin index--------------------------------------------------------.
+#   |         ____  _             _         _           _                  |
+#   |        |  _ \| |_   _  __ _(_)_ __   (_)_ __   __| | _____  __       |
+#   |        | |_) | | | | |/ _` | | '_ \  | | '_ \ / _` |/ _ \ \/ /       |
+#   |        |  __/| | |_| | (_| | | | | | | | | | | (_| |  __/>  <        |
+#   |        |_|   |_|\__,_|\__, |_|_| |_| |_|_| |_|\__,_|\___/_/\_\       |
+#   |                       |___/                                          |
+#   +----------------------------------------------------------------------+
+#   | The check plugin index records for each plugin file which global     |
+#   | names and which entries of the plugin dictionaries (check_info,      |
+#   | factory_settings, ...) it defines and which plugin files it depends  |
+#   | on. Operation modes needing only a few checks use it to load only    |
+#   | the plugins really needed (see LazyCheckPluginDict).                 |
+#   '----------------------------------------------------------------------'
+
+# The dictionaries filled by the check plugins
+check_plugin_dicts = [ "check_info", "check_includes", "precompile_params",
+                       "check_default_levels", "factory_settings", "checkgroup_of",
+                       "snmp_info", "snmp_scan_functions", "active_check_info",
+                       "special_agent_info" ]
+
+# These dictionaries are also filled by convert_check_info() with the
+# base name of a check type as key
+check_plugin_dicts_by_basename = [ "check_includes", "snmp_info", "snmp_scan_functions" ]
+
+g_lazy_check_plugins = None # information needed for loading plugins on demand
+
+def check_plugin_index_path():
+    return cmk.paths.var_dir + "/check_plugin_index"
+
+
+def check_plugin_files_state(filelist):
+    files_state = {}
+    for f in filelist:
+        st = os.stat(f)
+        files_state[f] = st.st_mtime, st.st_size
+    return files_state
+
+
+# Returns the index, if it is valid for the current plugin files
+def read_check_plugin_index(files_state):
+    try:
+        index = cmk_base.cache_file.load(check_plugin_index_path(), "index")
+    except (IOError, cmk_base.cache_file.MKCacheFormatError):
+        return None
+
+    if index["version"] != cmk.__version__ or index["files"] != files_state:
+        console.verbose("Check plugin index is outdated\n")
+        return None
+
+    return index
+
+
+def write_check_plugin_index(files_state, filelist, plugins):
+    # Names defined by multiple plugins depend on all of them
+    definitions = {}
+    for f in filelist:
+        for name in plugins[f]["names"]:
+            definitions.setdefault(name, []).append(f)
+
+    # Names defined by the plugin itself, e.g. loop variables, do not
+    # introduce dependencies
+    for f in filelist:
+        depends = set([])
+        for name in plugins[f].pop("used_names").difference(plugins[f]["names"]):
+            depends.update(definitions.get(name, []))
+        plugins[f]["depends"] = sorted(depends)
+
+    index = {
+        "version" : cmk.__version__,
+        "files"   : files_state,
+        "order"   : filelist,
+        "plugins" : plugins,
+    }
+
+    try:
+        cmk_base.cache_file.save(check_plugin_index_path(), [ ("index", index) ])
+    except Exception, e:
+        if cmk.debug.enabled():
+            raise
+        console.verbose("Cannot write check plugin index: %s\n" % e)
+
+
+def check_plugin_namespace_snapshot():
+    return dict(globals()), \
+           dict([ (name, dict(globals()[name])) for name in check_plugin_dicts ])
+
+
+# Determines what a plugin has defined by comparing the namespace with
+# the snapshot taken before executing the plugin. Also finds out which
+# global names the plugin uses.
+def check_plugin_definitions(f, before):
+    global_vars, plugin_dicts = before
+    ignored_variable_types = [ type(lambda: None), type(os) ]
+    missing = object()
+
+    names, variables = [], []
+    for name, value in globals().iteritems():
+        if global_vars.get(name, missing) is not value:
+            names.append(name)
+            if name[0] != '_' and type(value) not in ignored_variable_types:
+                variables.append(name)
+
+    dict_keys = {}
+    for name, entries in plugin_dicts.items():
+        keys = [ key for key, value in globals()[name].iteritems()
+                 if entries.get(key, missing) is not value ]
+        if keys:
+            dict_keys[name] = keys
+
+    try:
+        used_names = code_names(compile(file(f).read() + "\n", f, "exec"))
+    except SyntaxError:
+        used_names = set([])
+
+    return {
+        "names"      : names,
+        "variables"  : variables,
+        "dict_keys"  : dict_keys,
+        "used_names" : used_names,
+    }
+
+
+# Returns all names used by a code object and the code objects nested
+# within it (e.g. function definitions)
+def code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if type(const) == type(code):
+            names.update(code_names(const))
+    return names
+
+
+def activate_lazy_check_loading(index):
+    global g_lazy_check_plugins
+
+    # Lookup tables from the defined names and keys to the plugin files
+    names, dict_keys = {}, {}
+    for f in index["order"]:
+        plugin = index["plugins"][f]
+        for name in plugin["names"]:
+            names.setdefault(name, []).append(f)
+
+        for dict_name, keys in plugin["dict_keys"].items():
+            for key in keys:
+                dict_keys.setdefault((dict_name, key), []).append(f)
+
+                if dict_name == "check_info":
+                    basename = key.split(".")[0]
+                    for basename_dict in check_plugin_dicts_by_basename:
+                        dict_keys.setdefault((basename_dict, basename), []).append(f)
+
+        for varname in plugin["variables"]:
+            if varname not in globals():
+                config_variable_names.add(varname)
+
+    g_lazy_check_plugins = {
+        "index"         : index,
+        "positions"     : dict([ (f, nr) for nr, f in enumerate(index["order"]) ]),
+        "names"         : names,
+        "dict_keys"     : dict_keys,
+        "loaded"        : set([]),
+        "config_loaded" : False,
+    }
+
+    for dict_name in check_plugin_dicts:
+        globals()[dict_name] = LazyCheckPluginDict(dict_name, globals()[dict_name])
+
+
+# Loads the given plugin files and all files they depend on, in the
+# order of the regular loading
+def load_check_plugins(filelist):
+    lazy = g_lazy_check_plugins
+    plugins = lazy["index"]["plugins"]
+
+    needed = set([])
+    todo = [ f for f in filelist if f not in lazy["loaded"] ]
+    while todo:
+        f = todo.pop()
+        if f not in needed and f not in lazy["loaded"]:
+            needed.add(f)
+            todo += plugins[f]["depends"]
+
+    if not needed:
+        return False
+
+    check_types = []
+    for f in sorted(needed, key=lambda f: lazy["positions"][f]):
+        if f in lazy["loaded"]:
+            continue # already loaded while loading another plugin
+
+        console.vverbose("Loading check plugin %s\n" % f)
+        lazy["loaded"].add(f)
+        load_check_plugin_file(f)
+        check_types += plugins[f]["dict_keys"].get("check_info", [])
+
+    convert_check_info(check_types)
+
+    # Plugins loaded after reading the configuration need to be
+    # initialized like read_config_files() does it for the others
+    if lazy["config_loaded"]:
+        initialize_default_levels_variables([ check_info[t] for t in check_types ])
+
+    return True
+
+
+def load_all_check_plugins():
+    if len(g_lazy_check_plugins["loaded"]) < len(g_lazy_check_plugins["index"]["order"]):
+        load_check_plugins(g_lazy_check_plugins["index"]["order"])
+        verify_checkgroup_members()
+
+
+# Loads the plugins defining the given key of a plugin dictionary
+def load_check_plugins_defining(dict_name, key):
+    return load_check_plugins(g_lazy_check_plugins["dict_keys"].get((dict_name, key), []))
+
+
+# Loads the plugins defining global names used in the given source
+# code, e.g. the default levels variables set in a configuration file.
+# Private names of the plugins (starting with _) are not considered.
+def load_check_plugins_referenced_by(source):
+    if not g_lazy_check_plugins:
+        return
+
+    load_check_plugins_of_names(set(regex("[A-Za-z][A-Za-z0-9_]*").findall(source)))
+
+
+# Loads the check plugins defining one of the given names
+def load_check_plugins_of_names(names):
+    if not g_lazy_check_plugins:
+        return
+
+    plugin_names = g_lazy_check_plugins["names"]
+    filelist = []
+    for name in names:
+        filelist += plugin_names.get(name, [])
+    load_check_plugins(filelist)
+
+
+# Returns the check_info entries of the checks loaded so far
+def loaded_checks():
+    if g_lazy_check_plugins:
+        return dict.values(check_info)
+    return check_info.values()
+
+
+# Replaces the dictionaries filled by the check plugins when the plugins
+# are loaded on demand. Looking up a missing key loads the plugins
+# defining it. Accessing all entries loads all plugins.
+class LazyCheckPluginDict(dict):
+    def __init__(self, name, *args):
+        super(LazyCheckPluginDict, self).__init__(*args)
+        self._name = name
+
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            if not load_check_plugins_defining(self._name, key):
+                raise
+            return dict.__getitem__(self, key)
+
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        return load_check_plugins_defining(self._name, key) and dict.__contains__(self, key)
+
+
+    def has_key(self, key):
+        return key in self
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+    def __iter__(self):
+        load_all_check_plugins()
+        return dict.__iter__(self)
+
+
+    def __len__(self):
+        load_all_check_plugins()
+        return dict.__len__(self)
+
+
+    def keys(self):
+        load_all_check_plugins()
+        return dict.keys(self)
+
+
+    def values(self):
+        load_all_check_plugins()
+        return dict.values(self)
+
+
+    def items(self):
+        load_all_check_plugins()
+        return dict.items(self)
+
+
+    def iterkeys(self):
+        load_all_check_plugins()
+        return dict.iterkeys(self)
+
+
+    def itervalues(self):
+        load_all_check_plugins()
+        return dict.itervalues(self)
+
+
+    def iteritems(self):
+        load_all_check_plugins()
+        return dict.iteritems(self)
+
+
+    def copy(self):
+        load_all_check_plugins()
+        return dict(dict.items(self))
+
+
 #.
 #   .--Checks--------------------------------------------------------------.
 #   |                    ____ _               _                            |
@@ -827,53 +1197,66 @@ def host_extra_conf_merged(hostname, conf):
             rule_dict.setdefault(key, value)
     return rule_dict
 
-g_in_binary_hostlist_cache = {}
-g_global_caches.append("g_in_binary_hostlist_cache")
+g_converted_binary_hostlists_cache = {}
+g_global_caches.append("g_converted_binary_hostlists_cache")
 def in_binary_hostlist(hostname, conf):
-    cache_id = id(conf), hostname
-
     # if we have just a list of strings just take it as list of hostnames
     if conf and type(conf[0]) == str:
-        result = hostname in conf
-        g_in_binary_hostlist_cache[cache_id] = result
+        return hostname in conf
+
+    # The rules are compiled for all configured hosts. This must not use
+    # all_active_hosts(), since only_hosts is evaluated here to compute
+    # the active hosts. Other host names (e.g. hosts that are not part
+    # of the configuration) are matched against the rules one by one.
+    if hostname in all_configured_hosts():
+        try:
+            rules = g_converted_binary_hostlists_cache[id(conf)]
+        except KeyError:
+            rules = convert_binary_hostlist(conf, host_index(with_foreign_hosts=True))
+            g_converted_binary_hostlists_cache[id(conf)] = rules
     else:
-        for entry in conf:
-            entry, rule_options = get_rule_options(entry)
-            if rule_options.get("disabled"):
-                continue
+        rules = convert_binary_hostlist(conf, make_host_index([hostname]))
 
-            try:
-                # Negation via 'NEGATE'
-                if entry[0] == NEGATE:
-                    entry = entry[1:]
-                    negate = True
-                else:
-                    negate = False
-                # entry should be one-tuple or two-tuple. Tuple's elements are
-                # lists of strings. User might forget comma in one tuple. Then the
-                # entry is the list itself.
-                if type(entry) == list:
-                    hostlist = entry
+    for negate, hosts in rules:
+        if hostname in hosts:
+            return not negate
+    return False
+
+
+def convert_binary_hostlist(conf, index):
+    new_rules = []
+    for entry in conf:
+        entry, rule_options = get_rule_options(entry)
+        if rule_options.get("disabled"):
+            continue
+
+        try:
+            # Negation via 'NEGATE'
+            if entry[0] == NEGATE:
+                entry = entry[1:]
+                negate = True
+            else:
+                negate = False
+            # entry should be one-tuple or two-tuple. Tuple's elements are
+            # lists of strings. User might forget comma in one tuple. Then the
+            # entry is the list itself.
+            if type(entry) == list:
+                hostlist = entry
+                tags = []
+            else:
+                if len(entry) == 1: # 1-Tuple with list of hosts
+                    hostlist = entry[0]
                     tags = []
                 else:
-                    if len(entry) == 1: # 1-Tuple with list of hosts
-                        hostlist = entry[0]
-                        tags = []
-                    else:
-                        tags, hostlist = entry
+                    tags, hostlist = entry
 
-                if hosttags_match_taglist(tags_of_host(hostname), tags) and \
-                       in_extraconf_hostlist(hostlist, hostname):
-                    g_in_binary_hostlist_cache[cache_id] = not negate
-                    break
+            new_rules.append((negate, hosts_matching_rule(index, tags, hostlist)))
 
-            except:
-                MKGeneralException("Invalid entry '%r' in host configuration list: "
-                                   "must be tupel with 1 or 2 entries" % (entry,))
-        else:
-            g_in_binary_hostlist_cache[cache_id] = False
+        except:
+            MKGeneralException("Invalid entry '%r' in host configuration list: "
+                               "must be tupel with 1 or 2 entries" % (entry,))
 
-    return g_in_binary_hostlist_cache[cache_id]
+    return new_rules
 
 
 # Pick out the last element of an entry if it is a dictionary.
@@ -944,30 +1327,161 @@ def all_matching_hosts(tags, hostlist, with_foreign_hosts):
     except KeyError:
         pass
 
+    matching = hosts_matching_rule(host_index(with_foreign_hosts), tags, hostlist)
+    g_hostlist_match_cache[cache_id] = matching
+    return matching
+
+
+# The host index is the base for matching the rules against all hosts
+# at once. The hosts are bucketed by their tags, so the tag conditions
+# of a rule need to be evaluated only once per distinct set of tags
+# instead of once per host.
+g_host_index_cache = {}
+g_global_caches.append('g_host_index_cache')
+def host_index(with_foreign_hosts):
+    try:
+        return g_host_index_cache[with_foreign_hosts]
+    except KeyError:
+        pass
+
     if with_foreign_hosts:
         valid_hosts = all_configured_hosts()
     else:
         valid_hosts = all_active_hosts()
 
-    # Speed up matching process by filter out single matches
-    matching = set([])
-    if not tags and not [x for x in hostlist if x[0] in ["@", "!", "~"]]:
-        for hostname in hostlist:
-            if hostname in valid_hosts:
-                matching.add(hostname)
-    elif not tags and len(hostlist) == 1 and "@all" in hostlist:
-        matching.update(set(valid_hosts))
+    index = make_host_index(valid_hosts)
+    g_host_index_cache[with_foreign_hosts] = index
+    return index
+
+
+def make_host_index(hostnames):
+    tag_buckets = {}
+    for hostname in hostnames:
+        tag_buckets.setdefault(tuple(tags_of_host(hostname)), set()).add(hostname)
+
+    hosts = set(hostnames)
+    return {
+        "hosts"       : hosts,
+        "clusters"    : hosts.intersection(all_configured_clusters()),
+        "tag_buckets" : tag_buckets,
+    }
+
+
+# Returns the set of all hosts of the host index that are matched by
+# the tag and host list conditions of a rule
+def hosts_matching_rule(index, tags, hostlist):
+    if tags:
+        candidates = set([])
+        for bucket_tags, hostnames in index["tag_buckets"].items():
+            if hosttags_match_taglist(bucket_tags, tags):
+                candidates.update(hostnames)
     else:
-        for hostname in valid_hosts:
-            # When no tag matching is requested, do not filter by tags. Accept all hosts
-            # and filter only by hostlist
-            if in_extraconf_hostlist(hostlist, hostname) and \
-               (not tags or hosttags_match_taglist(tags_of_host(hostname), tags)):
-               matching.add(hostname)
+        candidates = index["hosts"]
+
+    return hosts_matching_hostlist(candidates, index["clusters"], hostlist)
+
+
+# Set based variant of in_extraconf_hostlist(): Returns the subset of the
+# candidate hosts matched by the host list. The entries are applied in
+# reverse order, so that the first matching entry of the list decides
+# about each host, just as in in_extraconf_hostlist().
+def hosts_matching_hostlist(candidates, clusters, hostlist):
+    # Migration help: print error if old format appears in config file
+    if hostlist and hostlist[0] == "":
+        raise MKGeneralException('Invalid empty entry [ "" ] in configuration')
+
+    entries = []
+    regex_entries = []
+    for nr, hostentry in enumerate(hostlist):
+        if hostentry == '':
+            raise MKGeneralException('Empty hostname in host list %r' % hostlist)
+
+        if hostentry in [ '@all', '@cluster', '@physical' ]:
+            entries.append((False, hostentry, None))
+            continue
+
+        negate = False
+        if hostentry[0] != '@':
+            # Allow negation of hostentry with prefix '!'
+            if hostentry[0] == '!':
+                hostentry = hostentry[1:]
+                negate = True
+            # Allow regex with prefix '~'
+            if hostentry[:1] == '~':
+                regex_entries.append((nr, hostentry[1:]))
+                entries.append((negate, "~", nr))
+                continue
+
+        entries.append((negate, "=", hostentry))
+
+    if regex_entries:
+        regex_matches = hosts_matching_regexes(candidates, regex_entries)
+
+    matching = set([])
+    for negate, how, value in reversed(entries):
+        if how == "=":
+            if negate:
+                matching.discard(value)
+            elif value in candidates:
+                matching.add(value)
+            continue
+
+        if how == "~":
+            hosts = regex_matches[value]
+        elif how == "@all":
+            hosts = candidates
+        elif how == "@cluster":
+            hosts = candidates.intersection(clusters)
+        else:
+            hosts = candidates.difference(clusters)
+
+        if negate:
+            matching.difference_update(hosts)
+        else:
+            matching.update(hosts)
 
-    g_hostlist_match_cache[cache_id] = matching
     return matching
 
+
+# Matches the host names against a list of regular expressions. Returns
+# a dictionary from the number of the entry to the set of matching hosts.
+# Instead of trying each regex on each host, the expressions are combined
+# into one alternation of named groups. The group of a match tells which
+# of the expressions matched first - and only the first matching entry
+# of a host list is relevant. Expressions using groups or backreferences
+# of their own are matched separately.
+def hosts_matching_regexes(candidates, regex_entries):
+    matches = dict([ (nr, set([])) for nr, _unused_pattern in regex_entries ])
+
+    combinable, separate = [], []
+    for nr, pattern in regex_entries:
+        try:
+            regex(pattern) # make sure the pattern is valid
+        except MKGeneralException:
+            if cmk.debug.enabled():
+                raise
+            continue # invalid patterns never match
+
+        if "(?" in pattern or regex(r"\\[0-9]").search(pattern):
+            separate.append((nr, pattern))
+        else:
+            combinable.append((nr, pattern))
+
+    # Python supports only 100 named groups per regex
+    for chunk_start in range(0, len(combinable), 50):
+        chunk = combinable[chunk_start:chunk_start + 50]
+        reg = regex("|".join([ "(?P<r%d>%s)" % entry for entry in chunk ]))
+        for hostname in candidates:
+            match = reg.match(hostname)
+            if match:
+                matches[int(match.lastgroup[1:])].add(hostname)
+
+    for nr, pattern in separate:
+        reg = regex(pattern)
+        matches[nr].update([ hostname for hostname in candidates if reg.match(hostname) ])
+
+    return matches
+
 g_converted_service_rulesets_cache = {}
 g_global_caches.append('g_converted_service_rulesets_cache')
 
@@ -1008,23 +1522,14 @@ def service_extra_conf(hostname, service, ruleset):
     with_foreign_hosts = hostname not in all_active_hosts()
     cache_id = id(ruleset), with_foreign_hosts
     try:
-        ruleset = g_converted_service_rulesets_cache[cache_id]
+        converted = g_converted_service_rulesets_cache[cache_id]
     except KeyError:
-        ruleset = convert_service_ruleset(ruleset, with_foreign_hosts)
-        g_converted_service_rulesets_cache[cache_id] = ruleset
+        converted = convert_service_ruleset(ruleset, with_foreign_hosts)
+        g_converted_service_rulesets_cache[cache_id] = converted
 
     entries = []
-    for item, hosts, service_matchers in ruleset:
-        if hostname in hosts:
-            cache_id = service_matchers, service
-            try:
-                match = g_extraconf_servicelist_cache[cache_id]
-            except:
-                match = in_servicematcher_list(service_matchers, service)
-                g_extraconf_servicelist_cache[cache_id] = match
-
-            if match:
-                entries.append(item)
+    for nr in matching_service_rules(hostname, service, ruleset, converted):
+        entries.append(converted[nr][0])
     return entries
 
 
@@ -1065,23 +1570,156 @@ def in_boolean_serviceconf_list(hostname, service_description, ruleset):
     with_foreign_hosts = hostname not in all_active_hosts()
     cache_id = id(ruleset), with_foreign_hosts
     try:
-        ruleset = g_converted_service_rulesets_cache[cache_id]
+        converted = g_converted_service_rulesets_cache[cache_id]
     except KeyError:
-        ruleset = convert_boolean_service_ruleset(ruleset, with_foreign_hosts)
-        g_converted_service_rulesets_cache[cache_id] = ruleset
+        converted = convert_boolean_service_ruleset(ruleset, with_foreign_hosts)
+        g_converted_service_rulesets_cache[cache_id] = converted
 
-    for negate, hosts, service_matchers in ruleset:
+    for nr in matching_service_rules(hostname, service_description, ruleset, converted):
+        negate = converted[nr][0]
+        return not negate
+    return False # no match. Do not ignore
+
+
+# Returns the numbers of the converted rules that match the host and the
+# service in ascending order. The converted rules are triples having the
+# set of matching hosts at index 1 and the service matchers at index 2.
+def matching_service_rules(hostname, service, ruleset, converted):
+    if use_service_match_cache and hostname in all_configured_hosts():
+        bitmaps = service_match_bitmaps(hostname, ruleset)
+        try:
+            bitmap = bitmaps[service]
+        except KeyError:
+            bitmap = service_match_bitmap(hostname, service, converted)
+            bitmaps[service] = bitmap
+            g_service_match_cache[hostname]["changed"] = True
+    else:
+        bitmap = service_match_bitmap(hostname, service, converted)
+
+    nr = 0
+    while bitmap:
+        if bitmap & 1:
+            yield nr
+        bitmap >>= 1
+        nr += 1
+
+
+def service_match_bitmap(hostname, service, converted):
+    bitmap = 0
+    for nr, (_unused_value, hosts, service_matchers) in enumerate(converted):
         if hostname in hosts:
-            cache_id = service_matchers, service_description
+            cache_id = service_matchers, service
             try:
                 match = g_extraconf_servicelist_cache[cache_id]
-            except:
-                match = in_servicematcher_list(service_matchers, service_description)
+            except KeyError:
+                match = in_servicematcher_list(service_matchers, service)
                 g_extraconf_servicelist_cache[cache_id] = match
 
-            if match:
-                return not negate
-    return False # no match. Do not ignore
+            if match:
+                bitmap |= 1 << nr
+    return bitmap
+
+
+# The result of matching the services of a host against the service
+# conditions of the rules is persisted per host, so that it need not be
+# computed again by each Check_MK process. For each ruleset and service
+# description the cache holds a bitmap of the rules matching the host
+# and the service. The cache of a host is dropped when the loaded
+# configuration the matching of the host depends on has changed.
+g_service_match_cache = {}
+g_global_caches.append('g_service_match_cache')
+g_service_ruleset_keys_cache = {}
+g_global_caches.append('g_service_ruleset_keys_cache')
+
+def service_match_cache_dir():
+    return cmk.paths.var_dir + "/service_match_cache"
+
+
+# Returns the dictionary from service description to match bitmap
+# of the given ruleset for this host
+def service_match_bitmaps(hostname, ruleset):
+    try:
+        cache = g_service_match_cache[hostname]
+    except KeyError:
+        cache = load_service_match_cache(hostname)
+        g_service_match_cache[hostname] = cache
+
+    return cache["blocks"].setdefault(service_ruleset_key(ruleset), {})
+
+
+# The rulesets are identified by a hash of their content, which is
+# stable between the processes as long as the configuration is unchanged
+def service_ruleset_key(ruleset):
+    try:
+        return g_service_ruleset_keys_cache[id(ruleset)]
+    except KeyError:
+        key = "ruleset:" + hashlib.md5(repr(ruleset)).hexdigest()
+        g_service_ruleset_keys_cache[id(ruleset)] = key
+        return key
+
+
+# Digest of the host specific data of the loaded configuration the rules
+# are matched with. Together with the ruleset keys it covers everything
+# the bitmaps are computed from. The file modification times can not be
+# used for this: a process still running with an older configuration
+# would store its results as valid for the current one.
+def service_match_host_digest(hostname):
+    return hashlib.md5(repr([
+        cmk.__version__,
+        tags_of_host(hostname),
+        is_cluster(hostname),
+        hostname in all_active_hosts(),
+    ])).hexdigest()
+
+
+def load_service_match_cache(hostname):
+    digest = service_match_host_digest(hostname)
+    path = service_match_cache_dir() + "/" + hostname
+    try:
+        blocks = cmk_base.cache_file.load(path)
+        if blocks.get("config_digest") != digest:
+            console.vverbose("Service match cache of %s is outdated\n" % hostname)
+            blocks = {}
+    except IOError:
+        blocks = {}
+    except cmk_base.cache_file.MKCacheFormatError, e:
+        console.verbose("Ignoring invalid service match cache %s: %s\n" % (path, e))
+        blocks = {}
+
+    blocks["config_digest"] = digest
+    return {
+        "blocks"  : blocks,
+        "changed" : False,
+    }
+
+
+# Writes the caches filled by this process which are kept between
+# the Check_MK processes
+def save_persistent_caches():
+    save_service_match_caches()
+    save_check_table_store()
+
+
+# Writes the caches of all hosts having new match results. Errors are
+# ignored, the matches are simply computed again next time.
+def save_service_match_caches():
+    changed = [ (hostname, cache) for hostname, cache in g_service_match_cache.items()
+                if cache["changed"] ]
+    if not changed:
+        return
+
+    try:
+        if not os.path.exists(service_match_cache_dir()):
+            os.makedirs(service_match_cache_dir())
+
+        for hostname, cache in changed:
+            cmk_base.cache_file.save(service_match_cache_dir() + "/" + hostname,
+                                     sorted(cache["blocks"].items()))
+            cache["changed"] = False
+    except Exception, e:
+        if cmk.debug.enabled():
+            raise
+        console.verbose("Cannot save service match cache: %s\n" % e)
 
 
 # Entries in list are hostnames that must equal the hostname.
@@ -1656,6 +2294,13 @@ def is_inline_snmp_host(hostname):
            and not in_binary_hostlist(hostname, non_inline_snmp_hosts)
 
 
+# Classic SNMP hosts which are queried with the built-in SNMP engine
+# instead of the net-snmp command line tools
+def is_builtin_snmp_host(hostname):
+    return not is_inline_snmp_host(hostname) \
+           and in_binary_hostlist(hostname, builtin_snmp_hosts)
+
+
 def snmp_timing_of(hostname):
     timing = host_extra_conf(hostname, snmp_timing)
     if len(timing) > 0:
@@ -1803,6 +2448,74 @@ def snmp_get_oid(hostname, ipaddress, oid):
     return value
 
 
+# Gets all given OIDs with one snmpget and one snmpgetnext command.
+# Returns a dictionary from the OIDs to their values like snmp_get_oid()
+# returns them. OIDs ending with ".*" are fetched with snmpgetnext. OIDs
+# not answered by the commands are missing.
+def snmp_get_oids(hostname, ipaddress, oids):
+    values = {}
+
+    get_oids = [ oid for oid in oids if not oid.endswith(".*") ]
+    if get_oids:
+        for item, value in snmp_get_command_answers("get", hostname, ipaddress, get_oids):
+            if item in get_oids and item not in values:
+                values[item] = value
+
+    next_oids = [ oid for oid in oids if oid.endswith(".*") ]
+    if next_oids:
+        answers = snmp_get_command_answers("getnext", hostname, ipaddress,
+                                           [ oid[:-2] for oid in next_oids ])
+        # The answers can only be assigned to the OIDs, if the agent
+        # answered all of them
+        if len(answers) == len(next_oids):
+            for oid, (item, value) in zip(next_oids, answers):
+                if not item.startswith(oid[:-2] + "."):
+                    value = None
+                values[oid] = value
+
+    return values
+
+
+# Returns the list of pairs of OID and value of the answer lines. Like
+# in snmp_get_oid() only the first line of values spanning several
+# lines is used. Answers of an agent which failed on single OIDs are
+# still returned: net-snmp retries the request without these OIDs.
+def snmp_get_command_answers(commandtype, hostname, ipaddress, oids):
+    protospec = snmp_proto_spec(hostname)
+    portspec = snmp_port_spec(hostname)
+    command = snmp_base_command(commandtype, hostname) + \
+               [ "-On", "-OQ", "-Oe", "-Ot",
+                 "%s%s%s" % (protospec, ipaddress, portspec) ] + oids
+
+    debug_cmd = [ "''" if a == "" else a for a in command ]
+    console.vverbose("Running '%s'\n" % " ".join(debug_cmd))
+
+    snmp_process = subprocess.Popen(command, close_fds=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = snmp_process.communicate()
+    if snmp_process.returncode:
+        console.verbose(tty.red + tty.bold + "ERROR: " + tty.normal + "SNMP error\n")
+        console.verbose(error + "\n")
+
+    answers = []
+    for line in output.splitlines():
+        parts = line.strip().split("=", 1)
+        if len(parts) < 2 or not parts[0].startswith("."):
+            continue # continuation line
+
+        item, value = parts[0].strip(), parts[1].strip()
+        if value.startswith('No more variables') or value.startswith('End of MIB') \
+           or value.startswith('No Such Object available') or value.startswith('No Such Instance currently exists'):
+            value = None
+
+        # Strip quotes
+        if value and value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        answers.append((item, value))
+
+    return answers
+
+
 def clear_other_hosts_oid_cache(hostname):
     global g_single_oid_hostname
     if g_single_oid_hostname != hostname:
@@ -1847,6 +2560,8 @@ def get_single_oid(hostname, ipaddress, oid):
         try:
             if is_inline_snmp_host(hostname):
                 value = inline_snmp_get_oid(hostname, oid, ipaddress=ipaddress)
+            elif is_builtin_snmp_host(hostname):
+                value = builtin_snmp_get_oid(hostname, ipaddress, oid)
             else:
                 value = snmp_get_oid(hostname, ipaddress, oid)
         except:
@@ -1862,6 +2577,35 @@ def get_single_oid(hostname, ipaddress, oid):
     set_oid_cache(hostname, oid, value)
     return value
 
+
+# Fetches the given OIDs at once and puts them into the cache used by
+# get_single_oid(). OIDs which could not be fetched that way are fetched
+# one by one, so afterwards all of them are cached.
+def prefetch_single_oids(hostname, ipaddress, oids):
+    clear_other_hosts_oid_cache(hostname)
+    oids = [ oid for oid in oids if oid not in g_single_oid_cache ]
+
+    if len(oids) > 1 and not opt_use_snmp_walk and not is_usewalk_host(hostname) \
+       and not is_inline_snmp_host(hostname):
+        console.vverbose("       Getting %d OIDs at once\n" % len(oids))
+        try:
+            if is_builtin_snmp_host(hostname):
+                values = builtin_snmp_get_oids(hostname, ipaddress, oids)
+            else:
+                values = snmp_get_oids(hostname, ipaddress, oids)
+        except:
+            if cmk.debug.enabled():
+                raise
+            values = {}
+
+        for oid in oids:
+            if oid in values:
+                console.vverbose("       Got OID %s: %s\n" % (oid, values[oid]))
+                set_oid_cache(hostname, oid, values[oid])
+
+    for oid in oids:
+        get_single_oid(hostname, ipaddress, oid)
+
 #.
 #   .--Cluster-------------------------------------------------------------.
 #   |                    ____ _           _                                |
@@ -1944,9 +2688,6 @@ def host_of_clustered_service(hostname, servicedesc):
 # Format: (checkname, item) -> (params, description)
 
 def get_check_table(hostname, remove_duplicates=False, use_cache=True, world='config', skip_autochecks=False):
-    global g_singlehost_checks
-    global g_multihost_checks
-
     if is_ping_host(hostname):
         skip_autochecks = True
 
@@ -1957,10 +2698,34 @@ def get_check_table(hostname, remove_duplicates=False, use_cache=True, world='co
         else:
             return g_check_table_cache[hostname]
 
+    if not skip_autochecks and use_cache and use_check_table_store \
+       and hostname in all_active_hosts():
+        rows = stored_check_table_rows(hostname, world)
+    else:
+        rows = compute_check_table_rows(hostname, world, skip_autochecks)
+
+    # The parameters are computed from the raw parameters of the rows by
+    # applying the rules of the hosts listed in param_hosts
     check_table = {}
+    for (checkname, item), (params, param_hosts, descr, deps) in rows.items():
+        for param_host in param_hosts:
+            params = compute_check_parameters(param_host, checkname, item, params)
+        check_table[(checkname, item)] = (params, descr, list(deps))
+
+    if not skip_autochecks and use_cache:
+        g_check_table_cache[hostname] = check_table
+
+    if remove_duplicates:
+        return remove_duplicate_checks(check_table)
+    else:
+        return check_table
+
+
+# First time? Split up all checks in single and multi-host-checks
+def split_manual_checks():
+    global g_singlehost_checks
+    global g_multihost_checks
 
-    # First time? Split up all checks in single and
-    # multi-host-checks
     if g_singlehost_checks == None:
         g_singlehost_checks = {}
         g_multihost_checks = []
@@ -1970,6 +2735,16 @@ def get_check_table(hostname, remove_duplicates=False, use_cache=True, world='co
             else:
                 g_multihost_checks.append(entry)
 
+
+# Computes the check table of a host without the final check parameters.
+# Format: (checkname, item) -> (params, param_hosts, description, deps)
+# The parameters are the raw parameters of the autochecks or the manual
+# checks and param_hosts is the list of hosts whose rules need to be
+# applied to them.
+def compute_check_table_rows(hostname, world, skip_autochecks):
+    split_manual_checks()
+
+    rows = {}
     hosttags = tags_of_host(hostname)
 
     # Just a local cache and its function
@@ -1992,7 +2767,7 @@ def get_check_table(hostname, remove_duplicates=False, use_cache=True, world='co
         return passed
 
 
-    def handle_entry(entry):
+    def handle_entry(entry, param_hosts):
         num_elements = len(entry)
         if num_elements == 3: # from autochecks
             hostlist = hostname
@@ -2038,52 +2813,247 @@ def get_check_table(hostname, remove_duplicates=False, use_cache=True, world='co
             if hostname != host_of_clustered_service(hostname, descr):
                 return
             deps  = service_deps(hostname, descr)
-            check_table[(checkname, item)] = (params, descr, deps)
+            rows[(checkname, item)] = (params, param_hosts, descr, deps)
 
     # Now process all entries that are specific to the host
     # in search (single host) or that might match the host.
     if not skip_autochecks:
-        for entry in read_autochecks_of(hostname, world):
-            handle_entry(entry)
+        for entry in read_raw_autochecks_of(hostname, world):
+            handle_entry(entry, [ hostname ])
 
     for entry in g_singlehost_checks.get(hostname, []):
-        handle_entry(entry)
+        handle_entry(entry, [])
 
     for entry in g_multihost_checks:
-        handle_entry(entry)
+        handle_entry(entry, [])
 
     # Now add checks a cluster might receive from its nodes
     if is_cluster(hostname):
         for node in nodes_of(hostname):
-            node_checks = g_singlehost_checks.get(node, [])
+            node_checks = [ (entry[1:], []) for entry in g_singlehost_checks.get(node, []) ]
             if not skip_autochecks:
-                node_checks = node_checks + read_autochecks_of(node, world)
-            for entry in node_checks:
-                if len(entry) == 4:
-                    entry = entry[1:] # drop hostname from g_singlehost_checks
-                checkname, item, params = entry
+                node_checks += [ (entry, [ node ]) for entry in read_raw_autochecks_of(node, world) ]
+            for (checkname, item, params), param_hosts in node_checks:
                 descr = service_description(node, checkname, item)
                 if hostname == host_of_clustered_service(node, descr):
-                    cluster_params = compute_check_parameters(hostname, checkname, item, params)
-                    handle_entry((hostname, checkname, item, cluster_params))
+                    handle_entry((hostname, checkname, item, params), param_hosts + [ hostname ])
 
 
     # Remove dependencies to non-existing services
-    all_descr = set([ descr for ((checkname, item), (params, descr, deps)) in check_table.items() ])
-    for (checkname, item), (params, descr, deps) in check_table.items():
+    all_descr = set([ descr for ((checkname, item), (params, param_hosts, descr, deps)) in rows.items() ])
+    for (checkname, item), (params, param_hosts, descr, deps) in rows.items():
         deeps = deps[:]
         del deps[:]
         for d in deeps:
             if d in all_descr:
                 deps.append(d)
 
-    if not skip_autochecks and use_cache:
-        g_check_table_cache[hostname] = check_table
+    return rows
 
-    if remove_duplicates:
-        return remove_duplicate_checks(check_table)
-    else:
-        return check_table
+
+# The check table rows of the hosts are persisted, so that they need not
+# be computed again by each Check_MK process and after each configuration
+# change. Each stored table carries a fingerprint of everything it has been
+# computed from: the autochecks of the host (and of the nodes of a cluster),
+# the host properties, the rules matching the host and the check plugins.
+# Only the tables of hosts with a changed fingerprint are computed again.
+g_check_table_store_changes = {}
+g_global_caches.append('g_check_table_store_changes')
+g_check_table_global_digest_cache = {}
+g_global_caches.append('g_check_table_global_digest_cache')
+
+def check_table_store_dir(world):
+    return cmk.paths.var_dir + "/check_tables/" + world
+
+
+def stored_check_table_rows(hostname, world):
+    fingerprint = check_table_fingerprint(hostname, world)
+    path = check_table_store_dir(world) + "/" + hostname
+
+    def decode(data):
+        if cmk_base.cache_file.loads(data, "fingerprint") != fingerprint:
+            return None
+        return cmk_base.cache_file.loads(data, "rows")
+
+    try:
+        rows = cmk_base.cache_file.load_mapped(path, decode)
+        if rows != None:
+            return rows
+        console.vverbose("Stored check table of %s is outdated\n" % hostname)
+    except IOError:
+        pass
+    except cmk_base.cache_file.MKCacheFormatError, e:
+        console.verbose("Ignoring invalid stored check table %s: %s\n" % (path, e))
+
+    rows = compute_check_table_rows(hostname, world, False)
+    g_check_table_store_changes[(hostname, world)] = fingerprint, rows
+    return rows
+
+
+def check_table_fingerprint(hostname, world):
+    fingerprint = {
+        "global" : check_table_global_digest(),
+        "host"   : check_table_host_digest(hostname, world),
+    }
+    for node in nodes_of(hostname) or []:
+        fingerprint["node:" + node] = check_table_host_digest(node, world)
+    return fingerprint
+
+
+# Digest of the configuration affecting the check tables of all hosts
+def check_table_global_digest():
+    try:
+        return g_check_table_global_digest_cache["digest"]
+    except KeyError:
+        pass
+
+    digest = hashlib.md5(cmk.__version__)
+    digest.update(repr(sorted(check_plugin_files_state(check_plugin_filelist()).items())))
+    digest.update(repr((ignored_checktypes, service_descriptions, use_new_descriptions_for)))
+    g_check_table_global_digest_cache["digest"] = digest.hexdigest()
+    return g_check_table_global_digest_cache["digest"]
+
+
+# Digest of the host specific data the check table of a host (or of a
+# cluster the host is node of) is computed from
+def check_table_host_digest(hostname, world):
+    split_manual_checks()
+
+    properties = [
+        tags_of_host(hostname),
+        is_snmp_host(hostname),
+        is_tcp_host(hostname),
+        is_ping_host(hostname),
+        has_management_board(hostname) and management_protocol(hostname),
+        clusters_of(hostname),
+        nodes_of(hostname),
+    ]
+    if not is_tcp_host(hostname):
+        properties.append(has_piggyback_info(hostname))
+
+    digest = hashlib.md5(repr(properties))
+    digest.update(autochecks_file_content(hostname, world))
+    digest.update(autochecks_referenced_values_digest(hostname, world))
+    digest.update(repr(g_singlehost_checks.get(hostname, [])))
+    digest.update(matching_multihost_checks_digest(hostname))
+
+    for ruleset, kind in [ (ignored_services,           "boolean"),
+                           (ignored_checks,             "host"),
+                           (clustered_services,         "boolean"),
+                           (clustered_services_mapping, "service"),
+                           (service_dependencies,       "service") ]:
+        digest.update(host_rules_digest(hostname, ruleset, kind))
+
+    the_clusters = clusters_of(hostname)
+    for cluster, ruleset in sorted(clustered_services_of.items()):
+        if cluster in the_clusters:
+            digest.update(host_rules_digest(hostname, ruleset, "boolean"))
+
+    return digest.hexdigest()
+
+
+def autochecks_file_content(hostname, world):
+    try:
+        return file(autochecks_file_path(hostname, world)).read()
+    except IOError:
+        return ""
+
+
+# Digest of the current values of the variables referenced by the
+# autochecks of a host, e.g. the default levels of the checks. The
+# stored rows contain the parameters evaluated with these values.
+def autochecks_referenced_values_digest(hostname, world):
+    try:
+        _unused_entries, names = cached_raw_autochecks_of(hostname, world)
+    except (IOError, OSError):
+        return ""
+
+    # The values need to be the same as when the autochecks are evaluated
+    load_check_plugins_of_names(names)
+
+    ignored_variable_types = [ type(lambda: None), type(os) ]
+    values = []
+    for name in names:
+        value = globals().get(name)
+        if value is not None and type(value) not in ignored_variable_types \
+           and not callable(value):
+            values.append((name, value))
+    return hashlib.md5(repr(values)).hexdigest()
+
+
+def matching_multihost_checks_digest(hostname):
+    with_foreign_hosts = hostname not in all_active_hosts()
+    matching = []
+    for entry in g_multihost_checks:
+        if len(entry) == 4:
+            tags, hostlist = [], entry[0]
+        else:
+            tags, hostlist = entry[0], entry[1]
+
+        if type(hostlist) == str:
+            if hostlist == hostname:
+                matching.append(entry)
+        elif type(tags) != list or (hostlist and type(hostlist[0]) != str):
+            return service_ruleset_key(checks) # invalid, reported when computing the table
+        elif hostname in all_matching_hosts(tags, hostlist, with_foreign_hosts):
+            matching.append(entry)
+    return hashlib.md5(repr(matching)).hexdigest()
+
+
+# Returns a digest of the rules of the ruleset whose host conditions match
+# the host. The kind of the ruleset tells where the host conditions are:
+# "host": (value, [tags,] hostlist), "service": (value, [tags,] hostlist,
+# servicelist) and "boolean": ([NEGATE,] [tags,] hostlist, servicelist).
+def host_rules_digest(hostname, ruleset, kind):
+    with_foreign_hosts = hostname not in all_active_hosts()
+    hostlist_pos, num_with_tags = { "host"    : (-1, 3),
+                                    "service" : (-2, 4),
+                                    "boolean" : (-2, 3) }[kind]
+    matching = []
+    for rule in ruleset:
+        entry, rule_options = get_rule_options(rule)
+        if rule_options.get("disabled"):
+            continue
+
+        if kind == "boolean" and entry[0] == NEGATE:
+            entry = entry[1:]
+
+        if len(entry) == num_with_tags:
+            tags = entry[hostlist_pos - 1]
+        elif len(entry) == num_with_tags - 1:
+            tags = []
+        else:
+            return service_ruleset_key(ruleset) # invalid, reported when computing the table
+
+        if hostname in all_matching_hosts(tags, entry[hostlist_pos], with_foreign_hosts):
+            matching.append(rule)
+    return hashlib.md5(repr(matching)).hexdigest()
+
+
+# Writes the check tables computed by this process. Errors are ignored,
+# the tables are simply computed again next time. The same is done for
+# tables containing parameters which can not be stored, e.g. objects
+# created by manual checks in main.mk.
+def save_check_table_store():
+    if not g_check_table_store_changes:
+        return
+
+    try:
+        for (hostname, world), (fingerprint, rows) in g_check_table_store_changes.items():
+            if not os.path.exists(check_table_store_dir(world)):
+                os.makedirs(check_table_store_dir(world))
+
+            try:
+                cmk_base.cache_file.save(check_table_store_dir(world) + "/" + hostname,
+                                         [ ("fingerprint", fingerprint), ("rows", rows) ])
+            except ValueError, e:
+                console.verbose("Not storing check table of %s, the parameters can not be "
+                                "stored: %s\n" % (hostname, e))
+            del g_check_table_store_changes[(hostname, world)]
+    except Exception, e:
+        if cmk.debug.enabled():
+            raise
+        console.verbose("Cannot save check table store: %s\n" % e)
 
 
 def get_precompiled_check_table(hostname, remove_duplicates=True, world="config"):
@@ -2358,6 +3328,22 @@ def write_ip_lookup_cache():
     os.rename(cmk.paths.var_dir + '/ipaddresses.cache' + suffix, cmk.paths.var_dir + '/ipaddresses.cache')
 
 
+# Adds the addresses resolved by a worker process to the IP lookup cache
+def merge_ip_lookup_cache(ip_lookup_cache):
+    if not ip_lookup_cache:
+        return
+
+    init_ip_lookup_cache()
+    updated = False
+    for key, ipa in ip_lookup_cache.items():
+        if g_ip_lookup_cache.get(key) != ipa:
+            g_ip_lookup_cache[key] = ipa
+            updated = True
+
+    if updated:
+        write_ip_lookup_cache()
+
+
 def do_update_dns_cache():
     # Temporarily disable *use* of cache, we want to force an update
     global use_dns_cache
@@ -2540,28 +3526,22 @@ skipped_config_variable_names = [
 ]
 
 def pack_config():
-    # Checks whether or not a variable can be written to the config.mk
-    # and read again from it.
+    # Checks whether or not a variable can be written to the packed config
+    # and read again from it. Values marshal can not handle are stored as
+    # source code and need to be evaluable.
     def packable(varname, val):
         if type(val) in [ int, str, unicode, bool ] or not val:
             return True
 
+        if cmk_base.packed_config.is_marshallable(val):
+            return True
+
         try:
             eval(repr(val))
             return True
         except:
             return False
 
-    # TODO: Write using cmk.store.
-    filepath = cmk.paths.var_dir + "/core/helper_config.mk"
-    out = file(filepath + ".new", "w")
-    out.write("#!/usr/bin/python\n"
-              "# encoding: utf-8\n"
-              "# Created by Check_MK. Dump of the currently active configuration\n\n")
-
-
-
-
     # These functions purpose is to filter out hosts which are monitored on different sites
     active_hosts    = all_active_hosts()
     active_clusters = all_active_clusters()
@@ -2597,34 +3577,43 @@ def pack_config():
         "hosttags"                 : filter_hostname_in_dict
     }
 
+    variables = []
     for varname in list(config_variable_names) + derived_config_variable_names:
         if varname not in skipped_config_variable_names:
             val = globals()[varname]
             if packable(varname, val):
                 if varname in filter_var_functions:
                     val = filter_var_functions[varname](val)
-                out.write("\n%s = %r\n" % (varname, val))
+                variables.append((varname, val))
 
+    deleted = []
     for varname, _unused_factory_setting in factory_settings.items():
         if varname in globals():
-            out.write("\n%s = %r\n" % (varname, globals()[varname]))
+            variables.append((varname, globals()[varname]))
         else: # remove explicit setting from previous packed config!
-            out.write("\nif %r in globals():\n    del %s\n" % (varname, varname))
+            deleted.append(varname)
+
+    cmk_base.packed_config.save(packed_config_path(), variables, deleted)
 
-    out.close()
 
-    import marshal
-    code = compile(open(filepath + ".new").read(), '<string>', 'exec')
-    marshal.dump(code, open(filepath + ".compiled", "wb"))
-    os.rename(filepath + ".compiled", filepath)
-    # Remove the configs readable version
-    os.unlink(filepath + ".new")
+def packed_config_path():
+    return cmk.paths.var_dir + "/core/helper_config.mk"
 
 
+# Checksums of the variables loaded by the last read_packed_config().
+# Unchanged variables are not decoded again when the config is reloaded.
+g_packed_config_checksums = {}
+
 def read_packed_config():
-    import marshal
-    filepath = cmk.paths.var_dir + "/core/helper_config.mk"
-    exec(marshal.load(open(filepath)), globals())
+    global g_packed_config_checksums
+    try:
+        g_packed_config_checksums = cmk_base.packed_config.load(packed_config_path(),
+                                        globals(), g_packed_config_checksums)
+    except cmk_base.cache_file.MKCacheFormatError:
+        # Config packed by a previous version as marshalled code object
+        import marshal
+        exec(marshal.load(open(packed_config_path())), globals())
+        g_packed_config_checksums = {}
 
 def pack_autochecks():
     dstpath = cmk.paths.var_dir + "/core/autochecks"
@@ -2647,6 +3636,37 @@ def pack_autochecks():
         if f not in needed:
             os.remove(dstpath + "/" + f)
 
+    pack_autochecks_caches()
+
+
+# Brings the caches of all autochecks files up to date and links them for
+# the copies of the core. The copies are hardlinks, so the caches of the
+# files are valid for them as well.
+def pack_autochecks_caches():
+    preload_autochecks("config")
+    g_preloaded_autochecks["active"] = g_preloaded_autochecks["config"]
+
+    srcpath = autochecks_cache_dir("config")
+    dstpath = autochecks_cache_dir("active")
+    for path in [ srcpath, dstpath ]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    hostnames = g_preloaded_autochecks["config"]
+    for hostname in hostnames:
+        d = dstpath + "/" + hostname
+        if os.path.exists(d):
+            os.remove(d)
+        try:
+            os.link(srcpath + "/" + hostname, d)
+        except OSError:
+            pass # cache could not be written, is created on demand
+
+    for path in [ srcpath, dstpath ]:
+        for f in os.listdir(path):
+            if f not in hostnames and not f.startswith("."):
+                os.remove(path + "/" + f)
+
 
 #.
 #   .--Backup & Restore----------------------------------------------------.
@@ -2867,6 +3887,7 @@ def create_core_config():
 
     verify_non_duplicate_hosts()
     verify_non_deprecated_checkgroups()
+    preload_autochecks()
 
     if monitoring_core == "cmc":
         do_create_cmc_config(opt_cmc_relfilename)
@@ -3246,7 +4267,10 @@ def do_snmpwalk_on(hostname, filename):
     console.verbose("%s:\n" % hostname)
     ip = lookup_ipv4_address(hostname)
 
-    out = file(filename, "w")
+    # The walk file is replaced at the end, since processes using it for
+    # simulation read it via mmap
+    tmp_filename = "%s.new%d" % (filename, os.getpid())
+    out = file(tmp_filename, "w")
     oids_to_walk = opt_oids
     if not opt_oids:
         oids_to_walk = [
@@ -3261,6 +4285,8 @@ def do_snmpwalk_on(hostname, filename):
             if is_inline_snmp_host(hostname):
                 rows = inline_snmpwalk_on_suboid(hostname, None, oid)
                 rows = inline_convert_rows_for_stored_walk(rows)
+            elif is_builtin_snmp_host(hostname):
+                rows = builtin_snmpwalks(hostname, ip, [ oid ], None, hex_plain = True)[oid]
             else:
                 rows = snmpwalk_on_suboid(hostname, ip, oid, hex_plain = True)
 
@@ -3269,9 +4295,12 @@ def do_snmpwalk_on(hostname, filename):
             console.verbose("%d variables.\n" % len(rows))
         except:
             if cmk.debug.enabled():
+                out.close()
+                os.remove(tmp_filename)
                 raise
 
     out.close()
+    os.rename(tmp_filename, filename)
     console.verbose("Successfully Wrote %s%s%s.\n" % (tty.bold, filename, tty.normal))
 
 
@@ -3535,6 +4564,7 @@ Copyright (C) 2009 Mathias Kettner
 def usage():
     sys.stdout.write("""WAYS TO CALL:
  cmk [-n] [-v] [-p] HOST [IPADDRESS]  check all services on HOST
+ cmk --check-hosts [HOST1 HOST2...]   check all services on many hosts at once
  cmk -I [HOST ..]                     inventory - find new services
  cmk -II ...                          renew inventory, drop old services
  cmk -N [HOSTS...]                    output Nagios configuration
@@ -3596,7 +4626,8 @@ OPTIONS:
   --interactive  Some errors are only reported in interactive mode, i.e. if stdout
                  is a TTY. This option forces interactive mode even if the output
                  is directed into a pipe or file.
-  --procs N      start up to N processes in parallel during --scan-parents
+  --procs N      start up to N processes in parallel during --scan-parents,
+                 contact up to N agents in parallel during --check-hosts
   --checks A,..  restrict checks/inventory to specified checks (tcp/snmp/check type)
   --keepalive    used by Check_MK Mirco Core: run check and --notify
                  in continous mode. Read data from stdin and from cmd line.
@@ -3694,6 +4725,12 @@ NOTES:
   walk from the directory %s. You can add further MIBs to the directory
   %s.
 
+  --check-hosts checks all, one or several hosts within one process.
+  The agents of the hosts are contacted concurrently (see --procs), so
+  waiting for slow agents does not add up. The same is done for the
+  SNMP tables of hosts using the built-in SNMP engine. The results of
+  all services, including the Check_MK service itself, are sent to the core.
+
   --scan-parents uses traceroute in order to automatically detect
   hosts's parents. It creates the file conf.d/parents.mk which
   defines gateway hosts and parent declarations.
@@ -3932,6 +4969,139 @@ def do_donation():
         indata = indata[64:]
 
 
+# Check several hosts within one process. The output of the TCP agents
+# of a bunch of hosts is fetched concurrently, then the checks of these
+# hosts are executed one after the other. Waiting for slow agents thus
+# overlaps instead of adding up. All results - including the one of
+# the Check_MK service - are submitted to the core by this process.
+def do_check_hosts(hostnames, only_check_types=None):
+    global opt_check_hosts
+    opt_check_hosts = True
+
+    if hostnames:
+        hostnames = parse_hostname_list(hostnames)
+    else:
+        hostnames = sorted(all_active_hosts())
+
+    max_concurrent = max(1, max_num_processes)
+    chunk_size = max_concurrent * 10
+
+    exit_status = 0
+    while hostnames:
+        chunk, hostnames = hostnames[:chunk_size], hostnames[chunk_size:]
+
+        ipaddresses = {}
+        to_fetch = []
+        to_walk = []
+        for hostname in chunk:
+            try:
+                if is_cluster(hostname):
+                    ipaddresses[hostname] = None
+                else:
+                    ipaddresses[hostname] = lookup_ip_address(hostname)
+            except:
+                if cmk.debug.enabled():
+                    raise
+                continue
+
+            for realhost in nodes_of(hostname) or [ hostname ]:
+                try:
+                    ipaddress = lookup_ip_address(realhost)
+                except:
+                    continue # will fail later during the check
+                if needs_agent_prefetch(realhost, ipaddress):
+                    to_fetch.append((realhost, ipaddress))
+                if needs_snmp_prefetch(realhost, ipaddress):
+                    to_walk.append((realhost, ipaddress))
+
+        console.verbose("Fetching agent data of %d hosts (%d in parallel)...\n" %
+                        (len(to_fetch), max_concurrent))
+        fetch_agent_outputs(to_fetch, max_concurrent)
+        fetch_snmp_tables(to_walk, only_check_types)
+
+        for hostname in chunk:
+            console.output("%s%s%s: " % (tty.bold, hostname, tty.normal))
+            if hostname not in ipaddresses:
+                console.output("UNKNOWN - Cannot resolve hostname '%s'\n" % hostname)
+                exit_status = worst_monitoring_state(exit_status, 3)
+                continue
+
+            # An error while checking one host must not stop checking the
+            # other hosts and submitting the results collected so far
+            try:
+                status = do_check(hostname, ipaddresses[hostname], only_check_types)
+            except MKTerminate:
+                raise
+            except Exception, e:
+                if cmk.debug.enabled():
+                    raise
+                console.output("UNKNOWN - %s\n" % ("%s" % e or e.__class__.__name__))
+                status = 3
+            exit_status = worst_monitoring_state(exit_status, status)
+            cleanup_globals()
+
+        try:
+            flush_check_results()
+        except MKGeneralException, e:
+            if cmk.debug.enabled():
+                raise
+            console.warning("Cannot submit check results: %s" % e)
+            exit_status = worst_monitoring_state(exit_status, 3)
+
+        g_prefetched_agent_outputs.clear()
+        g_prefetched_snmp_walks.clear()
+
+    return exit_status
+
+
+# Only hosts that are contacted via TCP and whose data is not taken
+# from a valid cache file are fetched in advance. Everything else is
+# handled by the regular code path during the check.
+def needs_agent_prefetch(hostname, ipaddress):
+    if not ipaddress or not is_tcp_host(hostname) or opt_no_tcp or simulation_mode:
+        return False
+
+    if hostname in g_broken_agent_hosts or get_datasource_program(hostname, ipaddress):
+        return False
+
+    cachefile = cmk.paths.tcp_cache_dir + "/" + hostname
+    if opt_use_cachefile and not opt_no_cache and os.path.exists(cachefile) \
+       and cachefile_age(cachefile) <= check_max_cachefile_age:
+        return False
+
+    return True
+
+
+# Only the SNMP tables of hosts using the built-in SNMP engine can be
+# walked concurrently. The others are walked during the check.
+def needs_snmp_prefetch(hostname, ipaddress):
+    if not ipaddress or not is_snmp_host(hostname) or not is_builtin_snmp_host(hostname):
+        return False
+
+    return not opt_no_snmp_hosts and not opt_use_snmp_walk and not is_usewalk_host(hostname) \
+           and not opt_no_tcp and not simulation_mode
+
+
+# Fetch the raw output of the TCP agents of many hosts at once. The
+# connections are made concurrently, which saves a lot of time when
+# checking many hosts in one process. The results are kept in
+# g_prefetched_agent_outputs and are used by get_agent_info_tcp()
+# later instead of contacting the agent again.
+def fetch_agent_outputs(hosts, max_concurrent):
+    import cmk_base.agent_fetcher
+
+    jobs = []
+    for hostname, ipaddress in hosts:
+        family = is_ipv6_primary(hostname) and socket.AF_INET6 or socket.AF_INET
+        jobs.append((hostname, ipaddress, agent_port_of(hostname), family, tcp_connect_timeout))
+
+    outputs, errors = cmk_base.agent_fetcher.fetch_agent_outputs(jobs, max_concurrent,
+                                                                 agent_read_timeout)
+    g_prefetched_agent_outputs.update(outputs)
+    for hostname, message in errors.items():
+        g_prefetched_agent_outputs[hostname] = MKAgentError(message)
+
+
 def find_bin_in_path(prog):
     for path in os.environ['PATH'].split(os.pathsep):
         f = path + '/' + prog
@@ -3968,39 +5138,36 @@ def do_scan_parents(hosts):
                                      "Please rename it to keep the configuration or delete "
                                      "the file and try again.")
 
+    # skip hosts that already have a parent
+    chunk = []
+    for host in hosts:
+        if len(parents_of(host)) > 0:
+            console.verbose("(manual parent) ")
+            continue
+        chunk.append(host)
+
     sys.stdout.write("Scanning for parents (%d processes)..." % max_num_processes)
     sys.stdout.flush()
-    while len(hosts) > 0:
-        chunk = []
-        while len(chunk) < max_num_processes and len(hosts) > 0:
-            host = hosts[0]
-            del hosts[0]
-            # skip hosts that already have a parent
-            if len(parents_of(host)) > 0:
-                console.verbose("(manual parent) ")
-                continue
-            chunk.append(host)
-
-        gws = scan_parents_of(chunk)
-
-        for host, (gw, _unused_state, _unused_ping_fails, _unused_message) in zip(chunk, gws):
-            if gw:
-                gateway, gateway_ip, dns_name = gw
-                if not gateway: # create artificial host
-                    if dns_name:
-                        gateway = dns_name
-                    else:
-                        gateway = "gw-%s" % (gateway_ip.replace(".", "-"))
-                    if gateway not in gateway_hosts:
-                        gateway_hosts.add(gateway)
-                        parent_hosts.append("%s|parent|ping" % gateway)
-                        parent_ips[gateway] = gateway_ip
-                        if monitoring_host:
-                            parent_rules.append( (monitoring_host, [gateway]) ) # make Nagios a parent of gw
-                parent_rules.append( (gateway, [host]) )
-            elif host != monitoring_host and monitoring_host:
-                # make monitoring host the parent of all hosts without real parent
-                parent_rules.append( (monitoring_host, [host]) )
+    gws = scan_parents_of(chunk)
+
+    for host, (gw, _unused_state, _unused_ping_fails, _unused_message) in zip(chunk, gws):
+        if gw:
+            gateway, gateway_ip, dns_name = gw
+            if not gateway: # create artificial host
+                if dns_name:
+                    gateway = dns_name
+                else:
+                    gateway = "gw-%s" % (gateway_ip.replace(".", "-"))
+                if gateway not in gateway_hosts:
+                    gateway_hosts.add(gateway)
+                    parent_hosts.append("%s|parent|ping" % gateway)
+                    parent_ips[gateway] = gateway_ip
+                    if monitoring_host:
+                        parent_rules.append( (monitoring_host, [gateway]) ) # make Nagios a parent of gw
+            parent_rules.append( (gateway, [host]) )
+        elif host != monitoring_host and monitoring_host:
+            # make monitoring host the parent of all hosts without real parent
+            parent_rules.append( (monitoring_host, [host]) )
 
     out = file(outfilename, "w")
     out.write("# Automatically created by --scan-parents at %s\n\n" % time.asctime())
@@ -4018,10 +5185,14 @@ def do_scan_parents(hosts):
     out.write("parents += %s\n\n" % pprint.pformat(parent_rules))
     sys.stdout.write("\nWrote %s\n" % outfilename)
 
-def gateway_reachable_via_ping(ip, probes):
-    return 0 == os.system("ping -q -i 0.2 -l 3 -c %d -W 5 %s >/dev/null 2>&1" %
-      (probes, quote_shell_string(ip))) >> 8
+def gateway_ping_command(ip, probes):
+    return [ "ping", "-q", "-i", "0.2", "-l", "3", "-c", "%d" % probes, "-W", "5", ip ]
 
+# Scans the parents of all given hosts concurrently. The traceroute and
+# ping commands of all hosts are executed by one event loop, running up
+# to max_num_processes commands at the same time (see cmk_base.parent_scan).
+# Returns the list of gateways in the order of the hosts. The status of
+# each host is shown as soon as its scan is finished.
 def scan_parents_of(hosts, silent=False, settings={}):
     if monitoring_host:
         nagios_ip = lookup_ipv4_address(monitoring_host)
@@ -4031,62 +5202,56 @@ def scan_parents_of(hosts, silent=False, settings={}):
     os.putenv("LANG", "")
     os.putenv("LC_ALL", "")
 
-    # Start processes in parallel
-    procs = []
-    for host in hosts:
-        console.verbose("%s " % host)
-        try:
-            ip = lookup_ipv4_address(host)
-            command = "traceroute -w %d -q %d -m %d -n %s 2>&1" % (
-                settings.get("timeout", 8),
-                settings.get("probes", 2),
-                settings.get("max_ttl", 10),
-                quote_shell_string(ip))
-            if cmk.debug.enabled():
-                sys.stderr.write("Running '%s'\n" % command)
-            procs.append( (host, ip, os.popen(command) ) )
-        except:
-            procs.append( (host, None, os.popen(
-                "echo 'ERROR: cannot resolve host name'")))
-
     # Output marks with status of each single scan
     def dot(color, dot='o'):
         if not silent:
             sys.stdout.write(tty.bold + color + dot + tty.normal)
             sys.stdout.flush()
 
-    # Now all run and we begin to read the answers. For each host
-    # we add a triple to gateways: the gateway, a scan state  and a diagnostic output
-    gateways = []
-    for host, ip, proc in procs:
-        lines = [l.strip() for l in proc.readlines()]
-        exitstatus = proc.close()
-        if exitstatus:
-            dot(tty.red, '*')
-            gateways.append((None, "failed", 0, "Traceroute failed with exit code %d" % (exitstatus & 255)))
-            continue
+    # For each host we add a quadruple to gateways: the gateway, a scan state,
+    # the number of skipped gateways and a diagnostic output
+    gateways = [ None ] * len(hosts)
 
-        if len(lines) == 1 and lines[0].startswith("ERROR:"):
-            message = lines[0][6:].strip()
+    def scan_parents_of_host(nr, host):
+        console.verbose("%s " % host)
+        try:
+            ip = lookup_ipv4_address(host)
+        except:
+            message = "cannot resolve host name"
             console.verbose("%s: %s\n", host, message, stream=sys.stderr)
             dot(tty.red, "D")
-            gateways.append((None, "dnserror", 0, message))
-            continue
+            gateways[nr] = (None, "dnserror", 0, message)
+            return
+
+        command = [ "traceroute", "-w", "%d" % settings.get("timeout", 8),
+                    "-q", "%d" % settings.get("probes", 2),
+                    "-m", "%d" % settings.get("max_ttl", 10), "-n", ip ]
+        if cmk.debug.enabled():
+            sys.stderr.write("Running '%s'\n" % " ".join(command))
+
+        exitstatus, output = yield command
+        lines = [ l.strip() for l in output.splitlines() ]
+        if exitstatus:
+            dot(tty.red, '*')
+            gateways[nr] = (None, "failed", 0, "Traceroute failed with exit code %d" % exitstatus)
+            return
 
         elif len(lines) == 0:
             if cmk.debug.enabled():
-                raise MKGeneralException("Cannot execute %s. Is traceroute installed? Are you root?" % command)
+                raise MKGeneralException("Cannot execute %s. Is traceroute installed? Are you root?" %
+                                                                            " ".join(command))
             else:
                 dot(tty.red, '!')
-            continue
+            gateways[nr] = (None, "failed", 0, "Traceroute returned no output")
+            return
 
         elif len(lines) < 2:
             if not silent:
                 sys.stderr.write("%s: %s\n" % (host, ' '.join(lines)))
-            gateways.append((None, "garbled", 0, "The output of traceroute seem truncated:\n%s" %
-                    ("".join(lines))))
+            gateways[nr] = (None, "garbled", 0, "The output of traceroute seem truncated:\n%s" %
+                    ("".join(lines)))
             dot(tty.blue)
-            continue
+            return
 
         # Parse output of traceroute:
         # traceroute to 8.8.8.8 (8.8.8.8), 30 hops max, 40 byte packets
@@ -4117,9 +5282,9 @@ def scan_parents_of(hosts, silent=False, settings={}):
         if len(routes) == 0:
             error = "incomplete output from traceroute. No routes found."
             sys.stderr.write("%s: %s\n" % (host, error))
-            gateways.append((None, "garbled", 0, error))
+            gateways[nr] = (None, "garbled", 0, error)
             dot(tty.red)
-            continue
+            return
 
         # Only one entry -> host is directly reachable and gets nagios as parent -
         # if nagios is not the parent itself. Problem here: How can we determine
@@ -4127,14 +5292,14 @@ def scan_parents_of(hosts, silent=False, settings={}):
         # this in monitoring_host.
         elif len(routes) == 1:
             if ip == nagios_ip:
-                gateways.append( (None, "root", 0, "") ) # We are the root-monitoring host
+                gateways[nr] = (None, "root", 0, "") # We are the root-monitoring host
                 dot(tty.white, 'N')
             elif monitoring_host:
-                gateways.append( ((monitoring_host, nagios_ip, None), "direct", 0, "") )
+                gateways[nr] = ((monitoring_host, nagios_ip, None), "direct", 0, "")
                 dot(tty.cyan, 'L')
             else:
-                gateways.append( (None, "direct", 0, "") )
-            continue
+                gateways[nr] = (None, "direct", 0, "")
+            return
 
         # Try far most route which is not identical with host itself
         ping_probes = settings.get("ping_probes", 5)
@@ -4144,9 +5309,11 @@ def scan_parents_of(hosts, silent=False, settings={}):
             if not r or (r == ip):
                 continue
             # Do (optional) PING check in order to determine if that
-            # gateway can be monitored via the standard host check
+            # gateway can be monitored via the standard host check.
+            # Gateways shared by several hosts are only pinged once.
             if ping_probes:
-                if not gateway_reachable_via_ping(r, ping_probes):
+                ping_status, _unused_output = yield gateway_ping_command(r, ping_probes)
+                if ping_status != 0:
                     console.verbose("(not using %s, not reachable)\n", r, stream=sys.stderr)
                     skipped_gateways += 1
                     continue
@@ -4156,9 +5323,9 @@ def scan_parents_of(hosts, silent=False, settings={}):
             error = "No usable routing information"
             if not silent:
                 sys.stderr.write("%s: %s\n" % (host, error))
-            gateways.append((None, "notfound", 0, error))
+            gateways[nr] = (None, "notfound", 0, error)
             dot(tty.blue)
-            continue
+            return
 
         # TTLs already have been filtered out)
         gateway_ip = route
@@ -4168,10 +5335,22 @@ def scan_parents_of(hosts, silent=False, settings={}):
         else:
             console.verbose("%s ", gateway_ip)
 
-        # Try to find DNS name of host via reverse DNS lookup
-        dns_name = ip_to_dnsname(gateway_ip)
-        gateways.append( ((gateway, gateway_ip, dns_name), "gateway", skipped_gateways, "") )
+        # The DNS name is looked up after all scans are finished
+        gateways[nr] = ((gateway, gateway_ip, None), "gateway", skipped_gateways, "")
         dot(tty.green, 'G')
+
+    max_concurrent = max(1, max_num_processes)
+    cmk_base.parent_scan.run_tasks([ scan_parents_of_host(nr, host)
+                                     for nr, host in enumerate(hosts) ], max_concurrent)
+
+    # Try to find DNS names of the gateways via reverse DNS lookup
+    gateway_ips = [ gw[0][1] for gw in gateways if gw[1] == "gateway" ]
+    dns_names = cmk_base.parent_scan.reverse_lookups(gateway_ips, max_concurrent)
+    for nr, (gw, state, skipped_gateways, message) in enumerate(gateways):
+        if state == "gateway":
+            gateway, gateway_ip, _unused_dns_name = gw
+            gateways[nr] = ((gateway, gateway_ip, dns_names[gateway_ip]), state,
+                            skipped_gateways, message)
     return gateways
 
 # find hostname belonging to an ip address. We must not use
@@ -4191,12 +5370,6 @@ def ip_to_hostname(ip):
                 pass
     return ip_to_hostname_cache.get(ip)
 
-def ip_to_dnsname(ip):
-    try:
-        return socket.gethostbyaddr(ip)[0]
-    except:
-        return None
-
 def config_timestamp():
     mtime = 0
     for dirpath, _unused_dirnames, filenames in os.walk(cmk.paths.check_mk_config_dir):
@@ -4223,6 +5396,10 @@ def cleanup_globals():
     g_hostname = "unknown"
     global g_item_state
     g_item_state = {}
+    global g_item_state_file
+    g_item_state_file = None
+    global g_piggyback_store
+    g_piggyback_store = None
     global g_infocache
     g_infocache = {}
     global g_agent_cache_info
@@ -4235,9 +5412,14 @@ def cleanup_globals():
     g_inactive_timerperiods = None
     global g_walk_cache
     g_walk_cache = {}
+    g_snmp_walk_plans.clear()
+    g_snmp_walks.clear()
     global g_timeout
     g_timeout = None
     clear_other_hosts_oid_cache(None)
+    save_persistent_caches()
+
+    close_builtin_snmp_sessions()
 
     if has_inline_snmp:
         cleanup_inline_snmp_globals()
@@ -4305,15 +5487,17 @@ def interactive_abort(error):
         sys.exit(1)
 
 
-def read_config_files(with_conf_d=True, validate_hosts=True):
-    global vars_before_config, checks
-
-    # Initialize dictionary-type default levels variables
-    for check in check_info.values():
+# Initialize dictionary-type default levels variables
+def initialize_default_levels_variables(checks):
+    for check in checks:
         def_var = check.get("default_levels_variable")
         if def_var:
             globals()[def_var] = {}
 
+
+def read_config_files(with_conf_d=True, validate_hosts=True):
+    global vars_before_config, checks
+
     # Create list of all files to be included
     if with_conf_d:
         list_of_files = reduce(lambda a,b: a+b,
@@ -4329,6 +5513,15 @@ def read_config_files(with_conf_d=True, validate_hosts=True):
         if os.path.exists(path):
             list_of_files.append(path)
 
+    # When the check plugins are loaded on demand, the plugins defining
+    # variables used in the configuration need to be loaded now
+    if g_lazy_check_plugins:
+        for _f in list_of_files:
+            load_check_plugins_referenced_by(file(_f).read())
+        g_lazy_check_plugins["config_loaded"] = True
+
+    initialize_default_levels_variables(loaded_checks())
+
     global FILE_PATH, FOLDER_PATH
     FILE_PATH = None
     FOLDER_PATH = None
@@ -4537,6 +5730,21 @@ def get_checkgroup_parameters(host, checktype, item):
         raise MKGeneralException(str(e) + " (on host %s, checktype %s)" % (host, checktype))
 
 
+# Loading the check plugins on demand is only done for the operation modes
+# which are known to need only the plugins of a single host: checking a
+# host, getting the autochecks of a host and notifications
+def lazy_check_loading_possible(opts, args):
+    modifiers = [ '-v', '--verbose', '-n', '-p', '-c', '--cache', '--no-cache', '--no-tcp',
+                  '--debug', '--checks', '--fake-dns', '--usewalk', '-f', '--force' ]
+    modes = [ (o, a) for o, a in opts if o not in modifiers ]
+    if not modes:
+        return len(args) in [ 1, 2 ] # check a single host
+    elif len(modes) == 1:
+        o, a = modes[0]
+        return o == "--notify" or (o == "--automation" and a == "get-autochecks")
+    return False
+
+
 def output_profile():
     if g_profile:
         g_profile.dump_stats(g_profile_path)
@@ -4564,7 +5772,6 @@ def output_profile():
 #   '----------------------------------------------------------------------'
 
 register_sigint_handler()
-load_checks()
 
 opt_split_rrds = False
 opt_delete_rrds = False
@@ -4576,7 +5783,7 @@ long_options = [ "help", "version", "verbose", "compile", "debug", "interactive"
                  "list-checks", "list-hosts", "list-tag", "no-tcp", "cache",
                  "flush", "package", "localize", "donate", "snmpwalk", "oid=", "extraoid=",
                  "snmptranslate", "bake-agents", "force", "show-snmp-stats",
-                 "usewalk", "scan-parents", "procs=", "automation=", "handle-alerts", "notify",
+                 "usewalk", "scan-parents", "check-hosts", "procs=", "automation=", "handle-alerts", "notify",
                  "snmpget=", "profile", "keepalive", "keepalive-fd=", "create-rrd",
                  "convert-rrds", "compress-history", "split-rrds", "delete-rrds",
                  "no-cache", "update", "restart", "reload", "dump", "fake-dns=",
@@ -4597,6 +5804,8 @@ except getopt.GetoptError, err:
     sys.stdout.write("%s\n" % err)
     sys.exit(1)
 
+load_checks(lazy=lazy_check_loading_possible(opts, args))
+
 # Read the configuration files (main.mk, autochecks, etc.), but not for
 # certain operation modes that does not need them and should not be harmed
 # by a broken configuration
@@ -4787,6 +5996,9 @@ try:
         elif o == '--scan-parents':
             do_scan_parents(args)
             done = True
+        elif o == '--check-hosts':
+            exit_status = do_check_hosts(args, check_types)
+            done = True
         elif o == '--automation':
             load_module("automation")
             do_automation(a, args)
@@ -4896,6 +6108,7 @@ try:
 
             exit_status = do_check(hostname, ipaddress, check_types)
 
+    save_persistent_caches()
     output_profile()
     sys.exit(exit_status)
 
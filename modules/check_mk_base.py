@@ -44,6 +44,7 @@ sys.path.pop(0)
 
 import socket
 import os
+import ast
 import fnmatch
 import time
 import re
@@ -61,6 +62,10 @@ import cmk.crash_reporting as crash_reporting
 import cmk.paths
 
 import cmk_base.agent_simulator
+import cmk_base.cache_file
+import cmk_base.item_state
+import cmk_base.piggyback
+import cmk_base.result_submission
 import cmk_base.utils
 import cmk_base.prediction
 import cmk_base.console as console
@@ -109,17 +114,25 @@ g_infocache                  = {} # In-memory cache of host info.
 g_agent_cache_info           = {} # Information about agent caching
 g_agent_already_contacted    = {} # do we have agent data from this host?
 g_item_state                 = {} # storing counters of one host
+g_item_state_file            = None # file the counters are stored in (see load_item_state())
+g_piggyback_store            = None # see piggyback_store()
 g_hostname                   = "unknown" # Host currently being checked
 g_aggregated_service_results = {}   # store results for later submission
 g_inactive_timerperiods      = None # Cache for current state of timeperiods
 g_last_counter_wrap          = None
 nagios_command_pipe          = None # Filedescriptor to open nagios command pipe.
+g_command_pipe_buffer        = cmk_base.result_submission.CommandPipeBuffer()
+g_checkresult_file_buffer    = cmk_base.result_submission.CheckResultFileBuffer()
 checkresult_file_fd          = None
 checkresult_file_path        = None
 g_single_oid_hostname        = None
 g_single_oid_cache           = {}
 g_broken_snmp_hosts          = set([])
 g_broken_agent_hosts         = set([])
+g_prefetched_agent_outputs   = {} # raw agent output fetched in advance (--check-hosts)
+g_prefetched_snmp_walks      = {} # SNMP walks of built-in SNMP hosts done in advance (--check-hosts)
+g_snmp_walk_plans            = {} # subtrees to walk for the SNMP checks of a host (see plan_snmp_walks())
+g_snmp_walks                 = {} # subtrees walked in the current check cycle of a host
 g_timeout                    = None
 g_global_caches              = []
 
@@ -147,6 +160,7 @@ opt_cleanup_autochecks       = False
 opt_keepalive                = False
 opt_cmc_relfilename          = "config"
 opt_keepalive_fd             = None
+opt_check_hosts              = False # checking several hosts in one process
 opt_oids                     = []
 opt_extra_oids               = []
 opt_force                    = False
@@ -349,7 +363,7 @@ def get_realhost_info(hostname, ipaddress, check_type, max_cache_age,
 
     info = get_cached_hostinfo(hostname)
     if info and info.has_key(check_type):
-        return info[check_type]
+        return section_content(info[check_type])
 
     cache_relpath = hostname + "." + check_type
 
@@ -385,7 +399,7 @@ def get_realhost_info(hostname, ipaddress, check_type, max_cache_age,
             raise
 
         if content:
-            return eval(content)
+            return parse_snmp_cache_file(content)
         # Not cached -> need to get info via SNMP
 
         # Try to contact host only once
@@ -409,7 +423,7 @@ def get_realhost_info(hostname, ipaddress, check_type, max_cache_age,
         # prevent the regular checking from getting status updates during
         # interactive debugging, for example with cmk -nv.
         if not opt_dont_submit:
-            write_cache_file(cache_relpath, repr(table) + "\n")
+            write_cache_file(cache_relpath, cmk_base.cache_file.dumps([("table", table)]))
         return table
 
     # Note: even von SNMP-tagged hosts TCP based checks can be used, if
@@ -459,7 +473,7 @@ def get_realhost_info(hostname, ipaddress, check_type, max_cache_age,
     elif len(output) < 16:
         raise MKAgentError("Too short output from agent: '%s'" % output)
 
-    info, piggybacked, persisted, agent_cache_info = parse_info(output.split("\n"), hostname)
+    info, piggybacked, persisted, agent_cache_info = parse_info(output, hostname)
     g_agent_cache_info.setdefault(hostname, {}).update(agent_cache_info)
     store_piggyback_info(hostname, piggybacked)
     store_persisted_info(hostname, persisted)
@@ -478,7 +492,18 @@ def get_realhost_info(hostname, ipaddress, check_type, max_cache_age,
         else:
             return []
 
-    return info[check_type] # return only data for specified check
+    return section_content(info[check_type]) # return only data for specified check
+
+# SNMP cache files written by older versions contain the repr() of the
+# table. These are still read (but not evaluated) until they are replaced.
+def parse_snmp_cache_file(content):
+    try:
+        return cmk_base.cache_file.loads(content, "table")
+    except cmk_base.cache_file.MKCacheFormatError:
+        if content.startswith(cmk_base.cache_file.MAGIC):
+            raise
+        return ast.literal_eval(content)
+
 
 def store_persisted_info(hostname, persisted):
     dirname = cmk.paths.var_dir + "/persisted/"
@@ -529,22 +554,20 @@ def add_persisted_info(hostname, info):
         store_persisted_info(hostname, persisted)
 
 
+def piggyback_store():
+    global g_piggyback_store
+    if g_piggyback_store is None:
+        g_piggyback_store = cmk_base.piggyback.PiggybackStore(cmk.paths.tmp_dir + "/piggyback",
+                                                              cmk.paths.tmp_dir + "/piggyback_sources")
+    return g_piggyback_store
+
+
 def get_piggyback_files(hostname):
-    files = []
-    dir = cmk.paths.tmp_dir + "/piggyback/" + hostname
-    if os.path.exists(dir):
-        for sourcehost in os.listdir(dir):
-            if sourcehost not in ['.', '..'] \
-               and not sourcehost.startswith(".new."):
-                file_path = dir + "/" + sourcehost
-
-                if cachefile_age(file_path) > piggyback_max_cachefile_age:
-                    console.verbose("Piggyback file %s is outdated by %d seconds. Deleting it.\n" %
-                        (file_path, cachefile_age(file_path) - piggyback_max_cachefile_age))
-                    os.remove(file_path)
-                    continue
-
-                files.append((sourcehost, file_path))
+    files, outdated = piggyback_store().files_of(hostname, piggyback_max_cachefile_age)
+    for sourcehost, file_path, age in outdated:
+        console.verbose("Piggyback file %s is outdated by %d seconds. Deleting it.\n" %
+                            (file_path, age))
+        piggyback_store().remove_file(hostname, sourcehost)
     return files
 
 
@@ -558,47 +581,23 @@ def get_piggyback_info(hostname):
         return output
     for sourcehost, file_path in get_piggyback_files(hostname):
         console.verbose("Using piggyback information from host %s.\n" % sourcehost)
-        output += file(file_path).read()
+        try:
+            output += file(file_path).read()
+        except IOError:
+            pass # removed by the source host in the meantime
     return output
 
 
 def store_piggyback_info(sourcehost, piggybacked):
-    piggyback_path = cmk.paths.tmp_dir + "/piggyback/"
-    for backedhost, lines in piggybacked.items():
+    for backedhost in piggybacked:
         console.verbose("Storing piggyback data for %s.\n" % backedhost)
-        dir = piggyback_path + backedhost
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-        out = file(dir + "/.new." + sourcehost, "w")
-        for line in lines:
-            out.write("%s\n" % line)
-        os.rename(dir + "/.new." + sourcehost, dir + "/" + sourcehost)
-
-    # Remove piggybacked information that is not
+    # Also removes piggybacked information that is not
     # being sent this turn
-    remove_piggyback_info_from(sourcehost, keep=piggybacked.keys())
-
-
-def remove_piggyback_info_from(sourcehost, keep=[]):
-    removed = 0
-    piggyback_path = cmk.paths.tmp_dir + "/piggyback/"
-    if not os.path.exists(piggyback_path):
-        return # Nothing to do
+    piggyback_store().store(sourcehost, piggybacked)
 
-    for backedhost in os.listdir(piggyback_path):
-        if backedhost not in ['.', '..'] and backedhost not in keep:
-            path = piggyback_path + backedhost + "/" + sourcehost
-            if os.path.exists(path):
-                console.verbose("Removing stale piggyback file %s\n" % path)
-                os.remove(path)
-                removed += 1
 
-            # Remove directory if empty
-            try:
-                os.rmdir(piggyback_path + backedhost)
-            except:
-                pass
-    return removed
+def remove_piggyback_info_from(sourcehost):
+    return piggyback_store().remove_source(sourcehost)
 
 
 def translate_piggyback_host(sourcehost, backedhost):
@@ -790,6 +789,41 @@ def decrypt_package(encrypted_pkg, encryption_key):
     return unpad(decrypted_pkg)
 
 
+# Connect to the agent and read its raw (maybe encrypted) output
+def fetch_agent_output_tcp(hostname, ipaddress, port):
+    s = socket.socket(is_ipv6_primary(hostname) and socket.AF_INET6 or socket.AF_INET,
+                      socket.SOCK_STREAM)
+    try:
+        s.settimeout(tcp_connect_timeout)
+    except:
+        pass # some old Python versions lack settimeout(). Better ignore than fail
+    console.vverbose("Connecting via TCP to %s:%d.\n" % (ipaddress, port))
+    s.connect((ipaddress, port))
+    # Immediately close sending direction. We do not send any data
+    # s.shutdown(socket.SHUT_WR)
+    try:
+        s.setblocking(1)
+    except:
+        pass
+    output = ""
+    try:
+        while True:
+            out = s.recv(4096, socket.MSG_WAITALL)
+            if out and len(out) > 0:
+                output += out
+            else:
+                break
+    except Exception, e:
+        # Python seems to skip closing the socket under certain
+        # conditions, leaving open filedescriptors and sockets in
+        # CLOSE_WAIT. This happens one a timeout (ALERT signal)
+        s.close()
+        raise
+
+    s.close()
+    return output
+
+
 # Get data in case of TCP
 def get_agent_info_tcp(hostname, ipaddress, port = None):
     if not ipaddress:
@@ -801,36 +835,15 @@ def get_agent_info_tcp(hostname, ipaddress, port = None):
     encryption_settings = agent_encryption_settings(hostname)
 
     try:
-        s = socket.socket(is_ipv6_primary(hostname) and socket.AF_INET6 or socket.AF_INET,
-                          socket.SOCK_STREAM)
-        try:
-            s.settimeout(tcp_connect_timeout)
-        except:
-            pass # some old Python versions lack settimeout(). Better ignore than fail
-        console.vverbose("Connecting via TCP to %s:%d.\n" % (ipaddress, port))
-        s.connect((ipaddress, port))
-        # Immediately close sending direction. We do not send any data
-        # s.shutdown(socket.SHUT_WR)
-        try:
-            s.setblocking(1)
-        except:
-            pass
-        output = ""
-        try:
-            while True:
-                out = s.recv(4096, socket.MSG_WAITALL)
-                if out and len(out) > 0:
-                    output += out
-                else:
-                    break
-        except Exception, e:
-            # Python seems to skip closing the socket under certain
-            # conditions, leaving open filedescriptors and sockets in
-            # CLOSE_WAIT. This happens one a timeout (ALERT signal)
-            s.close()
-            raise
+        # The agent output might already have been fetched together with
+        # the output of other hosts (see fetch_agent_outputs())
+        if hostname in g_prefetched_agent_outputs:
+            output = g_prefetched_agent_outputs[hostname]
+            if isinstance(output, MKAgentError):
+                raise output
+        else:
+            output = fetch_agent_output_tcp(hostname, ipaddress, port)
 
-        s.close()
         if len(output) == 0: # may be caused by xinetd not allowing our address
             raise MKAgentError("Empty output from agent at TCP port %d" % port)
 
@@ -882,26 +895,108 @@ def store_cached_checkinfo(hostname, checkname, table):
         g_infocache[hostname] = { checkname: table }
 
 
+# The lines of one agent section. The section is only known by the
+# offsets of its lines within the raw agent output. Stripping, decoding
+# and splitting of the lines is done on the first access to the section
+# (see section_content()). Large sections that are not needed by any
+# check of a host are thus never processed.
+class AgentSection(object):
+    def __init__(self, output):
+        self._output = output
+        self._chunks = []
+        self._rows = None
+
+
+    # A section might consist of several chunks since the same section
+    # may appear several times in the agent output - each time with
+    # its own options.
+    def add_chunk(self, start, end, separator, encoding, nostrip):
+        self._chunks.append((start, end, separator, encoding, nostrip))
+
+
+    def rows(self):
+        if self._rows is None:
+            rows = []
+            for start, end, separator, encoding, nostrip in self._chunks:
+                for line in self._output[start:end].split("\n"):
+                    stripped_line = line.strip()
+                    if stripped_line == '':
+                        continue
+
+                    if nostrip:
+                        line = line.rstrip("\r")
+                    else:
+                        line = stripped_line
+
+                    if encoding:
+                        line = decode_incoming_string(line, encoding)
+                    else:
+                        line = decode_incoming_string(line)
+
+                    rows.append(line.split(separator))
+
+            self._rows = rows
+            self._output, self._chunks = None, None # free the raw output
+        return self._rows
+
+
+# Returns the list of rows of a section as found in the host info
+def section_content(section):
+    if isinstance(section, AgentSection):
+        return section.rows()
+    return section
+
+
 # Split agent output in chunks, splits lines by whitespaces.
 # Returns a tuple of:
-# 1. A dictionary from "sectionname" to a list of rows
+# 1. A dictionary from "sectionname" to an AgentSection object or a
+#    list of rows (use section_content() for accessing the rows)
 # 2. piggy-backed data for other hosts
 # 3. Sections to be persisted for later usage
 # 4. Agent cache information (dict section name -> (cached_at, cache_interval))
-def parse_info(lines, hostname):
+#
+# The output is not split into lines here. Only the section headers
+# are looked up and the data between them is remembered as offsets
+# into the output.
+def parse_info(output, hostname):
     info = {}
     piggybacked = {} # unparsed info for other hosts
     persist = {} # handle sections with option persist(...)
-    host = None
-    section = []
-    section_options = {}
     agent_cache_info = {}
+
+    host = None # piggybacked host currently being processed
+    section = None
+    section_options = {}
     separator = None
-    encoding  = None
-    for line in lines:
-        line = line.rstrip("\r")
-        stripped_line = line.strip()
+    encoding = None
+    chunk_start = 0
+
+    # Assign the data between the previous header and the header line
+    # starting at "end" to the current piggybacked host or section
+    def add_chunk(end):
+        if host:
+            if chunk_start < end:
+                lines = [ l.rstrip("\r") for l in output[chunk_start:end-1].split("\n") ]
+                piggybacked.setdefault(host, []).extend(lines)
+        elif section is not None:
+            section.add_chunk(chunk_start, end, separator, encoding, "nostrip" in section_options)
+
+    # Header lines are found by looking for "<<<" instead of examining
+    # every single line of the output
+    pos = output.find("<<<")
+    while pos != -1:
+        line_start = output.rfind("\n", 0, pos) + 1
+        line_end = output.find("\n", pos)
+        if line_end == -1:
+            line_end = len(output)
+        pos = output.find("<<<", line_end)
+
+        stripped_line = output[line_start:line_end].strip()
+        if stripped_line[:3] != '<<<' or stripped_line[-3:] != '>>>':
+            continue
+
         if stripped_line[:4] == '<<<<' and stripped_line[-4:] == '>>>>':
+            add_chunk(line_start)
             host = stripped_line[4:-4]
             if not host:
                 host = None
@@ -909,12 +1004,14 @@ def parse_info(lines, hostname):
                 host = translate_piggyback_host(hostname, host)
                 if host == hostname:
                     host = None # unpiggybacked "normal" host
+
         elif host: # processing data for an other host
-            piggybacked.setdefault(host, []).append(line)
+            continue
 
         # Found normal section header
         # section header has format <<<name:opt1(args):opt2:opt3(args)>>>
-        elif stripped_line[:3] == '<<<' and stripped_line[-3:] == '>>>':
+        else:
+            add_chunk(line_start)
             section_header = stripped_line[3:-3]
             headerparts = section_header.split(":")
             section_name = headerparts[0]
@@ -930,7 +1027,7 @@ def parse_info(lines, hostname):
 
             section = info.get(section_name, None)
             if section == None: # section appears in output for the first time
-                section = []
+                section = AgentSection(output)
                 info[section_name] = section
             try:
                 separator = chr(int(section_options["sep"]))
@@ -951,16 +1048,14 @@ def parse_info(lines, hostname):
             # The section data might have a different encoding
             encoding = section_options.get("encoding")
 
-        elif stripped_line != '':
-            if "nostrip" not in section_options:
-                line = stripped_line
+        chunk_start = line_end + 1
 
-            if encoding:
-                line = decode_incoming_string(line, encoding)
-            else:
-                line = decode_incoming_string(line)
+    add_chunk(len(output) + 1)
 
-            section.append(line.split(separator))
+    # Persisted sections are written to disk right away, so they are
+    # needed completely anyway
+    for section_name, (cached_at, until, section) in persist.items():
+        persist[section_name] = (cached_at, until, section.rows())
 
     return info, piggybacked, persist, agent_cache_info
 
@@ -1005,22 +1100,25 @@ def cachefile_age(filename):
 #   '----------------------------------------------------------------------'
 
 
+# The item states are stored in a binary log per host. Only the changed
+# states are written (see cmk_base.item_state).
 def load_item_state(hostname):
-    global g_item_state
-    filename = cmk.paths.counters_dir + "/" + hostname
-    try:
-        g_item_state = eval(file(filename).read())
-    except:
-        g_item_state = {}
+    global g_item_state, g_item_state_file
+    g_item_state_file = cmk_base.item_state.ItemStateFile(cmk.paths.counters_dir + "/" + hostname)
+    g_item_state = g_item_state_file.load()
 
 
 def save_item_state(hostname):
+    global g_item_state_file
     if not opt_dont_submit and not i_am_root(): # never writer counters as root
         filename = cmk.paths.counters_dir + "/" + hostname
         try:
             if not os.path.exists(cmk.paths.counters_dir):
                 os.makedirs(cmk.paths.counters_dir)
-            file(filename, "w").write("%r\n" % g_item_state)
+            if g_item_state_file is None or g_item_state_file.path != filename:
+                # Not loaded before: The file is written completely
+                g_item_state_file = cmk_base.item_state.ItemStateFile(filename)
+            g_item_state_file.save(g_item_state)
         except Exception, e:
             import pwd
             username = pwd.getpwuid(os.getuid())[0]
@@ -1238,15 +1336,18 @@ def do_check(hostname, ipaddress, only_check_types = None):
                 output += "Agent version %s, " % agent_version
             status = 0
 
-    except MKTimeout:
-        raise
-
     except MKGeneralException, e:
         if cmk.debug.enabled():
             raise
         output = "%s, " % e
         status = exit_spec.get("exception", 3)
 
+    except:
+        # Submit the results of the checks done so far (e.g. before a
+        # timeout) instead of leaving them to the next host
+        flush_check_results_after_error()
+        raise
+
     if aggregate_check_mk:
         try:
             submit_check_mk_aggregation(hostname, status, output)
@@ -1254,8 +1355,15 @@ def do_check(hostname, ipaddress, only_check_types = None):
             if cmk.debug.enabled():
                 raise
 
-    if checkresult_file_fd != None:
-        close_checkresult_file()
+    # With --check-hosts the results are flushed after a bunch of hosts
+    if not opt_check_hosts:
+        try:
+            flush_check_results()
+        except MKGeneralException, e:
+            if cmk.debug.enabled():
+                raise
+            output += "%s, " % e
+            status = exit_spec.get("exception", 3)
 
     run_time = time.time() - start_time
     if check_mk_perfdata_with_times:
@@ -1278,6 +1386,11 @@ def do_check(hostname, ipaddress, only_check_types = None):
         console.verbose(output)
     else:
         console.output(core_state_names[status] + " - " + output.encode('utf-8'))
+        # There is no core waiting for our output. Send the result of the
+        # Check_MK service to the core just like the other check results.
+        if opt_check_hosts and not opt_dont_submit:
+            submit_to_core(hostname, "Check_MK", status,
+                           core_state_names[status] + " - " + output.rstrip("\n"))
 
     return status
 
@@ -1332,6 +1445,14 @@ def do_all_checks_on_host(hostname, ipaddress, only_check_types = None, fetch_ag
 
     parsed_infos = {} # temporary cache for section infos, maybe parsed
 
+    # Plan the SNMP walks of all checks at once, so that tables contained in
+    # each other are only walked once
+    snmp_check_types = [ entry[0] for entry in check_table
+                         if (only_check_types is None or entry[0] in only_check_types)
+                            and check_uses_snmp(entry[0]) ]
+    if snmp_check_types and is_snmp_host(hostname) and not is_cluster(hostname):
+        plan_snmp_walks(hostname, snmp_check_types)
+
     def execute_check(checkname, item, params, description, aggrname, ipaddress):
         if only_check_types != None and checkname not in only_check_types:
             return False
@@ -1537,26 +1658,13 @@ def is_manual_check(hostname, check_type, item):
     return (check_type, item) in manual_checks
 
 
-g_snmp_info_set  = {}
-g_global_caches.append("g_snmp_info_set")
-g_check_info_set = {}
-g_global_caches.append("g_check_info_set")
-def initialize_checktype_caches():
-    global g_snmp_info_set
-    global g_check_info_set
-
-    if not g_snmp_info_set:
-        g_snmp_info_set  = set(snmp_info.keys())
-        g_check_info_set = set(check_info.keys())
-
 g_is_snmp_check_cache = {}
 g_global_caches.append("g_is_snmp_check_cache")
 def is_snmp_check(check_name):
     if check_name in g_is_snmp_check_cache:
         return g_is_snmp_check_cache[check_name]
 
-    initialize_checktype_caches()
-    result = check_name.split(".")[0] in g_snmp_info_set
+    result = check_name.split(".")[0] in snmp_info
     g_is_snmp_check_cache[check_name] = result
     return result
 
@@ -1566,8 +1674,7 @@ def is_tcp_check(check_name):
     if check_name in g_is_tcp_check_cache:
         return g_is_tcp_check_cache[check_name]
 
-    initialize_checktype_caches()
-    result = check_name in g_check_info_set and check_name.split(".")[0] not in g_snmp_info_set # snmp check basename
+    result = check_name in check_info and check_name.split(".")[0] not in snmp_info # snmp check basename
     g_is_tcp_check_cache[check_name] = result
     return result
 
@@ -1592,7 +1699,11 @@ def create_crash_dump_info_file(crash_dir, hostname, check_type, item, params, d
 def write_crash_dump_snmp_info(crash_dir, hostname, check_type):
     cachefile = cmk.paths.tcp_cache_dir + "/" + hostname + "." + check_type.split(".")[0]
     if os.path.exists(cachefile):
-        file(crash_dir + "/snmp_info", "w").write(file(cachefile).read())
+        try:
+            content = "%r\n" % cmk_base.cache_file.load(cachefile, "table")
+        except cmk_base.cache_file.MKCacheFormatError:
+            content = file(cachefile).read()
+        file(crash_dir + "/snmp_info", "w").write(content)
 
 
 def write_crash_dump_agent_output(crash_dir, hostname):
@@ -1616,8 +1727,12 @@ def check_unimplemented(checkname, params, info):
 
 # FIXME: Clear / unset all legacy variables to prevent confusions in other code trying to
 # use the legacy variables which are not set by newer checks.
-def convert_check_info():
-    for check_type, info in check_info.items():
+def convert_check_info(check_types=None):
+    if check_types is None:
+        check_types = check_info.keys()
+
+    for check_type in check_types:
+        info = check_info[check_type]
         basename = check_type.split(".")[0]
 
         if type(info) != dict:
@@ -1666,7 +1781,8 @@ def convert_check_info():
             check_includes[basename] += info.get("includes", [])
 
     # Make sure that setting for node_info of check and subcheck matches
-    for check_type, info in check_info.iteritems():
+    for check_type in check_types:
+        info = check_info[check_type]
         if "." in check_type:
             base_check = check_type.split(".")[0]
             if base_check not in check_info:
@@ -1680,7 +1796,8 @@ def convert_check_info():
     # Now gather snmp_info and snmp_scan_function back to the
     # original arrays. Note: these information is tied to a "agent section",
     # not to a check. Several checks may use the same SNMP info and scan function.
-    for check_type, info in check_info.iteritems():
+    for check_type in check_types:
+        info = check_info[check_type]
         basename = check_type.split(".")[0]
         if info["snmp_info"] and basename not in snmp_info:
             snmp_info[basename] = info["snmp_info"]
@@ -1916,36 +2033,56 @@ def submit_to_core(host, service, state, output, cached_at = None, cache_interva
                                  "Must be 'pipe' or 'file'" % check_submission)
 
 
+# The results are collected in buffers and written to the core by
+# flush_check_results() at the end of the checks of a host (or of a
+# bunch of hosts with --check-hosts). Large buffers are flushed early.
+max_buffered_check_results_size = 1024 * 1024
+
 def submit_via_check_result_file(host, service, state, output):
     output = output.replace("\n", "\\n")
-    open_checkresult_file()
-    if checkresult_file_fd:
-        now = time.time()
-        os.write(checkresult_file_fd,
-                """host_name=%s
-service_description=%s
-check_type=1
-check_options=0
-reschedule_check
-latency=0.0
-start_time=%.1f
-finish_time=%.1f
-return_code=%d
-output=%s
-
-""" % (host, make_utf8(service), now, now, state, make_utf8(output)))
+    g_checkresult_file_buffer.add(host, make_utf8(service), state, make_utf8(output))
+    if g_checkresult_file_buffer.size >= max_buffered_check_results_size:
+        flush_check_results()
 
 
 def submit_via_command_pipe(host, service, state, output):
     output = output.replace("\n", "\\n")
-    open_command_pipe()
-    if nagios_command_pipe:
-        # [<timestamp>] PROCESS_SERVICE_CHECK_RESULT;<host_name>;<svc_description>;<return_code>;<plugin_output>
-        nagios_command_pipe.write("[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" %
-                               (int(time.time()), host, make_utf8(service), state, make_utf8(output)))
-        # Important: Nagios needs the complete command in one single write() block!
-        # Python buffers and sends chunks of 4096 bytes, if we do not flush.
-        nagios_command_pipe.flush()
+    g_command_pipe_buffer.add(host, make_utf8(service), state, make_utf8(output))
+    if g_command_pipe_buffer.size >= max_buffered_check_results_size:
+        flush_check_results()
+
+
+def flush_check_results():
+    if not g_checkresult_file_buffer and not g_command_pipe_buffer:
+        return
+
+    try:
+        if g_checkresult_file_buffer:
+            open_checkresult_file()
+            g_checkresult_file_buffer.flush(lambda data: os.write(checkresult_file_fd, data))
+            close_checkresult_file()
+
+        if g_command_pipe_buffer:
+            open_command_pipe()
+            if nagios_command_pipe:
+                # Important: Nagios needs the complete command in one single write() block!
+                # The buffer writes the commands in blocks of at most PIPE_BUF bytes.
+                g_command_pipe_buffer.flush(lambda data: os.write(nagios_command_pipe.fileno(), data))
+    finally:
+        # Results which could not be written are dropped
+        g_checkresult_file_buffer.clear()
+        g_command_pipe_buffer.clear()
+
+    console.vverbose("%s\n" % cmk_base.result_submission.format_stats(
+                        [ g_checkresult_file_buffer, g_command_pipe_buffer ]))
+
+
+# Used while another exception is being handled, which must not be hidden
+def flush_check_results_after_error():
+    try:
+        flush_check_results()
+    except Exception, e:
+        console.verbose("Cannot submit check results: %s\n" % e)
 
 
 #.
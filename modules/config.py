@@ -34,8 +34,14 @@ agent_ports                        = []
 agent_encryption                   = []
 snmp_ports                         = [] # UDP ports used for SNMP
 tcp_connect_timeout                = 5.0
+agent_read_timeout                 = 60.0 # secs. Limit for receiving agent output with --check-hosts
+max_concurrent_snmp_hosts          = 500 # built-in SNMP hosts walked at the same time with --check-hosts
 use_dns_cache                      = True # prevent DNS by using own cache file
+use_service_match_cache            = True # persist results of service rule matching in var/check_mk
+use_check_table_store              = True # persist the check tables of the hosts in var/check_mk
 delay_precompile                   = False  # delay Python compilation to Nagios execution
+precompiled_plugin_bundle          = False  # share compiled check plugins between precompiled host checks
+config_generation_processes        = 1 # number of processes creating the core config and host checks
 restart_locking                    = "abort" # also possible: "wait", None
 check_submission                   = "file" # alternative: "pipe"
 aggr_summary_hostname              = "%s-s"
@@ -59,6 +65,9 @@ has_inline_snmp                    = False # is set to True by inline_snmp modul
 use_inline_snmp                    = True
 non_inline_snmp_hosts              = [] # Ruleset to disable Inline-SNMP per host when
                                         # use_inline_snmp is enabled.
+builtin_snmp_hosts                 = [] # Ruleset to query classic SNMP hosts with the
+                                        # built-in SNMP engine instead of net-snmp tools
+builtin_snmp_max_repetitions       = 10 # Number of entries per column fetched with one GETBULK
 
 snmp_limit_oid_range               = [] # Ruleset to recduce fetched OIDs of a check, only inline SNMP
 record_inline_snmp_stats           = False
@@ -82,6 +91,7 @@ inventory_check_autotrigger        = True # Automatically trigger inv-check afte
 always_cleanup_autochecks          = None # For compatiblity with old configuration
 
 periodic_discovery                 = []
+discovery_processes                = 1 # number of processes discovering services with -I, -II and --discover-marked-hosts
 
 # Nagios templates and other settings concerning generation
 # of Nagios configuration files. No need to change these values.
@@ -24,11 +24,17 @@
 # to the Free Software Foundation, Inc., 51 Franklin St,  Fifth Floor,
 # Boston, MA 02110-1301 USA.
 
+import types
+from cStringIO import StringIO
+
 from cmk.regex import regex
 import cmk.tty as tty
 import cmk.paths
 
 import cmk_base.console as console
+import cmk_base.parallel
+import cmk_base.autochecks
+import cmk_base.discovery_fingerprints
 
 #   .--cmk -I--------------------------------------------------------------.
 #   |                                  _           ___                     |
@@ -69,22 +75,25 @@ def do_discovery(hostnames, check_types, only_new):
     hostnames = list(set([ h for h in hostnames if not is_cluster(h) ]))
     hostnames.sort()
 
-    # Now loop through all hosts
-    for hostname in hostnames:
+    if cmk.debug.enabled():
+        on_error = "raise"
+    else:
+        on_error = "warn"
+
+    def discover(hostname):
         try:
             console.verbose(tty.bold + hostname + tty.normal + ":\n")
-            if cmk.debug.enabled():
-                on_error = "raise"
-            else:
-                on_error = "warn"
             do_discovery_for(hostname, check_types, only_new, use_caches, on_error)
             console.verbose("\n")
         except Exception, e:
             if cmk.debug.enabled():
                 raise
             console.verbose(" -> Failed: %s\n" % e)
+            return None, "%s" % e
+        return None, None
 
-        cleanup_globals()
+    # Now loop through all hosts
+    discover_hosts(hostnames, discover)
 
     # Check whether or not the cluster host autocheck files are still
     # existant. Remove them. The autochecks are only stored in the nodes
@@ -92,6 +101,80 @@ def do_discovery(hostnames, check_types, only_new):
     for hostname in cluster_hosts:
         remove_autochecks_file(hostname)
 
+# Calls discover() for each of the hosts. It returns a pair of its result
+# and an error message, which is None if the host has been discovered.
+# With discovery_processes > 1 the hosts are discovered by forked worker
+# processes. The output of the hosts is then written in the order of the
+# hosts, followed by a summary of the time needed per host and of the
+# failed hosts. Returns the list of pairs of the hosts and the results.
+def discover_hosts(hostnames, discover):
+    num_processes = min(discovery_processes, len(hostnames))
+    if num_processes <= 1:
+        results = []
+        for hostname in hostnames:
+            result, _unused_error = discover(hostname)
+            results.append((hostname, result))
+            cleanup_globals()
+        return results
+
+    console.verbose("Discovering services of %d hosts (%d processes)...\n" %
+                    (len(hostnames), num_processes))
+
+    # The hosts are distributed round robin, because hosts of the same
+    # kind, e.g. slow SNMP devices, are often sorted next to each other.
+    # The shards then hold every num_processes-th host.
+    numbered = list(enumerate(hostnames))
+    distributed = []
+    for offset in range(num_processes):
+        distributed += numbered[offset::num_processes]
+
+    host_results = []
+    for shard_results in cmk_base.parallel.map_shards(lambda shard: discover_hosts_of(shard, discover),
+                                                      distributed, num_processes):
+        host_results += shard_results
+    host_results.sort()
+
+    failed = []
+    for _unused_nr, hostname, output, _unused_duration, _unused_result, error in host_results:
+        console.output(output)
+        if error is not None:
+            failed.append((hostname, error))
+
+    console.verbose("Time needed per host:\n")
+    for _unused_nr, hostname, _unused_output, duration, _unused_result, _unused_error \
+        in sorted(host_results, key=lambda entry: -entry[3]):
+        console.verbose("  %-40s %7.2f sec\n" % (hostname, duration))
+
+    if failed:
+        console.verbose("Discovery failed on %d of %d hosts:\n" % (len(failed), len(hostnames)))
+        for hostname, error in failed:
+            console.verbose("  %-40s %s\n" % (hostname, error or "host is offline"))
+    else:
+        console.verbose("Discovery succeeded on all %d hosts.\n" % len(hostnames))
+
+    return [ (hostname, result) for _unused_nr, hostname, _unused_output,
+                                    _unused_duration, result, _unused_error in host_results ]
+
+
+# Discovers the given numbered hosts in a worker process of
+# discover_hosts(). Returns a list of the number of each host, the host
+# name, the output, the time needed and the result of discover().
+def discover_hosts_of(hosts, discover):
+    results = []
+    for nr, hostname in hosts:
+        start_time = time.time()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            result, error = discover(hostname)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        cleanup_globals()
+        results.append((nr, hostname, output, time.time() - start_time, result, error))
+    return results
+
+
 def do_discovery_for(hostname, check_types, only_new, use_caches, on_error):
     # Usually we disable SNMP scan if cmk -I is used without a list of
     # explicity hosts. But for host that have never been service-discovered
@@ -270,7 +353,7 @@ def check_discovery(hostname, ipaddress=None):
     try:
         # scan services, register changes
         try:
-            services = get_host_services(hostname, use_caches=opt_use_cachefile,
+            services = get_host_services_incremental(hostname, use_caches=opt_use_cachefile,
                                         do_snmp_scan=params["inventory_check_do_scan"],
                                         on_error="raise",
                                         ipaddress=ipaddress)
@@ -469,20 +552,22 @@ def discover_marked_hosts():
         console.verbose("  Nothing to do. No hosts marked by discovery check.\n")
         return
 
-    activation_required = False
-
+    configured_hosts = []
     for hostname in hosts:
-        console.verbose("%s%s%s:\n" % (tty.bold, hostname, tty.normal))
-        host_flag_path = autodiscovery_dir + "/" + hostname
-
         if hostname not in all_configured_hosts():
-            os.remove(host_flag_path)
+            console.verbose("%s%s%s:\n" % (tty.bold, hostname, tty.normal))
+            os.remove(autodiscovery_dir + "/" + hostname)
             console.verbose("  Skipped. Host does not exist in configuration. Removing mark.\n")
-            continue
+        else:
+            configured_hosts.append(hostname)
 
+    # Returns "timeout", "skipped", "failed", "unchanged", "changed" or
+    # "activate" (changed and the core needs to be restarted)
+    def discover_marked_host(hostname):
         if time.time() > end_time_ts:
-            console.warning("  Timeout of %d seconds reached. Lets do the remaining hosts next time." % marked_host_discovery_timeout)
-            break
+            return "timeout", None
+
+        console.verbose("%s%s%s:\n" % (tty.bold, hostname, tty.normal))
 
         # have to do hosts one-by-one because each could have a different configuration
         params = discovery_check_parameters(hostname) or default_discovery_check_parameters()
@@ -498,36 +583,56 @@ def discover_marked_hosts():
             item_filters = None
 
         why_not = may_rediscover(params)
-        if not why_not:
-            redisc_params = params["inventory_rediscovery"]
-            console.verbose("  Doing discovery with mode '%s'...\n" % mode_table[redisc_params["mode"]])
-            result, error = discover_on_host(mode_table[redisc_params["mode"]], hostname,
-                                             params["inventory_check_do_scan"], True,
-                                             service_filter=item_filters)
-            if error is not None:
-                if error:
-                    console.verbose("failed: %s\n" % error)
-                else:
-                    # for offline hosts the error message is empty. This is to remain
-                    # compatible with the automation code
-                    console.verbose("  failed: host is offline\n")
+        if why_not:
+            console.verbose("  skipped: %s\n" % why_not)
+            return "skipped", None
+
+        redisc_params = params["inventory_rediscovery"]
+        console.verbose("  Doing discovery with mode '%s'...\n" % mode_table[redisc_params["mode"]])
+        result, error = discover_on_host(mode_table[redisc_params["mode"]], hostname,
+                                         params["inventory_check_do_scan"], True,
+                                         service_filter=item_filters)
+        if error is not None:
+            if error:
+                console.verbose("failed: %s\n" % error)
             else:
-                new_services, removed_services, kept_services, total_services = result
-                if new_services == 0 and removed_services == 0 and kept_services == total_services:
-                    console.verbose("  nothing changed.\n")
-                else:
-                    console.verbose("  %d new, %d removed, %d kept, %d total services.\n" % (tuple(result)))
-                    if redisc_params["activation"]:
-                        activation_required = True
+                # for offline hosts the error message is empty. This is to remain
+                # compatible with the automation code
+                console.verbose("  failed: host is offline\n")
+            return "failed", error
+
+        new_services, removed_services, kept_services, total_services = result
+        if new_services == 0 and removed_services == 0 and kept_services == total_services:
+            console.verbose("  nothing changed.\n")
+            return "unchanged", None
+
+        console.verbose("  %d new, %d removed, %d kept, %d total services.\n" % (tuple(result)))
+        if redisc_params["activation"]:
+            return "activate", None
+        return "changed", None
+
+    # The marks are handled here and not by the worker processes of
+    # discover_hosts()
+    activation_required = False
+    timeout_reached = False
+    for hostname, result in discover_hosts(configured_hosts, discover_marked_host):
+        if result == "timeout":
+            if not timeout_reached:
+                console.warning("  Timeout of %d seconds reached. Lets do the remaining hosts next time." % marked_host_discovery_timeout)
+                timeout_reached = True
+            continue
+
+        elif result in [ "changed", "activate" ]:
+            if result == "activate":
+                activation_required = True
 
-                    # Now ensure that the discovery service is updated right after the changes
-                    schedule_inventory_check(hostname)
+            # Now ensure that the discovery service is updated right after the changes
+            schedule_inventory_check(hostname)
 
+        if result != "skipped":
             # delete the file even in error case, otherwise we might be causing the same error
             # every time the cron job runs
-            os.remove(host_flag_path)
-        else:
-            console.verbose("  skipped: %s\n" % why_not)
+            os.remove(autodiscovery_dir + "/" + hostname)
 
     if activation_required:
         console.verbose("\nRestarting monitoring core with updated configuration...\n")
@@ -778,6 +883,7 @@ def snmp_scan(hostname, ipaddress, on_error = "ignore", for_inv=False):
     positive_found = []
     default_found = []
 
+    scan_functions = []
     for check_type, _unused_check in items:
         if check_type in ignored_checktypes:
             continue
@@ -796,16 +902,18 @@ def snmp_scan(hostname, ipaddress, on_error = "ignore", for_inv=False):
             scan_function = inv_info[basename].get("snmp_scan_function")
         else:
             scan_function = None
+        scan_functions.append((check_type, scan_function))
 
+    scan_results = evaluate_snmp_scan_functions(hostname, ipaddress,
+                        [ entry for entry in scan_functions if entry[1] ])
+
+    for check_type, scan_function in scan_functions:
         if scan_function:
             try:
-                def oid_function(oid, default_value=None):
-                    value = get_single_oid(hostname, ipaddress, oid)
-                    if value == None:
-                        return default_value
-                    else:
-                        return value
-                result = scan_function(oid_function)
+                result, exc_info = scan_results[check_type]
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
                 if result is not None and type(result) not in [ str, bool ]:
                     if on_error == "warn":
                         console.warning("   SNMP scan function of %s returns invalid type %s." %
@@ -836,6 +944,156 @@ def snmp_scan(hostname, ipaddress, on_error = "ignore", for_inv=False):
     found.sort()
     return found
 
+class MKOIDNotFetched(Exception):
+    pass
+
+
+# Evaluates the SNMP scan functions in rounds. In each round the OIDs the
+# scan functions ask for, but which have not been fetched yet, are
+# collected and then fetched at once. A scan function asking for such an
+# OID is stopped and evaluated again in the next round. Returns a
+# dictionary from the check types to pairs of the result of the scan
+# function and the exception info, if it raised an exception.
+def evaluate_snmp_scan_functions(hostname, ipaddress, scan_functions):
+    results = {}
+    pending = scan_functions
+    while pending:
+        missing_oids = []
+        still_pending = []
+        for check_type, scan_function in pending:
+            requested_oids = []
+            def oid_function(oid, default_value=None):
+                cache_oid = oid.startswith(".") and oid or "." + oid
+                clear_other_hosts_oid_cache(hostname)
+                if cache_oid not in g_single_oid_cache:
+                    requested_oids.append(cache_oid)
+                    raise MKOIDNotFetched(cache_oid)
+
+                value = get_single_oid(hostname, ipaddress, oid)
+                if value == None:
+                    return default_value
+                else:
+                    return value
+
+            try:
+                result, exc_info = scan_function(oid_function), None
+            except:
+                result, exc_info = None, sys.exc_info()
+
+            # Scan functions catching exceptions on their own may have
+            # continued without the missing OID
+            if requested_oids:
+                still_pending.append((check_type, scan_function))
+                for oid in requested_oids:
+                    if oid not in missing_oids:
+                        missing_oids.append(oid)
+            else:
+                results[check_type] = result, exc_info
+
+        if missing_oids:
+            prefetch_single_oids(hostname, ipaddress, missing_oids)
+        pending = still_pending
+
+    return results
+
+
+# While the periodic discovery check is running, discover_check_type()
+# reuses the results of the previous discovery check for the check types
+# whose sections did not change (see cmk_base.discovery_fingerprints).
+# Maps the host name to the pair of the stored and the current results.
+g_discovery_fingerprints = None
+
+# Same as get_host_services(), but only the check types with changed
+# sections are discovered again
+def get_host_services_incremental(hostname, use_caches, do_snmp_scan, on_error, ipaddress=None):
+    global g_discovery_fingerprints
+    g_discovery_fingerprints = {}
+    try:
+        services = get_host_services(hostname, use_caches, do_snmp_scan, on_error, ipaddress)
+        save_discovery_fingerprints()
+        return services
+    finally:
+        g_discovery_fingerprints = None
+
+
+def discovery_fingerprints_path(hostname):
+    return cmk.paths.var_dir + "/discovery_fingerprints/" + hostname
+
+
+def discovery_fingerprints_of(hostname):
+    try:
+        return g_discovery_fingerprints[hostname]
+    except KeyError:
+        stored = cmk_base.discovery_fingerprints.load(discovery_fingerprints_path(hostname),
+                                                      discovery_config_digest())
+        g_discovery_fingerprints[hostname] = stored, {}
+        return g_discovery_fingerprints[hostname]
+
+
+# Results are only stored for the check types discovered in this run,
+# so the results of check types not found anymore are dropped.
+def save_discovery_fingerprints():
+    for hostname, (stored, current) in g_discovery_fingerprints.items():
+        if current == stored:
+            continue
+
+        path = discovery_fingerprints_path(hostname)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            cmk_base.discovery_fingerprints.save(path, discovery_config_digest(), current)
+        except Exception, e:
+            if cmk.debug.enabled():
+                raise
+            console.verbose("Cannot save discovery fingerprints of %s: %s\n" % (hostname, e))
+
+
+# Digest of the state of all files the configuration and the check plugins
+# are read from. The stored discovery results are only valid as long as
+# none of these files changes.
+g_discovery_config_digest_cache = {}
+g_global_caches.append("g_discovery_config_digest_cache")
+
+def discovery_config_digest():
+    try:
+        return g_discovery_config_digest_cache["digest"]
+    except KeyError:
+        pass
+
+    filelist = [ cmk.paths.main_config_file, cmk.paths.final_config_file,
+                 cmk.paths.local_config_file, packed_config_path() ]
+    for dirpath, _unused_dirnames, filenames in os.walk(cmk.paths.check_mk_config_dir):
+        filelist += [ dirpath + "/" + f for f in filenames if f.endswith(".mk") ]
+    filelist = [ f for f in filelist if os.path.exists(f) ]
+
+    digest = hashlib.md5(cmk.__version__)
+    digest.update(repr(sorted(check_plugin_files_state(filelist + check_plugin_filelist()).items())))
+    g_discovery_config_digest_cache["digest"] = digest.hexdigest()
+    return g_discovery_config_digest_cache["digest"]
+
+
+# Returns the fingerprint of the sections the discovery of the check type
+# uses. Exceptions are raised like by get_info_for_discovery().
+def discovery_sections_fingerprint(hostname, ipaddress, section_name, use_caches):
+    max_cachefile_age = use_caches and inventory_max_cachefile_age or 0
+    sections = [ (section_name, get_realhost_info(hostname, ipaddress, section_name, max_cachefile_age,
+                                                  ignore_check_interval=True, use_snmpwalk_cache=False)) ]
+
+    if sections[0][1] != None and section_name in check_info:
+        for es in check_info[section_name]["extra_sections"]:
+            try:
+                sections.append((es, get_realhost_info(hostname, ipaddress, es, max_cachefile_age,
+                                                       ignore_check_interval=True, use_snmpwalk_cache=False)))
+            except MKAgentError:
+                sections.append((es, None))
+            except:
+                if cmk.debug.enabled():
+                    raise
+                sections.append((es, None))
+
+    return cmk_base.discovery_fingerprints.fingerprint(sections)
+
+
 def discover_check_type(hostname, ipaddress, check_type, use_caches, on_error, use_snmp=None):
     # Skip this check type if is ignored for that host
     if service_ignored(hostname, check_type, None):
@@ -857,8 +1115,16 @@ def discover_check_type(hostname, ipaddress, check_type, use_caches, on_error, u
 
     section_name = check_type.split('.')[0]    # make e.g. 'lsi' from 'lsi.arrays'
 
+    fingerprint = None
     try:
         info = None # default in case of exception
+        if g_discovery_fingerprints is not None:
+            fingerprint = discovery_sections_fingerprint(hostname, ipaddress, section_name, use_caches)
+            stored, current = discovery_fingerprints_of(hostname)
+            if check_type in stored and stored[check_type][0] == fingerprint:
+                current[check_type] = stored[check_type]
+                return stored[check_type][1]
+
         info = get_info_for_discovery(hostname, ipaddress, section_name, use_caches)
     except MKAgentError, e:
         if str(e) and str(e) != "Cannot get information from agent, processing only piggyback data.":
@@ -937,6 +1203,8 @@ def discover_check_type(hostname, ipaddress, check_type, use_caches, on_error, u
             raise
         return []
 
+    if fingerprint is not None:
+        discovery_fingerprints_of(hostname)[1][check_type] = fingerprint, result
     return result
 
 def discoverable_check_types(what): # snmp, tcp, all
@@ -1228,16 +1496,70 @@ def get_check_preview(hostname, use_caches, do_snmp_scan, on_error):
 # 2. item
 # 3. parameters evaluated!
 def read_autochecks_of(hostname, world="config"):
+    autochecks = []
+    for check_type, item, parameters in read_raw_autochecks_of(hostname, world):
+        autochecks.append((check_type, item, compute_check_parameters(hostname, check_type, item, parameters)))
+    return autochecks
+
+
+def autochecks_file_path(hostname, world="config"):
+    return autochecks_dir(world) + '/' + hostname + '.mk'
+
+
+def autochecks_dir(world="config"):
     if world == "config":
-        basedir = cmk.paths.autochecks_dir
+        return cmk.paths.autochecks_dir
     else:
-        basedir = cmk.paths.var_dir + "/core/autochecks"
-    filepath = basedir + '/' + hostname + '.mk'
+        return cmk.paths.var_dir + "/core/autochecks"
+
+
+# The precompiled caches of the autochecks files (see cmk_base.autochecks)
+def autochecks_cache_path(hostname, world="config"):
+    return autochecks_cache_dir(world) + "/" + hostname
+
+
+def autochecks_cache_dir(world="config"):
+    return cmk.paths.var_dir + "/autochecks_cache/" + world
+
+
+# Autochecks of all hosts read in one pass by preload_autochecks(). The
+# entries are only used as long as the autochecks file is unchanged.
+g_preloaded_autochecks = {}
+g_global_caches.append("g_preloaded_autochecks")
+
+def preload_autochecks(world="config"):
+    g_preloaded_autochecks[world] = cmk_base.autochecks.load_all(
+        autochecks_dir(world), autochecks_cache_dir(world), [ "entries", "names" ])
 
-    if not os.path.exists(filepath):
+
+# Returns the pair of the entries and the referenced names from the
+# cache of the autochecks file. Raises OSError or IOError if the host
+# has no autochecks file.
+def cached_raw_autochecks_of(hostname, world):
+    filepath = autochecks_file_path(hostname, world)
+    preloaded = g_preloaded_autochecks.get(world, {}).get(hostname)
+    if preloaded and preloaded[0] == cmk_base.autochecks.file_key(filepath):
+        return preloaded[1]
+    return cmk_base.autochecks.load(filepath, autochecks_cache_path(hostname, world),
+                                    [ "entries", "names" ])
+
+
+# Same as read_autochecks_of(), but the parameters are returned as
+# found in the autochecks file, not merged with the configured ones
+def read_raw_autochecks_of(hostname, world="config"):
+    filepath = autochecks_file_path(hostname, world)
+
+    try:
+        autochecks_raw, names = cached_raw_autochecks_of(hostname, world)
+    except (IOError, OSError):
         return []
+
     try:
-        autochecks_raw = eval(file(filepath).read())
+        load_check_plugins_of_names(names)
+        if autochecks_raw is None:
+            autochecks_raw = eval(file(filepath).read()) # reports the syntax error
+        elif type(autochecks_raw) == types.CodeType:
+            autochecks_raw = eval(autochecks_raw)
     except SyntaxError,e:
         console.verbose("Syntax error in file %s: %s\n", filepath, e, stream=sys.stderr)
         if cmk.debug.enabled():
@@ -1249,8 +1571,6 @@ def read_autochecks_of(hostname, world="config"):
             raise
         return []
 
-    # Exchange inventorized check parameters with those configured by
-    # the user. Also merge with default levels for modern dictionary based checks.
     autochecks = []
     for entry in autochecks_raw:
         if len(entry) == 4: # old format where hostname is at the first place
@@ -1260,7 +1580,7 @@ def read_autochecks_of(hostname, world="config"):
         # items from existing autocheck files for compatibility. TODO remove this one day
         if type(item) == str:
             item = decode_incoming_string(item)
-        autochecks.append((check_type, item, compute_check_parameters(hostname, check_type, item, parameters)))
+        autochecks.append((check_type, item, parameters))
     return autochecks
 
 
@@ -1271,86 +1591,29 @@ def read_autochecks_of(hostname, world="config"):
 # 2. item
 # 3. parameter string, not yet evaluated!
 def parse_autochecks_file(hostname):
-    def split_python_tuple(line):
-        quote = None
-        bracklev = 0
-        backslash = False
-        for i, c in enumerate(line):
-            if backslash:
-                backslash = False
-                continue
-            elif c == '\\':
-                backslash = True
-            elif c == quote:
-                quote = None # end of quoted string
-            elif c in [ '"', "'" ] and not quote:
-                quote = c # begin of quoted string
-            elif quote:
-                continue
-            elif c in [ '(', '{', '[' ]:
-                bracklev += 1
-            elif c in [ ')', '}', ']' ]:
-                bracklev -= 1
-            elif bracklev > 0:
-                continue
-            elif c == ',':
-                value = line[0:i]
-                rest = line[i+1:]
-                return value.strip(), rest
-
-        return line.strip(), None
-
-    path = "%s/%s.mk" % (cmk.paths.autochecks_dir, hostname)
-    if not os.path.exists(path):
+    path = autochecks_file_path(hostname)
+    try:
+        table = cmk_base.autochecks.load(path, autochecks_cache_path(hostname), [ "table" ])[0]
+    except (IOError, OSError):
         return []
-    lineno = 0
 
-    table = []
-    for line in file(path):
-        lineno += 1
+    if table is None:
+        # The cache only tells that the file is invalid, parse it again for the details
         try:
-            line = line.strip()
-            if not line.startswith("("):
-                continue
-
-            # drop everything after potential '#' (from older versions)
-	    i = line.rfind('#')
-	    if i > 0: # make sure # is not contained in string
-		rest = line[i:]
-		if '"' not in rest and "'" not in rest:
-		    line = line[:i].strip()
-
-            if line.endswith(","):
-                line = line[:-1]
-            line = line[1:-1] # drop brackets
-
-            # First try old format - with hostname
-            parts = []
-            while True:
-                try:
-                    part, line = split_python_tuple(line)
-                    parts.append(part)
-                except:
-                    break
-            if len(parts) == 4:
-                parts = parts[1:] # drop hostname, legacy format with host in first column
-            elif len(parts) != 3:
-                raise Exception("Invalid number of parts: %d (%r)" % (len(parts), parts))
-
-            checktypestring, itemstring, paramstring = parts
-
-            item = eval(itemstring)
-            # With Check_MK 1.2.7i3 items are now defined to be unicode strings. Convert
-            # items from existing autocheck files for compatibility. TODO remove this one day
-            if type(item) == str:
-                item = decode_incoming_string(item)
-
-            table.append((eval(checktypestring), item, paramstring))
-        except:
+            cmk_base.autochecks.parse_table(file(path).read())
+        except cmk_base.autochecks.AutochecksLineError, e:
             if cmk.debug.enabled():
                 raise
-            raise Exception("Invalid line %d in autochecks file %s" % (lineno, path))
-    return table
+            raise Exception("Invalid line %d in autochecks file %s" % (e.lineno, path))
+
+    autochecks = []
+    for check_type, item, paramstring in table:
+        # With Check_MK 1.2.7i3 items are now defined to be unicode strings. Convert
+        # items from existing autocheck files for compatibility. TODO remove this one day
+        if type(item) == str:
+            item = decode_incoming_string(item)
+        autochecks.append((check_type, item, paramstring))
+    return autochecks
 
 
 def has_autochecks(hostname):
@@ -1370,11 +1633,15 @@ def save_autochecks_file(hostname, items):
     if not os.path.exists(cmk.paths.autochecks_dir):
         os.makedirs(cmk.paths.autochecks_dir)
     filepath = "%s/%s.mk" % (cmk.paths.autochecks_dir, hostname)
-    out = file(filepath, "w")
-    out.write("[\n")
+    content = [ "[\n" ]
     for check_type, item, paramstring in items:
-        out.write("  (%r, %r, %s),\n" % (check_type, item, paramstring))
-    out.write("]\n")
+        content.append("  (%r, %r, %s),\n" % (check_type, item, paramstring))
+    content.append("]\n")
+
+    # Several discovery processes may write the file at the same time
+    # (see discover_hosts()). The lock is released by save_file().
+    store.aquire_lock(filepath)
+    store.save_file(filepath, "".join(content))
 
 
 def set_autochecks_of(hostname, new_items):
@@ -30,6 +30,8 @@ import cmk.tty as tty
 import cmk.paths
 
 import cmk_base.console as console
+import cmk_base.parallel
+import cmk_base.plugin_bundle
 
 #   .--Create config-------------------------------------------------------.
 #   |      ____                _                          __ _             |
@@ -97,8 +99,11 @@ def create_nagios_config(outfile = sys.stdout, hostnames = None):
     if hostnames == None:
         hostnames = all_active_hosts()
 
-    for hostname in hostnames:
-        create_nagios_config_host(outfile, hostname)
+    if config_generation_processes > 1 and len(hostnames) > 1:
+        create_nagios_config_hosts_parallel(outfile, hostnames)
+    else:
+        for hostname in hostnames:
+            create_nagios_config_host(outfile, hostname)
 
     create_nagios_config_contacts(outfile, hostnames)
     create_nagios_config_hostgroups(outfile)
@@ -122,6 +127,61 @@ def create_nagios_config_host(outfile, hostname):
     create_nagios_servicedefs(outfile, hostname, host_attrs)
 
 
+# Creates the host and service definitions in worker processes, each of
+# them processing a contiguous part of the hosts. The definitions and the
+# objects to be defined later are merged in the order of the hosts, which
+# results in the same configuration as creating it in one process.
+def create_nagios_config_hosts_parallel(outfile, hostnames):
+    for result in cmk_base.parallel.map_shards(create_nagios_config_hosts,
+                                               hostnames, config_generation_processes):
+        # Host check commands are numbered. Continue the numbering of the
+        # previous workers.
+        offset = len(hostcheck_commands_to_define)
+        def renumber(match):
+            return "check-mk-host-custom-%d" % (int(match.group(1)) + offset)
+
+        config = result["config"]
+        if offset and result["hostcheck_commands"]:
+            config = regex(r"\bcheck-mk-host-custom-([0-9]+)\b").sub(renumber, config)
+            result["hostcheck_commands"] = [
+                (regex("^check-mk-host-custom-([0-9]+)$").sub(renumber, command), command_line)
+                for command, command_line in result["hostcheck_commands"] ]
+
+        outfile.write(config)
+        hostcheck_commands_to_define.extend(result["hostcheck_commands"])
+        hostgroups_to_define.update(result["hostgroups"])
+        servicegroups_to_define.update(result["servicegroups"])
+        contactgroups_to_define.update(result["contactgroups"])
+        checknames_to_define.update(result["checknames"])
+        active_checks_to_define.update(result["active_checks"])
+        custom_commands_to_define.update(result["custom_commands"])
+        for text in result["warnings"]:
+            configuration_warning(text)
+        merge_ip_lookup_cache(result["ip_lookup_cache"])
+
+
+# Worker of create_nagios_config_hosts_parallel()
+def create_nagios_config_hosts(hostnames):
+    num_warnings = len(g_configuration_warnings)
+    outfile = StringIO()
+    for hostname in hostnames:
+        create_nagios_config_host(outfile, hostname)
+    save_persistent_caches()
+
+    return {
+        "config"             : outfile.getvalue(),
+        "hostcheck_commands" : hostcheck_commands_to_define,
+        "hostgroups"         : hostgroups_to_define,
+        "servicegroups"      : servicegroups_to_define,
+        "contactgroups"      : contactgroups_to_define,
+        "checknames"         : checknames_to_define,
+        "active_checks"      : active_checks_to_define,
+        "custom_commands"    : custom_commands_to_define,
+        "warnings"           : g_configuration_warnings[num_warnings:],
+        "ip_lookup_cache"    : g_ip_lookup_cache,
+    }
+
+
 def create_nagios_hostdefs(outfile, hostname, attrs):
     is_clust = is_cluster(hostname)
 
@@ -743,7 +803,7 @@ def create_nagios_config_commands(outfile):
         outfile.write("\n# ------------------------------------------------------------\n")
         outfile.write("# Dummy check commands and active check commands\n")
         outfile.write("# ------------------------------------------------------------\n\n")
-        for checkname in checknames_to_define:
+        for checkname in sorted(checknames_to_define):
             outfile.write("""define command {
   command_name\t\t\tcheck_mk-%s
   command_line\t\t\t%s
@@ -752,7 +812,7 @@ def create_nagios_config_commands(outfile):
 """ % ( checkname, dummy_check_commandline ))
 
     # active_checks
-    for acttype in active_checks_to_define:
+    for acttype in sorted(active_checks_to_define):
         act_info = active_check_info[acttype]
         outfile.write("""define command {
   command_name\t\t\tcheck_mk_active-%s
@@ -762,7 +822,7 @@ def create_nagios_config_commands(outfile):
 """ % ( acttype, act_info["command_line"]))
 
     # custom_checks
-    for command_name in custom_commands_to_define:
+    for command_name in sorted(custom_commands_to_define):
         outfile.write("""define command {
   command_name\t\t\t%s
   command_line\t\t\t$ARG1$
@@ -920,7 +980,21 @@ def find_check_plugins(checktype):
 def precompile_hostchecks():
     if not os.path.exists(cmk.paths.precompiled_hostchecks_dir):
         os.makedirs(cmk.paths.precompiled_hostchecks_dir)
-    for host in all_active_hosts():
+    if precompiled_plugin_bundle:
+        plugin_bundle_path() # compile the bundle before forking the workers
+
+    for ip_lookup_cache in cmk_base.parallel.map_shards(precompile_hostchecks_of,
+                                     all_active_hosts(), config_generation_processes):
+        merge_ip_lookup_cache(ip_lookup_cache)
+
+    if precompiled_plugin_bundle:
+        remove_outdated_plugin_bundles()
+
+
+# Precompiles the host checks of the given hosts. Returns the IP lookup
+# cache to make addresses resolved by worker processes available.
+def precompile_hostchecks_of(hostnames):
+    for host in hostnames:
         try:
             precompile_hostcheck(host)
         except Exception, e:
@@ -929,6 +1003,62 @@ def precompile_hostchecks():
             sys.stderr.write("Error precompiling checks for host %s: %s\n" % (host, e))
             sys.exit(5)
 
+    if config_generation_processes > 1:
+        save_persistent_caches()
+    return g_ip_lookup_cache
+
+
+def plugin_bundle_dir():
+    return cmk.paths.var_dir + "/plugin_bundles"
+
+
+# Returns the path to the bundle of the base modules and check plugins
+# used by the precompiled host checks. The bundle is compiled when the
+# plugins have changed.
+g_plugin_bundle_cache = {}
+def plugin_bundle_path():
+    try:
+        return g_plugin_bundle_cache["path"]
+    except KeyError:
+        pass
+
+    filenames = [ cmk.paths.modules_dir + "/" + f
+                  for f in [ "check_mk_base.py", "snmp.py", "inline_snmp.py" ]
+                  if os.path.exists(cmk.paths.modules_dir + "/" + f) ]
+    filenames += [ f for f in plugin_pathnames_in_directory(cmk.paths.local_checks_dir)
+                              + plugin_pathnames_in_directory(cmk.paths.checks_dir)
+                   if not f.endswith("~") ]
+
+    path = plugin_bundle_dir() + "/" + cmk_base.plugin_bundle.bundle_id(filenames)
+    if not os.path.exists(path):
+        if not os.path.exists(plugin_bundle_dir()):
+            os.makedirs(plugin_bundle_dir())
+        console.verbose("Compiling plugin bundle %s\n", path, stream=sys.stderr)
+        cmk_base.plugin_bundle.build(path, filenames)
+
+    g_plugin_bundle_cache["path"] = path
+    return path
+
+
+def remove_outdated_plugin_bundles():
+    current = os.path.basename(plugin_bundle_path())
+    for f in os.listdir(plugin_bundle_dir()):
+        if f != current:
+            try:
+                os.remove(plugin_bundle_dir() + "/" + f)
+            except OSError:
+                pass
+
+
+# Adds the code of the python files to a precompiled host check. The code
+# is either inlined or loaded from the plugin bundle.
+def write_python_files(output, filenames, bundle):
+    if bundle:
+        output.write("cmk_base.plugin_bundle.execute(%r, %r, globals())\n" % (bundle, filenames))
+    else:
+        for filename in filenames:
+            output.write(stripped_python_file(filename))
+
 
 # read python file and strip comments
 g_stripped_file_cache = {}
@@ -978,7 +1108,13 @@ if os.path.islink(%(dst)r):
 
 """ % { "src" : source_filename, "dst" : compiled_filename })
 
-    output.write(stripped_python_file(cmk.paths.modules_dir + "/check_mk_base.py"))
+    if precompiled_plugin_bundle:
+        bundle = plugin_bundle_path()
+        output.write("import cmk_base.plugin_bundle\n")
+    else:
+        bundle = None
+
+    write_python_files(output, [ cmk.paths.modules_dir + "/check_mk_base.py" ], bundle)
 
     # Register default Check_MK signal handler
     output.write("register_sigint_handler()\n")
@@ -1014,6 +1150,7 @@ no_discovery_possible = None
                  'simulation_mode', 'agent_simulator', 'aggregate_check_mk',
                  'check_mk_perfdata_with_times',
                  'use_inline_snmp', 'record_inline_snmp_stats',
+                 'builtin_snmp_max_repetitions',
                  ]:
         output.write("%s = %r\n" % (var, globals()[var]))
 
@@ -1055,10 +1192,10 @@ no_discovery_possible = None
     output.write("def check_period_of(hostname, service):\n    return precompiled_service_timeperiods.get(service)\n\n")
 
     if need_snmp_module:
-        output.write(stripped_python_file(cmk.paths.modules_dir + "/snmp.py"))
+        write_python_files(output, [ cmk.paths.modules_dir + "/snmp.py" ], bundle)
 
         if is_inline_snmp_host(hostname):
-            output.write(stripped_python_file(cmk.paths.modules_dir + "/inline_snmp.py"))
+            write_python_files(output, [ cmk.paths.modules_dir + "/inline_snmp.py" ], bundle)
             output.write("\ndef oid_range_limits_of(hostname):\n    return %r\n" % oid_range_limits_of(hostname))
         else:
             output.write("has_inline_snmp = False\n")
@@ -1102,10 +1239,14 @@ no_discovery_possible = None
                  "snmp_info = {}\n" +
                  "snmp_scan_functions = {}\n")
 
+    if bundle:
+        write_python_files(output, filenames, bundle)
+
     for filename in filenames:
-        output.write("# %s\n" % filename)
-        output.write(stripped_python_file(filename))
-        output.write("\n\n")
+        if not bundle:
+            output.write("# %s\n" % filename)
+            output.write(stripped_python_file(filename))
+            output.write("\n\n")
         console.verbose(" %s%s%s", tty.green, filename.split('/')[-1], tty.normal, stream=sys.stderr)
 
     # Make sure all checks are converted to the new API
@@ -1134,7 +1275,8 @@ no_discovery_possible = None
     output.write("def is_usewalk_host(hostname):\n   return % r\n\n" % is_usewalk_host(hostname))
     output.write("def snmpv3_contexts_of_host(hostname):\n    return % r\n\n" % snmpv3_contexts_of_host(hostname))
     output.write("def is_inline_snmp_host(hostname):\n   return        % r\n\n" % is_inline_snmp_host(hostname))
-    if is_inline_snmp_host(hostname):
+    output.write("def is_builtin_snmp_host(hostname):\n   return       % r\n\n" % is_builtin_snmp_host(hostname))
+    if is_inline_snmp_host(hostname) or is_builtin_snmp_host(hostname):
         output.write("def is_snmpv2c_host(hostname):\n   return     % r\n\n" % is_snmpv2c_host(hostname))
         output.write("def is_bulkwalk_host(hostname):\n   return    % r\n\n" % is_bulkwalk_host(hostname))
         output.write("def snmp_timing_of(hostname):\n   return      % r\n\n" % snmp_timing_of(hostname))
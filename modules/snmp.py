@@ -31,6 +31,12 @@ import subprocess
 import cmk.tty as tty
 
 import cmk_base.agent_simulator
+import cmk_base.cache_file
+import cmk_base.snmp_engine
+import cmk_base.snmp_poller
+import cmk_base.snmp_subtrees
+import cmk_base.snmp_table
+import cmk_base.stored_walk
 import cmk_base.console as console
 
 OID_END              =  0  # Suffix-part of OID that was not specified
@@ -105,10 +111,6 @@ def oid_to_intlist(oid):
 def cmp_oids(o1, o2):
     return cmp(oid_to_intlist(o1), oid_to_intlist(o2))
 
-def cmp_oid_pairs(pair1, pair2):
-    return cmp(oid_to_intlist(pair1[0].lstrip('.')),
-               oid_to_intlist(pair2[0].lstrip('.')))
-
 def snmpv3_contexts_of_host(hostname):
     return host_extra_conf(hostname, snmpv3_contexts)
 
@@ -140,6 +142,8 @@ def get_snmp_table(hostname, ip, check_type, oid_info, use_snmpwalk_cache):
     for suboid in suboids:
         colno = -1
         columns = []
+        prefetched = prefetch_snmpwalks(hostname, ip, check_type, oid, suboid, targetcolumns,
+                                        use_snmpwalk_cache)
         # Detect missing (empty columns)
         max_len = 0
         max_len_col = -1
@@ -164,7 +168,8 @@ def get_snmp_table(hostname, ip, check_type, oid_info, use_snmpwalk_cache):
                 index_format = column
                 continue
 
-            rowinfo = get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_cache)
+            rowinfo = get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_cache,
+                                   prefetched)
 
             columns.append((fetchoid, rowinfo, value_encoding))
             number_of_rows = len(rowinfo)
@@ -203,19 +208,19 @@ def get_snmp_table(hostname, ip, check_type, oid_info, use_snmpwalk_cache):
         # omit entries in some sub OIDs. This happens e.g. for CISCO 3650
         # in the interfaces MIB with 64 bit counters. So we need to look at
         # the OIDs and watch out for gaps we need to fill with dummy values.
-        new_columns = sanitize_snmp_table_columns(columns)
+        new_columns = cmk_base.snmp_table.sanitize_columns(columns)
 
         # From all SNMP data sources (stored walk, classic SNMP, inline SNMP) we
         # get normal python strings. But for Check_MK we need unicode strings now.
         # Convert them by using the standard Check_MK approach for incoming data
         sanitized_columns = sanitize_snmp_encoding(new_columns)
 
-        info += construct_snmp_table_of_rows(sanitized_columns)
+        info += cmk_base.snmp_table.construct_rows(sanitized_columns)
 
     return info
 
 
-def get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_cache):
+def get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_cache, prefetched=None):
     is_cachable = is_snmpwalk_cachable(column)
     rowinfo = None
     if is_cachable and use_snmpwalk_cache:
@@ -225,6 +230,8 @@ def get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_c
     if rowinfo == None:
         if opt_use_snmp_walk or is_usewalk_host(hostname):
             rowinfo = get_stored_snmpwalk(hostname, fetchoid)
+        elif prefetched and fetchoid in prefetched:
+            rowinfo = prefetched[fetchoid]
         else:
             rowinfo = perform_snmpwalk(hostname, ip, check_type, oid, fetchoid)
 
@@ -237,35 +244,85 @@ def get_snmpwalk(hostname, ip, check_type, oid, fetchoid, column, use_snmpwalk_c
 def perform_snmpwalk(hostname, ip, check_type, base_oid, fetchoid):
     added_oids = set([])
     rowinfo = []
-    if is_snmpv3_host(hostname):
-        snmp_contexts = snmpv3_contexts_of(hostname, check_type)
-    else:
-        snmp_contexts = [None]
+    for context_name in snmp_contexts_of_check(hostname, check_type):
+        rows = walk_snmp_subtrees(hostname, ip, check_type, base_oid, [ fetchoid ], context_name)[fetchoid]
+        add_walked_rows(rowinfo, added_oids, rows)
+
+    return rowinfo
 
-    for context_name in snmp_contexts:
+
+# Returns a dictionary from the given OIDs to their walked rows. Each
+# subtree is walked only once per check cycle of a host: OIDs contained
+# in an already walked subtree or in a subtree planned by
+# plan_snmp_walks() are taken from the walk of that subtree.
+def walk_snmp_subtrees(hostname, ip, check_type, base_oid, fetchoids, context_name):
+    walks = g_snmp_walks.setdefault((hostname, ip, context_name), {})
+    planned = g_snmp_walk_plans.get((hostname, context_name), [])
+
+    walked_oids = {}
+    to_walk = []
+    for fetchoid in fetchoids:
+        walked_oid = cmk_base.snmp_subtrees.find_covering_oid(fetchoid, walks) \
+                  or cmk_base.snmp_subtrees.find_covering_oid(fetchoid, planned) \
+                  or cmk_base.snmp_subtrees.normalize_oid(fetchoid)
+        walked_oids[fetchoid] = walked_oid
+        if walked_oid not in walks:
+            to_walk.append(walked_oid)
+
+    if to_walk:
+        to_walk = cmk_base.snmp_subtrees.covering_oids(to_walk)
+        for oid, rows in walk_snmp_oids(hostname, ip, check_type, base_oid,
+                                        to_walk, context_name).items():
+            walks[oid] = cmk_base.snmp_subtrees.Subtree(oid, rows)
+
+    rowinfos = {}
+    for fetchoid, walked_oid in walked_oids.items():
+        if walked_oid not in walks:
+            walked_oid = cmk_base.snmp_subtrees.find_covering_oid(fetchoid, walks)
+        oid = cmk_base.snmp_subtrees.normalize_oid(fetchoid)
+        if walked_oid != oid:
+            console.vverbose("Using walk of %s for %s\n" % (walked_oid, fetchoid))
+        rowinfos[fetchoid] = walks[walked_oid].rows_of(oid)
+    return rowinfos
+
+
+def walk_snmp_oids(hostname, ip, check_type, base_oid, oids, context_name):
+    if is_builtin_snmp_host(hostname):
+        return builtin_snmpwalks(hostname, ip, oids, context_name)
+
+    rowinfos = {}
+    for oid in oids:
         if is_inline_snmp_host(hostname):
-            rows = inline_snmpwalk_on_suboid(hostname, check_type, fetchoid, base_oid,
-                                                                  context_name=context_name,
-                                                                  ipaddress=ip)
+            rowinfos[oid] = inline_snmpwalk_on_suboid(hostname, check_type, oid, base_oid,
+                                                      context_name=context_name,
+                                                      ipaddress=ip)
         else:
-            rows = snmpwalk_on_suboid(hostname, ip, fetchoid, context_name=context_name)
-
-        # I've seen a broken device (Mikrotik Router), that broke after an
-        # update to RouterOS v6.22. It would return 9 time the same OID when
-        # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
-        # by removing any duplicate OID information
-        if len(rows) > 1 and rows[0][0] == rows[1][0]:
-            console.vverbose("Detected broken SNMP agent. Ignoring duplicate OID %s.\n" % rows[0][0])
-            rows = rows[:1]
-
-        for row_oid, val in rows:
-            if row_oid in added_oids:
-                console.vverbose("Duplicate OID found: %s (%s)\n" % (row_oid, val))
-            else:
-                rowinfo.append((row_oid, val))
-                added_oids.add(row_oid)
+            rowinfos[oid] = snmpwalk_on_suboid(hostname, ip, oid, context_name=context_name)
+    return rowinfos
 
-    return rowinfo
+
+def snmp_contexts_of_check(hostname, check_type):
+    if is_snmpv3_host(hostname):
+        return snmpv3_contexts_of(hostname, check_type)
+    else:
+        return [None]
+
+
+def add_walked_rows(rowinfo, added_oids, rows):
+    # I've seen a broken device (Mikrotik Router), that broke after an
+    # update to RouterOS v6.22. It would return 9 time the same OID when
+    # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
+    # by removing any duplicate OID information
+    if len(rows) > 1 and rows[0][0] == rows[1][0]:
+        console.vverbose("Detected broken SNMP agent. Ignoring duplicate OID %s.\n" % rows[0][0])
+        rows = rows[:1]
+
+    for row_oid, val in rows:
+        if row_oid in added_oids:
+            console.vverbose("Duplicate OID found: %s (%s)\n" % (row_oid, val))
+        else:
+            rowinfo.append((row_oid, val))
+            added_oids.add(row_oid)
 
 
 def compute_fetch_oid(oid, suboid, column):
@@ -295,75 +352,6 @@ def sanitize_snmp_encoding(columns):
     return columns
 
 
-def sanitize_snmp_table_columns(columns):
-    # First compute the complete list of end-oids appearing in the output
-    # by looping all results and putting the endoids to a flat list
-    endoids = []
-    for fetchoid, column, value_encoding in columns:
-        for o, value in column:
-            endoid = extract_end_oid(fetchoid, o)
-            if endoid not in endoids:
-                endoids.append(endoid)
-
-    # The list needs to be sorted to prevent problems when the first
-    # column has missing values in the middle of the tree.
-    if not are_ascending_oids(endoids):
-        endoids.sort(cmp = cmp_oids)
-        need_sort = True
-    else:
-        need_sort = False
-
-    # Now fill gaps in columns where some endois are missing
-    new_columns = []
-    for fetchoid, column, value_encoding in columns:
-        # It might happen that end OIDs are not ordered. Fix the OID sorting to make
-        # it comparable to the already sorted endoids list. Otherwise we would get
-        # some mixups when filling gaps
-        if need_sort:
-            column.sort(cmp = cmp_oid_pairs)
-
-        i = 0
-        new_column = []
-        # Loop all lines to fill holes in the middle of the list. All
-        # columns check the following lines for the correct endoid. If
-        # an endoid differs empty values are added until the hole is filled
-        for o, value in column:
-            eo = extract_end_oid(fetchoid, o)
-            if len(column) != len(endoids):
-                while i < len(endoids) and endoids[i] != eo:
-                    new_column.append("") # (beginoid + '.' +endoids[i], "" ) )
-                    i += 1
-            new_column.append(value)
-            i += 1
-
-        # At the end check if trailing OIDs are missing
-        while i < len(endoids):
-            new_column.append("") # (beginoid + '.' +endoids[i], "") )
-            i += 1
-        new_columns.append((new_column, value_encoding))
-
-    return new_columns
-
-
-def are_ascending_oids(oid_list):
-    for a in range(len(oid_list) - 1):
-        if cmp_oids(oid_list[a], oid_list[a + 1]) > 0: # == 0 should never happen
-            return False
-    return True
-
-
-def construct_snmp_table_of_rows(columns):
-    if not columns:
-        return []
-
-    # Now construct table by swapping X and Y.
-    new_info = []
-    for index in range(len(columns[0])):
-        row = [ c[index] for c in columns ]
-        new_info.append(row)
-    return new_info
-
-
 # SNMP-Helper functions used in various checks
 
 def check_snmp_misc(item, params, info):
@@ -422,9 +410,12 @@ def get_cached_snmpwalk(hostname, fetchoid):
 
     try:
         console.vverbose("  Loading %s from walk cache %s\n" % (fetchoid, path))
-        return eval(file(path).read())
+        return cmk_base.cache_file.load(path, "rowinfo")
     except IOError:
         return None # don't print error when not cached yet
+    except cmk_base.cache_file.MKCacheFormatError, e:
+        console.verbose("Ignoring cached SNMP walk %s: %s\n" % (path, e))
+        return None
     except:
         if cmk.debug.enabled():
             raise
@@ -437,7 +428,7 @@ def save_snmpwalk_cache(hostname, fetchoid, rowinfo):
     if not os.path.exists(base_dir):
         os.makedirs(base_dir)
     console.vverbose("  Caching walk of %s\n" % fetchoid)
-    file(base_dir + fetchoid, "w").write("%r\n" % rowinfo)
+    cmk_base.cache_file.save(base_dir + fetchoid, [("rowinfo", rowinfo)])
 
 
 g_walk_cache = {}
@@ -456,92 +447,39 @@ def get_stored_snmpwalk(hostname, oid):
 
     console.vverbose("  Loading %s from %s\n" % (oid, path))
 
-    rowinfo = []
-
-    # New implementation: use binary search
-    def to_bin_string(oid):
-        try:
-            return tuple(map(int, oid.strip(".").split(".")))
-        except:
-            raise MKGeneralException("Invalid OID %s" % oid)
-
-    def compare_oids(a, b):
-        aa = to_bin_string(a)
-        bb = to_bin_string(b)
-        if len(aa) <= len(bb) and bb[:len(aa)] == aa:
-            result = 0
-        else:
-            result = cmp(aa, bb)
-        return result
-
     if hostname in g_walk_cache:
-        lines = g_walk_cache[hostname]
+        walk = g_walk_cache[hostname]
     else:
+        index_path = cmk.paths.var_dir + "/snmpwalk_index/" + hostname
         try:
-            lines = file(path).readlines()
+            walk = cmk_base.stored_walk.StoredWalk(path, index_path)
         except IOError:
             raise MKSNMPError("No snmpwalk file %s" % path)
-        g_walk_cache[hostname] = lines
-
-    begin = 0
-    end = len(lines)
-    hit = None
-    while end - begin > 0:
-        current = (begin + end) / 2
-        parts = lines[current].split(None, 1)
-        comp = parts[0]
-        hit = compare_oids(oid_prefix, comp)
-        if hit == 0:
-            break
-        elif hit == 1: # we are too low
-            begin = current + 1
-        else:
-            end = current
-
-    if hit != 0:
-        return [] # not found
-
+        g_walk_cache[hostname] = walk
 
-    def collect_until(index, direction):
-        rows = []
-        # Handle case, where we run after the end of the lines list
-        if index >= len(lines):
-            if direction > 0:
-                return []
-            else:
-                index -= 1
-        while True:
-            line = lines[index]
-            parts = line.split(None, 1)
-            o = parts[0]
-            if o.startswith('.'):
-                o = o[1:]
-            if o == oid or o.startswith(oid_prefix + "."):
-                if len(parts) > 1:
-                    try:
-                        value = cmk_base.agent_simulator.process(parts[1])
-                    except:
-                        value = parts[1] # agent simulator missing in precompiled mode
-                else:
-                    value = ""
-                # Fix for missing starting oids
-                rows.append(('.'+o, strip_snmp_value(value)))
-                index += direction
-                if index < 0 or index >= len(lines):
-                    break
-            else:
-                break
-        return rows
+    try:
+        if dot_star:
+            row = walk.first_row_below(oid_prefix)
+            lines = row and [ row ] or []
+        else:
+            lines = walk.rows(oid_prefix)
+    except ValueError:
+        raise MKGeneralException("Invalid OID %s" % oid_prefix)
 
+    rowinfo = []
+    for o, value in lines:
+        if o.startswith('.'):
+            o = o[1:]
+        if value:
+            try:
+                value = cmk_base.agent_simulator.process(value)
+            except:
+                pass # agent simulator missing in precompiled mode
+        # Fix for missing starting oids
+        rowinfo.append(('.'+o, strip_snmp_value(value)))
 
-    rowinfo = collect_until(current, -1)
-    rowinfo.reverse()
-    rowinfo += collect_until(current + 1, 1)
+    return rowinfo
 
-    if dot_star:
-        return [ rowinfo[0] ]
-    else:
-        return rowinfo
 
 def snmp_decode_string(text):
     encoding = get_snmp_character_encoding(g_hostname)
@@ -622,3 +560,243 @@ def snmpwalk_on_suboid(hostname, ip, oid, hex_plain = False, context_name = None
         console.verbose(tty.red + tty.bold + "ERROR: " + tty.normal + "SNMP error: %s\n" % error.strip())
         raise MKSNMPError("SNMP Error on %s: %s (Exit-Code: %d)" % (ip, error.strip(), exitstatus))
     return rowinfo
+
+
+#.
+#   .--Built-in SNMP-------------------------------------------------------.
+#   |     ____        _ _ _        _         ____  _   _ __  __ ____       |
+#   |    | __ ) _   _(_) | |_     (_)_ __   / ___|| \ | |  \/  |  _ \      |
+#   |    |  _ \| | | | | | __|____| | '_ \  \___ \|  \| | |\/| | |_) |     |
+#   |    | |_) | |_| | | | ||_____| | | | |  ___) | |\  | |  | |  __/      |
+#   |    |____/ \__,_|_|_|\__|    |_|_| |_| |____/|_| \_|_|  |_|_|         |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | Classic SNMP hosts can be queried with the SNMP engine of Check_MK   |
+#   | instead of the net-snmp command line tools. All columns of a table   |
+#   | are then walked at once.                                             |
+#   '----------------------------------------------------------------------'
+
+g_builtin_snmp_sessions = {}
+
+def builtin_snmp_session(hostname, ip, context_name):
+    key = hostname, ip, context_name
+    if key in g_builtin_snmp_sessions:
+        return g_builtin_snmp_sessions[key]
+
+    # Only keep the sessions of one host open at the same time
+    if [ k for k in g_builtin_snmp_sessions if k[0] != hostname ]:
+        close_builtin_snmp_sessions()
+
+    session = make_builtin_snmp_session(hostname, ip, context_name)
+    g_builtin_snmp_sessions[key] = session
+    return session
+
+
+def make_builtin_snmp_session(hostname, ip, context_name):
+    timing = snmp_timing_of(hostname)
+    return cmk_base.snmp_engine.Session(ip, snmp_credentials_of(hostname),
+                                version         = is_snmpv2c_host(hostname) and 2 or 1,
+                                port            = snmp_port_of(hostname) or 161,
+                                context_name    = context_name,
+                                timeout         = timing.get("timeout", 1),
+                                retries         = timing.get("retries", 5),
+                                use_bulk        = is_bulkwalk_host(hostname),
+                                max_repetitions = builtin_snmp_max_repetitions)
+
+
+def close_builtin_snmp_sessions():
+    for session in g_builtin_snmp_sessions.values():
+        session.close()
+    g_builtin_snmp_sessions.clear()
+
+
+# Walks all given OIDs at once. Returns a dictionary from the OIDs to
+# the rows found, formatted like by snmpwalk_on_suboid().
+def builtin_snmpwalks(hostname, ip, fetchoids, context_name, hex_plain=False):
+    # The tables may already have been walked together with the tables
+    # of other hosts (see fetch_snmp_tables())
+    walks = g_prefetched_snmp_walks.get((hostname, context_name))
+    if isinstance(walks, MKSNMPError):
+        raise walks
+
+    elif walks is None or [ fetchoid for fetchoid in fetchoids if fetchoid not in walks ]:
+        session = builtin_snmp_session(hostname, ip, context_name)
+        console.vverbose("Walking %s (built-in SNMP)\n" % ", ".join(fetchoids))
+        try:
+            walks = session.walk(fetchoids)
+        except cmk_base.snmp_engine.SNMPError, e:
+            console.verbose(tty.red + tty.bold + "ERROR: " + tty.normal + "SNMP error: %s\n" % e)
+            raise MKSNMPError("SNMP Error on %s: %s" % (ip, e))
+
+    rowinfos = {}
+    for fetchoid in fetchoids:
+        rows = walks[fetchoid]
+        rowinfos[fetchoid] = [ (oid, strip_snmp_value(cmk_base.snmp_engine.format_value(tag, value),
+                                                      hex_plain))
+                               for oid, tag, value in rows ]
+    return rowinfos
+
+
+def perform_builtin_snmpwalks(hostname, ip, check_type, oid, fetchoids):
+    rowinfos = dict([ (fetchoid, []) for fetchoid in fetchoids ])
+    added_oids = dict([ (fetchoid, set([])) for fetchoid in fetchoids ])
+    for context_name in snmp_contexts_of_check(hostname, check_type):
+        walks = walk_snmp_subtrees(hostname, ip, check_type, oid, fetchoids, context_name)
+        for fetchoid in fetchoids:
+            add_walked_rows(rowinfos[fetchoid], added_oids[fetchoid], walks[fetchoid])
+    return rowinfos
+
+
+# Fetches the columns of a table which are not cached in one go.
+# Returns a dictionary from the fetch OIDs to the walked rows.
+def prefetch_snmpwalks(hostname, ip, check_type, oid, suboid, targetcolumns, use_snmpwalk_cache):
+    if not is_builtin_snmp_host(hostname) or opt_use_snmp_walk or is_usewalk_host(hostname):
+        return {}
+
+    fetchoids = walked_fetchoids(oid, suboid, targetcolumns, use_snmpwalk_cache)
+    if len(fetchoids) < 2:
+        return {}
+
+    return perform_builtin_snmpwalks(hostname, ip, check_type, oid, fetchoids)
+
+
+# The index columns are not walked but computed and the cached
+# columns are read from the walk cache, if possible
+def walked_fetchoids(oid, suboid, targetcolumns, use_snmpwalk_cache):
+    fetchoids = []
+    for column in targetcolumns:
+        if column in [ OID_END, OID_STRING, OID_BIN, OID_END_BIN, OID_END_OCTET_STRING ] \
+           or (use_snmpwalk_cache and is_snmpwalk_cachable(column)):
+            continue
+
+        fetchoid = compute_fetch_oid(oid, suboid, column)[0]
+        if fetchoid not in fetchoids:
+            fetchoids.append(fetchoid)
+    return fetchoids
+
+
+# Walks the SNMP tables needed by the checks of many hosts at once. The
+# requests to all hosts are in flight at the same time (see
+# cmk_base.snmp_poller), so waiting for slow devices does not add up.
+# The walks are kept in g_prefetched_snmp_walks and are used by
+# builtin_snmpwalks() later instead of contacting the host again.
+def fetch_snmp_tables(hosts, only_check_types=None):
+    jobs = []
+    ipaddresses = {}
+    for hostname, ipaddress in hosts:
+        ipaddresses[hostname] = ipaddress
+        check_types = [ check_type for check_type, _unused_item
+                        in get_check_table(hostname, remove_duplicates=True)
+                        if only_check_types is None or check_type in only_check_types ]
+        for context_name, fetchoids in snmp_fetchoids_of_checks(hostname, check_types).items():
+            jobs.append(((hostname, context_name),
+                         make_builtin_snmp_session(hostname, ipaddress, context_name), fetchoids))
+
+    if not jobs:
+        return
+
+    console.verbose("Walking SNMP tables of %d hosts (%d in parallel)...\n" %
+                    (len(hosts), max_concurrent_snmp_hosts))
+    walks, errors = cmk_base.snmp_poller.walk_hosts(jobs, max_concurrent_snmp_hosts)
+    g_prefetched_snmp_walks.update(walks)
+    for (hostname, context_name), message in errors.items():
+        g_prefetched_snmp_walks[(hostname, context_name)] = \
+            MKSNMPError("SNMP Error on %s: %s" % (ipaddresses[hostname], message))
+
+
+# Plans the walks of the SNMP checks of a host before the first one is
+# done. Subtrees contained in the walk of another subtree are taken from
+# that walk later (see walk_snmp_subtrees()).
+def plan_snmp_walks(hostname, check_types):
+    for context_name, fetchoids in snmp_fetchoids_of_checks(hostname, check_types).items():
+        g_snmp_walk_plans[(hostname, context_name)] = fetchoids
+
+
+# Returns the OIDs to walk for the given SNMP checks of a host, grouped by
+# the SNMPv3 context. Tables read from cache files are skipped. OIDs in
+# the subtree of another OID to walk are left out.
+def snmp_fetchoids_of_checks(hostname, check_types):
+    section_names = set([])
+    for check_type in check_types:
+        section_name = check_type.split(".")[0]
+        section_names.add(section_name)
+        section_names.update(check_info.get(section_name, {}).get("extra_sections", []))
+
+    fetchoids = {}
+    for section_name in sorted(section_names):
+        oid_info = snmp_info.get(section_name)
+        if not oid_info or snmp_table_is_cached(hostname, section_name):
+            continue
+
+        if type(oid_info) != list:
+            oid_info = [ oid_info ]
+
+        for context_name in snmp_contexts_of_check(hostname, section_name):
+            context_fetchoids = fetchoids.setdefault(context_name, [])
+            for entry in oid_info:
+                if len(entry) == 2:
+                    oid, suboids, targetcolumns = entry[0], [None], entry[1]
+                else:
+                    oid, suboids, targetcolumns = entry
+
+                for suboid in suboids:
+                    for fetchoid in walked_fetchoids(oid, suboid, targetcolumns, True):
+                        if fetchoid not in context_fetchoids:
+                            context_fetchoids.append(fetchoid)
+
+    for context_name, context_fetchoids in fetchoids.items():
+        fetchoids[context_name] = cmk_base.snmp_subtrees.covering_oids(context_fetchoids)
+    return fetchoids
+
+
+# Mirrors the handling of cache files in get_realhost_info()
+def snmp_table_is_cached(hostname, section_name):
+    cachefile = cmk.paths.tcp_cache_dir + "/" + hostname + "." + section_name
+    if not os.path.exists(cachefile):
+        return False
+
+    age = cachefile_age(cachefile)
+    check_interval = check_interval_of(hostname, section_name)
+    if not opt_dont_submit and check_interval is not None and age < check_interval * 60:
+        return True # check is skipped
+
+    return opt_use_cachefile and not opt_no_cache and age <= check_max_cachefile_age
+
+
+def builtin_snmp_get_oid(hostname, ipaddress, oid):
+    return builtin_snmp_get_oids(hostname, ipaddress, [ oid ]).get(oid)
+
+
+# Gets all given OIDs at once. Returns a dictionary from the OIDs to their
+# values like snmp_get_oid() returns them. OIDs ending with ".*" are
+# fetched with GETNEXT. Returns an empty dictionary on SNMP errors.
+def builtin_snmp_get_oids(hostname, ipaddress, oids):
+    session = builtin_snmp_session(hostname, ipaddress, None)
+    try:
+        entries = session.get([ oid for oid in oids if not oid.endswith(".*") ])
+        next_entries = session.get_next_many([ oid[:-2] for oid in oids if oid.endswith(".*") ])
+    except cmk_base.snmp_engine.SNMPError, e:
+        console.verbose(tty.red + tty.bold + "ERROR: " + tty.normal + "SNMP error: %s\n" % e)
+        return {}
+
+    values = {}
+    for oid in oids:
+        if oid.endswith(".*"):
+            oid_prefix = oid[:-2]
+            row = next_entries.get(oid_prefix)
+            if row is None or not row[0].startswith(oid_prefix + "."):
+                values[oid] = None
+                continue
+            tag, value = row[1:]
+        elif oid in entries:
+            tag, value = entries[oid]
+        else:
+            values[oid] = None
+            continue
+
+        # Strip quotes like snmp_get_oid() does
+        value = cmk_base.snmp_engine.format_value(tag, value)
+        if value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        values[oid] = value
+    return values
@@ -0,0 +1,112 @@
+# encoding: utf-8
+
+import os
+import types
+import pytest
+
+import cmk_base.autochecks as autochecks
+
+AUTOCHECKS = """[
+  ('df', u'/', {}),
+  ('df', u'/opt/a,b', {'levels': (80.0, 90.0)}),
+  ('cpu.loads', None, cpuload_default_levels),
+  ('if', '2', {'state': ['1'], 'speed': 1000000000}), # comment
+]
+"""
+
+
+@pytest.fixture()
+def autochecks_path(tmpdir):
+    path = "%s/autochecks/host.mk" % tmpdir
+    os.makedirs(os.path.dirname(path))
+    file(path, "w").write(AUTOCHECKS)
+    return path
+
+
+def test_parse_table():
+    assert autochecks.parse_table(AUTOCHECKS) == [
+        ('df', u'/', "{}"),
+        ('df', u'/opt/a,b', "{'levels': (80.0, 90.0)}"),
+        ('cpu.loads', None, "cpuload_default_levels"),
+        ('if', '2', "{'state': ['1'], 'speed': 1000000000}"),
+    ]
+
+
+def test_parse_table_legacy_format():
+    assert autochecks.parse_table("[\n  ('host', 'df', '/', {}),\n]\n") \
+        == [ ('df', '/', "{}") ]
+
+
+def test_parse_table_invalid_line():
+    with pytest.raises(autochecks.AutochecksLineError) as e:
+        autochecks.parse_table("[\n  ('df', '/'),\n]\n")
+    assert e.value.lineno == 2
+
+
+def test_compile_entries_literal():
+    assert autochecks.compile_entries("[\n  ('df', u'/', {}),\n]\n", "host.mk") \
+        == [ ('df', u'/', {}) ]
+
+
+def test_compile_entries_code():
+    code = autochecks.compile_entries(AUTOCHECKS, "host.mk")
+    assert type(code) == types.CodeType
+    assert eval(code, { "cpuload_default_levels" : (5.0, 10.0) })[2] \
+        == ('cpu.loads', None, (5.0, 10.0))
+
+
+def test_compile_entries_syntax_error():
+    with pytest.raises(SyntaxError):
+        autochecks.compile_entries("[\n  ('df', '/',\n", "host.mk")
+
+
+def test_load_creates_cache(autochecks_path, monkeypatch):
+    cache_path = os.path.dirname(autochecks_path) + "/../cache/host"
+    table, names = autochecks.load(autochecks_path, cache_path, [ "table", "names" ])
+    assert len(table) == 4
+    assert "cpuload_default_levels" in names
+    assert "df" in names
+    assert os.path.exists(cache_path)
+
+    # Now read from the cache
+    monkeypatch.setattr(autochecks, "compile_file", None)
+    assert autochecks.load(autochecks_path, cache_path, [ "table" ]) == [ table ]
+
+
+def test_load_outdated_cache(autochecks_path):
+    cache_path = os.path.dirname(autochecks_path) + "/host.cache"
+    autochecks.load(autochecks_path, cache_path, [ "entries" ])
+
+    file(autochecks_path + ".new", "w").write("[\n  ('df', u'/', {}),\n]\n")
+    os.rename(autochecks_path + ".new", autochecks_path)
+    assert autochecks.load(autochecks_path, cache_path, [ "entries" ]) \
+        == [ [ ('df', u'/', {}) ] ]
+
+
+def test_load_invalid_file(autochecks_path):
+    file(autochecks_path, "w").write("[\n  ('df', '/'\n")
+    entries, table = autochecks.load(autochecks_path, autochecks_path + ".cache",
+                                     [ "entries", "table" ])
+    assert entries is None
+    assert table is None
+
+
+def test_load_missing_file(tmpdir):
+    with pytest.raises(OSError):
+        autochecks.load("%s/missing.mk" % tmpdir, "%s/missing" % tmpdir, [ "entries" ])
+
+
+def test_load_all(autochecks_path):
+    directory = os.path.dirname(autochecks_path)
+    file(directory + "/other.mk", "w").write("[]\n")
+    file(directory + "/README", "w").write("")
+    cache_dir = directory + "/../cache"
+
+    result = autochecks.load_all(directory, cache_dir, [ "entries" ])
+    assert sorted(result.keys()) == [ "host", "other" ]
+    assert result["other"] == (autochecks.file_key(directory + "/other.mk"), [ [] ])
+    assert sorted(os.listdir(cache_dir)) == [ "host", "other" ]
+
+
+def test_load_all_missing_directory(tmpdir):
+    assert autochecks.load_all("%s/missing" % tmpdir, "%s/cache" % tmpdir, [ "entries" ]) == {}
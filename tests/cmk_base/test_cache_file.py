@@ -0,0 +1,59 @@
+# encoding: utf-8
+
+import pytest
+
+import cmk_base.cache_file as cache_file
+
+
+def test_dumps_loads():
+    table = [ [ "1", "eth0", u"Schnittstelle ä" ], [ "2", None, "" ] ]
+    data = cache_file.dumps([ ("table", table), ("other", (1, 2L)) ])
+
+    assert data.startswith(cache_file.MAGIC)
+    assert cache_file.loads(data, "table") == table
+    assert cache_file.loads(data, "other") == (1, 2L)
+    assert cache_file.loads(data) == { "table" : table, "other" : (1, 2L) }
+
+
+def test_read_index():
+    data = cache_file.dumps([ ("a", "x" * 100), ("b", []) ])
+    index = cache_file.read_index(data)
+    assert sorted(index.keys()) == [ "a", "b" ]
+    offset, length = index["b"]
+    assert offset + length == len(data)
+
+
+def test_save_load(tmpdir):
+    path = "%s/cache" % tmpdir
+    cache_file.save(path, [ ("rowinfo", [ (".1.3.6.1.2.1.1.1.0", "Linux") ]) ])
+    assert cache_file.load(path, "rowinfo") == [ (".1.3.6.1.2.1.1.1.0", "Linux") ]
+
+
+def test_load_missing_file(tmpdir):
+    with pytest.raises(IOError):
+        cache_file.load("%s/not_existing" % tmpdir)
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    "[['1', 'eth0']]\n", # repr() format of older versions
+    cache_file.dumps([ ("table", []) ])[:20],
+    cache_file.dumps([ ("table", [ 1, 2, 3 ]) ])[:-3],
+])
+def test_loads_invalid(data):
+    with pytest.raises(cache_file.MKCacheFormatError):
+        cache_file.loads(data, "table")
+
+
+def test_loads_missing_block():
+    with pytest.raises(cache_file.MKCacheFormatError):
+        cache_file.loads(cache_file.dumps([ ("table", []) ]), "other")
+
+
+def test_load_blocks(tmpdir):
+    path = "%s/cache" % tmpdir
+    cache_file.save(path, [ ("a", 1), ("b", [ 2 ]), ("c", "3") ])
+    assert cache_file.load_blocks(path, [ "c", "a" ]) == [ "3", 1 ]
+
+    with pytest.raises(cache_file.MKCacheFormatError):
+        cache_file.load_blocks(path, [ "a", "d" ])
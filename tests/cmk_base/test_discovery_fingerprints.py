@@ -0,0 +1,65 @@
+# encoding: utf-8
+
+import cmk_base.discovery_fingerprints as discovery_fingerprints
+
+SECTIONS = [
+    ("df",         [ [ u"/dev/sda1", u"ext4", u"100", u"50", u"50", u"50%", u"/" ] ]),
+    ("df_inodes",  None),
+]
+
+
+def test_fingerprint():
+    fingerprint = discovery_fingerprints.fingerprint(SECTIONS)
+    assert fingerprint == discovery_fingerprints.fingerprint(list(SECTIONS))
+    assert fingerprint != discovery_fingerprints.fingerprint(SECTIONS[:1])
+    assert fingerprint != discovery_fingerprints.fingerprint(
+        [ ("df", [ [ u"/dev/sda1", u"ext4", u"100", u"51", u"49", u"51%", u"/" ] ]),
+          ("df_inodes", None) ])
+    assert fingerprint != discovery_fingerprints.fingerprint(
+        [ ("df", SECTIONS[0][1]), ("df_inodes", []) ])
+
+
+def test_fingerprint_section_names():
+    assert discovery_fingerprints.fingerprint([ ("a", None), ("b", []) ]) \
+        != discovery_fingerprints.fingerprint([ ("b", None), ("a", []) ])
+
+
+class _Unmarshallable(object):
+    def __init__(self, value):
+        self.value = value
+
+
+    def __repr__(self):
+        return "_Unmarshallable(%r)" % self.value
+
+
+def test_fingerprint_unmarshallable_info():
+    fingerprint = discovery_fingerprints.fingerprint([ ("x", [ _Unmarshallable(1) ]) ])
+    assert fingerprint == discovery_fingerprints.fingerprint([ ("x", [ _Unmarshallable(1) ]) ])
+    assert fingerprint != discovery_fingerprints.fingerprint([ ("x", [ _Unmarshallable(2) ]) ])
+
+
+def test_save_load(tmpdir):
+    path = "%s/host" % tmpdir
+    results = {
+        "df"        : ("abc", [ (u"/", "{}") ]),
+        "cpu.loads" : ("def", [ (None, "cpuload_default_levels") ]),
+    }
+    discovery_fingerprints.save(path, "digest", results)
+    assert discovery_fingerprints.load(path, "digest") == results
+
+
+def test_load_changed_config(tmpdir):
+    path = "%s/host" % tmpdir
+    discovery_fingerprints.save(path, "digest", { "df" : ("abc", []) })
+    assert discovery_fingerprints.load(path, "other") == {}
+
+
+def test_load_missing(tmpdir):
+    assert discovery_fingerprints.load("%s/missing" % tmpdir, "digest") == {}
+
+
+def test_load_invalid(tmpdir):
+    path = "%s/host" % tmpdir
+    file(path, "w").write("garbage")
+    assert discovery_fingerprints.load(path, "digest") == {}
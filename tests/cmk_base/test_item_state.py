@@ -0,0 +1,121 @@
+# encoding: utf-8
+
+import os
+import pytest
+
+import cmk_base.item_state as item_state
+
+STATES = {
+    ("if", u"1", "in_octets")      : (1500000000.5, 123456789),
+    ("if", u"2", "in_octets")      : (1500000000.5, 0),
+    ("cpu.loads", None, "avg")     : (1500000000.0, 0.75),
+    "ps_stat.pcpu.669"             : (1448634267.875281, 1),
+    ("df", u"/", "trend")          : { "levels" : [ 1, 2 ] },
+}
+
+
+@pytest.fixture()
+def path(tmpdir):
+    return "%s/host" % tmpdir
+
+
+def _load(path):
+    return item_state.ItemStateFile(path).load()
+
+
+def test_load_missing(path):
+    assert _load(path) == {}
+
+
+def test_save_load(path):
+    item_state.ItemStateFile(path).save(STATES)
+    assert _load(path) == STATES
+    assert open(path).read().startswith(item_state.MAGIC)
+
+
+def test_save_appends_changes(path):
+    store = item_state.ItemStateFile(path)
+    store.load()
+    store.save(STATES)
+    size = os.stat(path).st_size
+
+    states = dict(STATES)
+    states[("if", u"1", "in_octets")] = (1500000060.5, 123456999)
+    del states["ps_stat.pcpu.669"]
+    inode = os.stat(path).st_ino
+    store.save(states)
+
+    assert os.stat(path).st_ino == inode
+    assert os.stat(path).st_size > size
+    assert _load(path) == states
+
+
+def test_save_unchanged(path):
+    store = item_state.ItemStateFile(path)
+    store.save(STATES)
+    size = os.stat(path).st_size
+    store.save(dict(STATES))
+    assert os.stat(path).st_size == size
+
+
+def test_save_detects_changes_of_mutable_states(path):
+    states = { "key" : [ 1 ] }
+    store = item_state.ItemStateFile(path)
+    store.save(states)
+    states["key"].append(2)
+    store.save(states)
+    assert _load(path) == { "key" : [ 1, 2 ] }
+
+
+def test_compaction(path):
+    store = item_state.ItemStateFile(path)
+    store.load()
+    for nr in range(1000):
+        store.save({ "counter" : (nr, nr), "other" : (0, 0) })
+    assert os.stat(path).st_size < 2 * item_state.COMPACTION_SLACK
+    assert _load(path) == { "counter" : (999, 999), "other" : (0, 0) }
+    assert [ f for f in os.listdir(os.path.dirname(path)) if f != "host" ] == []
+
+
+def test_truncated_record_is_ignored(path):
+    store = item_state.ItemStateFile(path)
+    store.save({ "a" : 1 })
+    store.save({ "a" : 1, "b" : 2 })
+    data = open(path).read()
+    open(path, "w").write(data[:-3])
+
+    store = item_state.ItemStateFile(path)
+    assert store.load() == { "a" : 1 }
+
+    # The broken file is rewritten completely on the next save
+    store.save({ "a" : 1, "c" : 3 })
+    assert _load(path) == { "a" : 1, "c" : 3 }
+
+
+def test_file_replaced_by_other_process(path):
+    store = item_state.ItemStateFile(path)
+    store.save({ "a" : 1 })
+    item_state.ItemStateFile(path).save({ "b" : 2 })
+    store.save({ "a" : 2 })
+    assert _load(path) == { "a" : 2 }
+
+
+def test_unmarshallable_state(path):
+    states = { "a" : set([ 1, 2 ]) }
+    item_state.ItemStateFile(path).save(states)
+    assert _load(path) == states
+
+
+def test_load_former_format(path):
+    open(path, "w").write("%r\n" % STATES)
+    store = item_state.ItemStateFile(path)
+    assert store.load() == STATES
+
+    store.save(STATES)
+    assert open(path).read().startswith(item_state.MAGIC)
+    assert _load(path) == STATES
+
+
+def test_load_garbage(path):
+    open(path, "w").write("{ garbage")
+    assert _load(path) == {}
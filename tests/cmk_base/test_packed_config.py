@@ -0,0 +1,46 @@
+# encoding: utf-8
+
+from collections import OrderedDict
+
+import cmk_base.packed_config as packed_config
+
+
+def test_save_load(tmpdir):
+    path = "%s/helper_config.mk" % tmpdir
+    variables = [
+        ("all_hosts", [ "host1|lnx", "host2|win" ]),
+        ("ipaddresses", { "host1" : "127.0.0.1" }),
+        ("ordered", OrderedDict([ ("b", 1), ("a", 2) ])),
+    ]
+    packed_config.save(path, variables, [ "removed" ])
+
+    namespace = { "OrderedDict" : OrderedDict, "removed" : 1 }
+    checksums = packed_config.load(path, namespace)
+
+    for varname, value in variables:
+        assert namespace[varname] == value
+    assert type(namespace["ordered"]) == OrderedDict
+    assert "removed" not in namespace
+    assert sorted(checksums) == [ "all_hosts", "ipaddresses" ]
+
+
+def test_load_skips_unchanged_variables(tmpdir):
+    path = "%s/helper_config.mk" % tmpdir
+    packed_config.save(path, [ ("a", [ 1 ]), ("b", [ 2 ]) ], [])
+    namespace = {}
+    checksums = packed_config.load(path, namespace)
+    a, b = namespace["a"], namespace["b"]
+
+    packed_config.save(path, [ ("a", [ 1 ]), ("b", [ 3 ]) ], [])
+    packed_config.load(path, namespace, checksums)
+    assert namespace["a"] is a
+    assert namespace["b"] is not b
+    assert namespace["b"] == [ 3 ]
+
+
+def test_load_selected_variables(tmpdir):
+    path = "%s/helper_config.mk" % tmpdir
+    packed_config.save(path, [ ("a", 1), ("b", 2) ], [ "c" ])
+    namespace = { "c" : 3 }
+    packed_config.load(path, namespace, varnames=[ "b" ])
+    assert namespace == { "b" : 2, "c" : 3 }
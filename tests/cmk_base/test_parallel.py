@@ -0,0 +1,44 @@
+# encoding: utf-8
+
+import os
+import pytest
+
+import cmk_base.parallel as parallel
+from cmk.exceptions import MKGeneralException
+
+
+def test_shards():
+    assert parallel.shards(range(7), 3) == [ [0, 1, 2], [3, 4], [5, 6] ]
+    assert parallel.shards(range(2), 4) == [ [0], [1] ]
+    assert parallel.shards([], 4) == [ [] ]
+
+
+def test_map_shards_keeps_order():
+    results = parallel.map_shards(lambda shard: (os.getpid(), [ x * 2 for x in shard ]),
+                                  range(100), 4)
+    assert sum([ values for _unused_pid, values in results ], []) == range(0, 200, 2)
+    assert len(set([ pid for pid, _unused_values in results ])) == 4
+    assert os.getpid() not in [ pid for pid, _unused_values in results ]
+
+
+def test_map_shards_large_results():
+    results = parallel.map_shards(lambda shard: [ "x" * 100000 ] * len(shard), range(20), 4)
+    assert sum(map(len, results)) == 20
+
+
+def test_map_shards_in_process():
+    assert parallel.map_shards(lambda shard: os.getpid(), range(10), 1) == [ os.getpid() ]
+
+
+def test_map_shards_raises_worker_exceptions():
+    def worker(shard):
+        if 3 in shard:
+            raise MKGeneralException("failed %d" % shard[0])
+        return shard
+
+    with pytest.raises(MKGeneralException) as e:
+        parallel.map_shards(worker, range(8), 4)
+    assert "failed 2" in str(e.value)
+
+    with pytest.raises(SystemExit):
+        parallel.map_shards(lambda shard: exit(5), range(8), 4)
@@ -0,0 +1,54 @@
+# encoding: utf-8
+
+import time
+
+import cmk_base.parent_scan as parent_scan
+
+
+def _task(commands, results):
+    for command in commands:
+        results.append((yield command))
+
+
+def test_run_tasks():
+    results_1, results_2 = [], []
+    parent_scan.run_tasks([ _task([ [ "echo", "a" ], [ "sh", "-c", "echo b; exit 3" ] ], results_1),
+                            _task([ [ "sh", "-c", "echo c >&2" ] ], results_2) ])
+    assert results_1 == [ (0, "a\n"), (3, "b\n") ]
+    assert results_2 == [ (0, "c\n") ]
+
+
+def test_run_tasks_executes_commands_once(tmpdir):
+    counter = "%s/counter" % tmpdir
+    command = [ "sh", "-c", "echo x >> %s; echo done" % counter ]
+    results = []
+    parent_scan.run_tasks([ _task([ command ], results) for _unused_nr in range(5) ]
+                          + [ _task([ command, command ], results) ], max_concurrent=2)
+    assert results == [ (0, "done\n") ] * 7
+    assert file(counter).read() == "x\n"
+
+
+def test_run_tasks_concurrently():
+    results = []
+    start = time.time()
+    parent_scan.run_tasks([ _task([ [ "sh", "-c", "sleep 0.5; echo %d" % nr ] ], results)
+                            for nr in range(6) ], max_concurrent=6)
+    assert time.time() - start < 2
+    assert sorted(results) == [ (0, "%d\n" % nr) for nr in range(6) ]
+
+
+def test_run_tasks_missing_command():
+    results = []
+    parent_scan.run_tasks([ _task([ [ "/no/such/command" ] ], results) ])
+    assert results[0][0] == 127
+    assert results[0][1].startswith("/no/such/command: ")
+
+
+def test_run_tasks_without_commands():
+    parent_scan.run_tasks([ _task([], []) ])
+
+
+def test_reverse_lookups():
+    names = parent_scan.reverse_lookups([ "127.0.0.1", "256.0.0.1", "127.0.0.1" ])
+    assert sorted(names.keys()) == [ "127.0.0.1", "256.0.0.1" ]
+    assert names["256.0.0.1"] is None
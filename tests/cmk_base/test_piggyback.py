@@ -0,0 +1,109 @@
+# encoding: utf-8
+
+import os
+import time
+import pytest
+
+import cmk_base.piggyback as piggyback
+
+
+@pytest.fixture()
+def store(tmpdir):
+    return piggyback.PiggybackStore("%s/piggyback" % tmpdir, "%s/piggyback_sources" % tmpdir)
+
+
+def _new(store):
+    return piggyback.PiggybackStore(store.piggyback_dir, store.sources_dir)
+
+
+def _read(store, backedhost):
+    files, _unused_outdated = store.files_of(backedhost, 3600)
+    return dict([ (sourcehost, file(path).read()) for sourcehost, path in files ])
+
+
+def test_no_data(store):
+    assert store.files_of("vm1", 3600) == ([], [])
+    assert not os.path.exists(store.piggyback_dir)
+
+
+def test_store(store):
+    store.store("esx1", { "vm1" : [ "<<<a>>>", "1" ], "vm2" : [ "<<<b>>>" ] })
+    store.store("esx2", { "vm1" : [ "<<<c>>>" ] })
+
+    store = _new(store)
+    assert _read(store, "vm1") == { "esx1" : "<<<a>>>\n1\n", "esx2" : "<<<c>>>\n" }
+    assert _read(store, "vm2") == { "esx1" : "<<<b>>>\n" }
+    assert sorted(store.source_index("esx1")) == [ "vm1", "vm2" ]
+    assert file("%s/vm1/%s" % (store.piggyback_dir, piggyback.INDEX_NAME)).read() == "esx1\nesx2\n"
+
+
+def test_store_removes_stale(store):
+    store.store("esx1", { "vm1" : [ "a" ], "vm2" : [ "b" ] })
+    assert store.store("esx1", { "vm2" : [ "c" ] }) == 1
+
+    store = _new(store)
+    assert _read(store, "vm1") == {}
+    assert _read(store, "vm2") == { "esx1" : "c\n" }
+    assert not os.path.exists("%s/vm1" % store.piggyback_dir)
+
+
+def test_remove_source(store):
+    store.store("esx1", { "vm1" : [ "a" ], "vm2" : [ "b" ] })
+    store.store("esx2", { "vm1" : [ "c" ] })
+    assert store.remove_source("esx1") == 2
+
+    store = _new(store)
+    assert store.source_index("esx1") is None
+    assert _read(store, "vm1") == { "esx2" : "c\n" }
+    assert _read(store, "vm2") == {}
+
+
+def test_outdated(store):
+    store.store("esx1", { "vm1" : [ "a" ] })
+    store._save_source_index("esx1", { "vm1" : int(time.time()) - 100 })
+
+    files, outdated = store.files_of("vm1", 10)
+    assert files == []
+    assert [ (sourcehost, path) for sourcehost, path, _unused_age in outdated ] \
+                == [ ("esx1", "%s/vm1/esx1" % store.piggyback_dir) ]
+
+    store.remove_file("vm1", "esx1")
+    assert _read(_new(store), "vm1") == {}
+
+
+def test_data_without_index(store):
+    # As stored by versions without index
+    os.makedirs("%s/vm1" % store.piggyback_dir)
+    file("%s/vm1/esx1" % store.piggyback_dir, "w").write("a\n")
+    file("%s/vm1/.new.esx2" % store.piggyback_dir, "w").write("b\n")
+
+    assert _read(store, "vm1") == { "esx1" : "a\n" }
+    assert file("%s/vm1/%s" % (store.piggyback_dir, piggyback.INDEX_NAME)).read() == "esx1\n"
+
+    # The first run of the source host cleans up the hard way
+    assert store.store("esx1", { "vm2" : [ "c" ] }) == 1
+    assert _read(_new(store), "vm1") == {}
+    assert _read(_new(store), "vm2") == { "esx1" : "c\n" }
+
+
+def test_store_after_outdated(store):
+    store.store("src1", { "vm1" : [ "a" ] })
+    store.store("src2", { "vm1" : [ "b" ] })
+
+    # src1 has been unreachable for too long
+    store._save_source_index("src1", { "vm1" : int(time.time()) - 100 })
+    _unused_files, outdated = store.files_of("vm1", 10)
+    for sourcehost, _unused_path, _unused_age in outdated:
+        store.remove_file("vm1", sourcehost)
+    assert _read(_new(store), "vm1") == { "src2" : "b\n" }
+
+    store.store("src1", { "vm1" : [ "c" ] })
+    assert _read(_new(store), "vm1") == { "src1" : "c\n", "src2" : "b\n" }
+
+
+def test_separate_lock_file(store):
+    store.store("src1", { "vm1" : [ "a" ] })
+    assert os.path.exists("%s/vm1/%s" % (store.piggyback_dir, piggyback.LOCK_NAME))
+
+    store.remove_source("src1")
+    assert not os.path.exists("%s/vm1" % store.piggyback_dir)
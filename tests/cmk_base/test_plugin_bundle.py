@@ -0,0 +1,29 @@
+# encoding: utf-8
+
+import cmk_base.plugin_bundle as plugin_bundle
+
+
+def test_build_execute(tmpdir):
+    tmpdir.join("plugin").write("check_info['test'] = { 'value' : helper() }\n")
+    tmpdir.join("plugin.include").write("def helper():\n    return 42")
+    filenames = [ "%s/plugin.include" % tmpdir, "%s/plugin" % tmpdir ]
+
+    path = "%s/bundle" % tmpdir
+    plugin_bundle.build(path, filenames)
+
+    namespace = { "check_info" : {} }
+    plugin_bundle.execute(path, filenames, namespace)
+    assert namespace["check_info"] == { "test" : { "value" : 42 } }
+    assert namespace["helper"].__code__.co_filename == filenames[0]
+
+
+def test_bundle_id_changes_with_sources(tmpdir):
+    plugin = tmpdir.join("plugin")
+    plugin.write("a = 1\n")
+    filenames = [ "%s" % plugin ]
+
+    bundle_id = plugin_bundle.bundle_id(filenames)
+    assert plugin_bundle.bundle_id(filenames) == bundle_id
+
+    plugin.write("a = 2\n")
+    assert plugin_bundle.bundle_id(filenames) != bundle_id
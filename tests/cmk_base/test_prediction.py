@@ -0,0 +1,142 @@
+# encoding: utf-8
+
+import pytest
+
+import cmk_base.prediction as prediction
+
+SLICES = [
+    (1000, 1, [ 1.0, 2.0, None, 4.0, 5.0, 6.0 ]),
+    (900,  1, [ 3.0, 2.0, None, None, 1.0 ]),
+    (800,  2, [ 2.0, None, 8.0 ]),
+]
+
+EXPECTED = [
+    [ 2.0, 1.0, 3.0, (2.0 / 3) ** 0.5 ],
+    [ 2.0, 2.0, 2.0, 0.0 ],
+    [ None, None, None, None ],
+    [ 4.0, 4.0, 4.0, 0.0 ],
+    [ 14.0 / 3, 1.0, 8.0, (74.0 / 9) ** 0.5 ],
+    [ 7.0, 6.0, 8.0, 1.0 ],
+]
+
+
+def _assert_points(points, expected):
+    assert len(points) == len(expected)
+    for point, expected_point in zip(points, expected):
+        if expected_point[0] is None:
+            assert point == expected_point
+        else:
+            assert point == pytest.approx(expected_point)
+
+
+def test_consolidate_slices_python():
+    _assert_points(prediction._consolidate_slices_python(SLICES, 6), EXPECTED)
+
+
+def test_consolidate_slices_numpy():
+    numpy = pytest.importorskip("numpy")
+    _assert_points(prediction._consolidate_slices_numpy(numpy, SLICES, 6), EXPECTED)
+
+
+@pytest.fixture()
+def prediction_path(tmpdir):
+    path = "%s/monday" % tmpdir
+    prediction.save_prediction(path, {
+        "num_points" : 6,
+        "step"       : 60,
+        "columns"    : prediction.COLUMNS,
+        "points"     : EXPECTED,
+    })
+    return path
+
+
+def test_load_prediction(prediction_path):
+    loaded = prediction.load_prediction(prediction_path)
+    assert loaded["num_points"] == 6
+    assert loaded["step"] == 60
+    _assert_points(loaded["points"], EXPECTED)
+
+
+def test_load_prediction_point(prediction_path):
+    assert prediction.load_prediction_point(prediction_path, 250) == \
+                dict(zip(prediction.COLUMNS, EXPECTED[4]))
+    assert prediction.load_prediction_point(prediction_path, 130) == \
+                dict.fromkeys(prediction.COLUMNS)
+    assert prediction.load_prediction_point(prediction_path, 360) == \
+                dict.fromkeys(prediction.COLUMNS)
+
+
+def test_load_old_format(tmpdir):
+    path = "%s/monday" % tmpdir
+    file(path, "w").write("%r\n" % {
+        "num_points" : 1,
+        "step"       : 60,
+        "columns"    : prediction.COLUMNS,
+        "points"     : [ [ 1.0, 1.0, 1.0, 0.0 ] ],
+    })
+    assert prediction.load_prediction(path) is None
+    assert prediction.load_prediction_point(path, 0) is None
+
+
+@pytest.fixture()
+def fetched(monkeypatch):
+    queries = []
+    def fetch_rrd_data(hostname, service_description, batch):
+        queries.append(batch)
+        if any(varname == "missing" for varname, _cf, _fromtime, _untiltime in batch):
+            raise prediction.MKGeneralException("Got no historic metrics")
+        return [ (60, [ fromtime ]) for _varname, _cf, fromtime, _untiltime in batch ]
+
+    monkeypatch.setattr(prediction, "fetch_rrd_data", fetch_rrd_data)
+    monkeypatch.setattr(prediction, "g_rrd_data_cache", {})
+    return queries
+
+
+def test_get_rrd_data_of_ranges(fetched):
+    ranges = [ (200, 299), (100, 199) ]
+    assert prediction.get_rrd_data_of_ranges("host", "CPU load", "load1", "MAX", ranges,
+                                             [ "load5" ]) == [ (60, [ 200 ]), (60, [ 100 ]) ]
+    assert fetched == [[ ("load1", "MAX", 200, 299), ("load1", "MAX", 100, 199),
+                         ("load5", "MAX", 200, 299), ("load5", "MAX", 100, 199) ]]
+
+    # The prefetched metric needs no further query
+    assert prediction.get_rrd_data_of_ranges("host", "CPU load", "load5", "MAX", ranges) \
+                == [ (60, [ 200 ]), (60, [ 100 ]) ]
+    assert len(fetched) == 1
+
+    # The cache only holds the data of one service
+    prediction.get_rrd_data_of_ranges("host", "Memory", "load5", "MAX", ranges)
+    prediction.get_rrd_data_of_ranges("host", "CPU load", "load5", "MAX", ranges)
+    assert len(fetched) == 3
+
+
+def test_get_rrd_data_of_ranges_prefetch_failure(fetched):
+    assert prediction.get_rrd_data_of_ranges("host", "CPU load", "load1", "MAX", [ (100, 199) ],
+                                             [ "missing" ]) == [ (60, [ 100 ]) ]
+    assert fetched[-1] == [ ("load1", "MAX", 100, 199) ]
+
+
+def test_outdated_predictions_of(tmpdir):
+    params = { "period" : "wday", "horizon" : 90 }
+    period_info = prediction.prediction_periods["wday"]
+    now = 1500000000
+    valid, outdated = dict(params, time=now - 3600), dict(params, time=now - 8 * 86400)
+    infos = {
+        "load1"     : {}, # the metric itself
+        "load5"     : { "monday" : valid },
+        "load15"    : { "monday" : outdated },
+        "user"      : { "monday" : dict(outdated, horizon=30) },
+        "system"    : {},
+        "fs_used"   : { "tuesday" : valid },
+        "avg"       : { "monday" : dict(outdated, cf="AVERAGE") },
+        "read_ql_x" : { "monday" : dict(outdated, dsname="read ql x") },
+    }
+    for name, timegroups in infos.items():
+        tmpdir.mkdir(name)
+        for timegroup, info in timegroups.items():
+            info = dict({ "dsname" : name, "cf" : "MAX" }, **info)
+            tmpdir.join(name, "%s.info" % timegroup).write("%r\n" % info)
+
+    assert sorted(prediction.outdated_predictions_of(str(tmpdir), "load1", "monday",
+                                                     params, period_info, now, "MAX")) \
+                == [ "fs_used", "load15", "read ql x" ]
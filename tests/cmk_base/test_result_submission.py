@@ -0,0 +1,114 @@
+# encoding: utf-8
+
+import re
+
+import cmk_base.result_submission as result_submission
+
+
+class _Writer(object):
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.writes   = []
+
+
+    def __call__(self, data):
+        if self.max_size is not None:
+            data = data[:self.max_size]
+        self.writes.append(data)
+        return len(data)
+
+
+def test_command_pipe_commands():
+    buf = result_submission.CommandPipeBuffer()
+    buf.add("host", "CPU load", 1, "WARN - 15 min load 3.5")
+    assert len(buf) == 1
+
+    writer = _Writer()
+    buf.flush(writer)
+    assert len(buf) == 0
+    assert buf.size == 0
+    assert len(writer.writes) == 1
+    assert re.match(r"^\[\d+\] PROCESS_SERVICE_CHECK_RESULT;host;CPU load;1;WARN - 15 min load 3.5\n$",
+                    writer.writes[0])
+
+
+def test_command_pipe_chunks():
+    buf = result_submission.CommandPipeBuffer(max_write_size=200)
+    for index in range(20):
+        buf.add("host", "Service %d" % index, 0, "OK - output of the check")
+
+    writer = _Writer()
+    buf.flush(writer)
+    assert len(writer.writes) > 1
+    for data in writer.writes:
+        assert len(data) <= 200
+        assert data.endswith("\n")
+        assert all(line.startswith("[") for line in data.splitlines())
+    assert "".join(writer.writes).count("\n") == 20
+
+
+def test_command_pipe_large_command():
+    buf = result_submission.CommandPipeBuffer(max_write_size=100)
+    buf.add("host", "Small", 0, "OK")
+    buf.add("host", "Large", 0, "x" * 500)
+    buf.add("host", "Small 2", 0, "OK")
+
+    writer = _Writer()
+    buf.flush(writer)
+    assert len(writer.writes) == 3
+    assert "Large" in writer.writes[1]
+    assert writer.writes[1].count("\n") == 1
+
+
+def test_check_result_file_single_write():
+    buf = result_submission.CheckResultFileBuffer()
+    buf.add("host", "Disk /", 2, "CRIT - 99% used")
+    buf.add("host", "Memory", 0, "OK")
+
+    writer = _Writer()
+    buf.flush(writer)
+    assert len(writer.writes) == 1
+    data = writer.writes[0]
+    assert data.count("start_time=") == 2
+    assert "service_description=Disk /\n" in data
+    assert "return_code=2\noutput=CRIT - 99% used\n\n" in data
+
+
+def test_partial_writes():
+    buf = result_submission.CheckResultFileBuffer()
+    for index in range(5):
+        buf.add("host", "Service %d" % index, 0, "OK")
+
+    writer = _Writer(max_size=10)
+    buf.flush(writer)
+    assert len(writer.writes) > 1
+    assert "".join(writer.writes).count("host_name=host\n") == 5
+    assert buf.stats["bytes"] == len("".join(writer.writes))
+
+
+def test_clear():
+    buf = result_submission.CommandPipeBuffer()
+    buf.add("host", "Service", 0, "OK")
+    buf.clear()
+    assert len(buf) == 0
+    assert buf.size == 0
+
+    writer = _Writer()
+    buf.flush(writer)
+    assert writer.writes == []
+
+
+def test_stats():
+    pipe_buf = result_submission.CommandPipeBuffer()
+    file_buf = result_submission.CheckResultFileBuffer()
+    for index in range(3):
+        pipe_buf.add("host", "Service %d" % index, 0, "OK")
+    file_buf.add("host", "Service", 0, "OK")
+
+    pipe_buf.flush(_Writer())
+    file_buf.flush(_Writer())
+    assert pipe_buf.stats["results"] == 3
+    assert pipe_buf.stats["flushes"] == 1
+    assert pipe_buf.stats["max_latency"] >= 0.0
+    assert result_submission.format_stats([ pipe_buf, file_buf ]) \
+                                .startswith("4 results submitted with 2 writes")
@@ -0,0 +1,163 @@
+# encoding: utf-8
+
+import socket
+import pytest
+
+import cmk_base.snmp_engine as snmp_engine
+from cmk_base.snmp_engine import Session, OCTET_STRING, INTEGER, OBJECT_ID, COUNTER32, \
+                                 IP_ADDRESS, TIMETICKS
+from testlib.snmp_agent import Agent, MIB
+
+
+@pytest.fixture()
+def agent(request):
+    agent = Agent(getattr(request, "param", "public"))
+    agent.start()
+    yield agent
+    agent.socket.close()
+
+
+def _session(agent, **kwargs):
+    return Session("127.0.0.1", agent.credentials, port=agent.port, timeout=1, retries=1, **kwargs)
+
+
+def test_ber_roundtrip():
+    for tag, value in [ (INTEGER, 0), (INTEGER, -1), (INTEGER, 128), (INTEGER, -129),
+                        (COUNTER32, 4294967295), (OCTET_STRING, "x" * 300),
+                        (OBJECT_ID, ".1.3.6.1.4.1.2021.4294967295"),
+                        (IP_ADDRESS, "10.1.2.3") ]:
+        encoded = snmp_engine.encode_value(tag, value)
+        decoded_tag, content, end = snmp_engine.decode_tlv(encoded, 0)
+        assert (decoded_tag, end) == (tag, len(encoded))
+        assert snmp_engine.decode_value(tag, content) == value
+
+
+def test_truncated_message():
+    with pytest.raises(snmp_engine.SNMPError):
+        snmp_engine.decode_community_message(snmp_engine.encode_tlv(0x30, "\x02\x01\x01")[:-1])
+
+
+def test_format_value():
+    assert snmp_engine.format_value(OCTET_STRING, 'say "hi" \\o/') == '"say \\"hi\\" \\\\o/"'
+    assert snmp_engine.format_value(OCTET_STRING, "a\n  b") == '"a b"'
+    assert snmp_engine.format_value(OCTET_STRING, "\x00\x1a") == '"00 1A "'
+    assert snmp_engine.format_value(OCTET_STRING, "") == '""'
+    assert snmp_engine.format_value(TIMETICKS, 5) == "5"
+    assert snmp_engine.format_value(OBJECT_ID, ".1.3.6") == ".1.3.6"
+
+
+def test_key_localization():
+    # Test vectors of RFC 3414, appendix A.3
+    engine_id = "\x00" * 11 + "\x02"
+    md5_key = snmp_engine.password_to_key("maplesyrup", snmp_engine.hashlib.md5)
+    assert md5_key.encode("hex") == "9faf3283884e92834ebc9847d8edd963"
+    assert snmp_engine.localize_key(md5_key, engine_id, snmp_engine.hashlib.md5).encode("hex") \
+            == "526f5eed9fcce26f8964c2930787d82b"
+
+    sha_key = snmp_engine.password_to_key("maplesyrup", snmp_engine.hashlib.sha1)
+    assert sha_key.encode("hex") == "9fb5cc0381497b3793528939ff788d5d79145211"
+    assert snmp_engine.localize_key(sha_key, engine_id, snmp_engine.hashlib.sha1).encode("hex") \
+            == "6695febc9288e36282235fc7151f128497b38f3f"
+
+
+@pytest.mark.parametrize("use_bulk", [ False, True ])
+def test_walk_columns(agent, use_bulk):
+    session = _session(agent, use_bulk=use_bulk, max_repetitions=2)
+    walks = session.walk([ ".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.6",
+                           ".1.3.6.1.2.1.2.2.1.10", ".1.3.6.1.2.1.1.1.0",
+                           ".1.3.6.1.2.1.99" ])
+    session.close()
+
+    assert [ oid for oid, _unused_tag, _unused_value in walks[".1.3.6.1.2.1.2.2.1.2"] ] \
+        == [ ".1.3.6.1.2.1.2.2.1.2.1", ".1.3.6.1.2.1.2.2.1.2.2", ".1.3.6.1.2.1.2.2.1.2.10" ]
+    assert walks[".1.3.6.1.2.1.2.2.1.6"] == [ MIB[9] ]
+    assert [ value for _unused_oid, _unused_tag, value in walks[".1.3.6.1.2.1.2.2.1.10"] ] \
+        == [ 4294967295, 17, 0 ]
+    # snmpwalk falls back to a GET of the OID itself
+    assert walks[".1.3.6.1.2.1.1.1.0"] == [ MIB[0] ]
+    assert walks[".1.3.6.1.2.1.99"] == []
+
+
+def test_walk_truncated_bulk_responses(agent):
+    agent.max_varbinds = 2
+    session = _session(agent, use_bulk=True, max_repetitions=10)
+    walks = session.walk([ ".1.3.6.1.2.1.2.2.1.1", ".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.10" ])
+    session.close()
+
+    assert [ value for _unused_oid, _unused_tag, value in walks[".1.3.6.1.2.1.2.2.1.1"] ] \
+        == [ 1, 2, 10 ]
+    assert [ value for _unused_oid, _unused_tag, value in walks[".1.3.6.1.2.1.2.2.1.2"] ] \
+        == [ "lo", "eth0", "eth1" ]
+    assert [ value for _unused_oid, _unused_tag, value in walks[".1.3.6.1.2.1.2.2.1.10"] ] \
+        == [ 4294967295, 17, 0 ]
+
+
+def test_walk_pipelines_requests(agent):
+    session = _session(agent, max_columns=1)
+    session.walk([ ".1.3.6.1.2.1.2.2.1.1", ".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.10" ])
+    session.close()
+    # One round per table row plus the round detecting the end of the columns
+    assert agent.num_requests == 3 * 4
+
+
+def test_snmpv1(agent):
+    session = _session(agent, version=1)
+    assert session.get([ ".1.3.6.1.2.1.1.3.0", ".1.3.6.1.2.1.1.9.0" ]) \
+            == { ".1.3.6.1.2.1.1.3.0" : (TIMETICKS, 123456) }
+    walk = session.walk([ ".1.3.6.1.2.1.4" ])[".1.3.6.1.2.1.4"]
+    assert walk == [ MIB[-1] ] # terminated by noSuchName at the end of the MIB
+    assert session.get_next(".1.3.6.1.2.1.1.2") == MIB[1]
+    session.close()
+
+
+@pytest.mark.parametrize("version", [ 1, 2 ])
+def test_get_many_oids(agent, version):
+    session = _session(agent, version=version, max_columns=2)
+    oids = [ ".1.3.6.1.2.1.1.1.0", ".1.3.6.1.2.1.1.9.0", ".1.3.6.1.2.1.1.2.0",
+             ".1.3.6.1.2.1.1.3.0", ".1.3.6.1.2.1.1.8.0" ]
+    assert sorted(session.get(oids).keys()) \
+            == [ ".1.3.6.1.2.1.1.1.0", ".1.3.6.1.2.1.1.2.0", ".1.3.6.1.2.1.1.3.0" ]
+
+    assert session.get_next_many([ ".1.3.6.1.2.1.1.2", ".1.3.6.1.2.1.99", ".1.3.6.1.2.1.1" ]) \
+            == { ".1.3.6.1.2.1.1.2" : MIB[1], ".1.3.6.1.2.1.1" : MIB[0] }
+    session.close()
+
+
+def test_get_splits_oids_into_pdus(agent):
+    session = _session(agent, max_columns=1)
+    session.get([ ".1.3.6.1.2.1.1.1.0", ".1.3.6.1.2.1.1.2.0", ".1.3.6.1.2.1.1.3.0" ])
+    session.close()
+    assert agent.num_requests == 3
+
+
+@pytest.mark.parametrize("agent", [ ("noAuthNoPriv", "monitor"),
+                                    ("authNoPriv", "md5", "monitor", "secret12"),
+                                    ("authNoPriv", "sha", "monitor", "secret12") ],
+                         indirect=True)
+def test_snmpv3(agent):
+    session = _session(agent, use_bulk=True)
+    walks = session.walk([ ".1.3.6.1.2.1.2.2.1.1", ".1.3.6.1.2.1.1.2" ])
+    assert len(walks[".1.3.6.1.2.1.2.2.1.1"]) == 3
+    assert walks[".1.3.6.1.2.1.1.2"] == [ MIB[1] ]
+    session.close()
+
+
+@pytest.mark.parametrize("agent", [ ("authNoPriv", "md5", "monitor", "secret12") ],
+                         indirect=True)
+def test_snmpv3_wrong_password(agent):
+    session = Session("127.0.0.1", ("authNoPriv", "md5", "monitor", "wrongpass"),
+                      port=agent.port, timeout=1, retries=0)
+    with pytest.raises(snmp_engine.SNMPError) as e:
+        session.get([ ".1.3.6.1.2.1.1.1.0" ])
+    assert "Wrong digest" in "%s" % e.value
+    session.close()
+
+
+def test_timeout():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    session = Session("127.0.0.1", "public", port=silent.getsockname()[1], timeout=0.1, retries=1)
+    with pytest.raises(snmp_engine.SNMPTimeout):
+        session.walk([ ".1.3.6.1.2.1.1" ])
+    session.close()
+    silent.close()
@@ -0,0 +1,65 @@
+# encoding: utf-8
+
+import socket
+import time
+import pytest
+
+import cmk_base.snmp_poller as snmp_poller
+from cmk_base.snmp_engine import Session
+from testlib.snmp_agent import Agent
+
+COLUMNS = [ ".1.3.6.1.2.1.2.2.1.1", ".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.10", ".1.3.6.1.2.1.1.1.0" ]
+
+
+@pytest.fixture()
+def agents():
+    agents = [ Agent("public", delay=0.2),
+               Agent(("authNoPriv", "sha", "monitor", "secret12"), delay=0.2) ]
+    for agent in agents:
+        agent.start()
+    yield agents
+    for agent in agents:
+        agent.socket.close()
+
+
+def _session(agent, **kwargs):
+    return Session("127.0.0.1", agent.credentials, port=agent.port, timeout=1, retries=1, **kwargs)
+
+
+def test_walk_hosts_concurrently(agents):
+    expected = _session(agents[0]).walk(COLUMNS)
+
+    jobs = [ ("host%d" % nr, _session(agents[nr % 2], use_bulk=nr % 4 < 2), COLUMNS)
+             for nr in range(40) ]
+    started = time.time()
+    results, errors = snmp_poller.walk_hosts(jobs, max_concurrent=40)
+
+    # Walking a single host takes 5 rounds with 0.2 seconds each. One
+    # after the other this would take more than 40 seconds.
+    assert time.time() - started < 5
+    assert errors == {}
+    assert sorted(results) == sorted([ key for key, _unused_session, _unused_oids in jobs ])
+    for result in results.values():
+        assert result == expected
+
+
+def test_walk_hosts_errors(agents):
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    jobs = [
+        ("silent", Session("127.0.0.1", "public", port=silent.getsockname()[1],
+                           timeout=0.1, retries=2), COLUMNS),
+        ("wrong", Session("127.0.0.1", ("authNoPriv", "sha", "monitor", "wrongpass"),
+                          port=agents[1].port, timeout=1, retries=0), COLUMNS),
+        ("ok", _session(agents[0]), COLUMNS),
+    ]
+    results, errors = snmp_poller.walk_hosts(jobs)
+    silent.close()
+
+    assert results.keys() == [ "ok" ]
+    assert errors["silent"].startswith("Timeout")
+    assert "Wrong digest" in errors["wrong"]
+
+
+def test_walk_no_hosts():
+    assert snmp_poller.walk_hosts([]) == ({}, {})
@@ -0,0 +1,72 @@
+# encoding: utf-8
+
+import pytest
+
+import cmk_base.snmp_subtrees as snmp_subtrees
+
+IF_ENTRY = ".1.3.6.1.2.1.2.2.1"
+
+ROWS = [
+    (IF_ENTRY + ".1.1",   "1"),
+    (IF_ENTRY + ".1.2",   "2"),
+    (IF_ENTRY + ".2.1",   "eth0"),
+    (IF_ENTRY + ".2.2",   "eth1"),
+    (IF_ENTRY + ".10.1",  "100"),
+    (IF_ENTRY + ".10.2",  "200"),
+    (IF_ENTRY + ".10.20", "300"),
+]
+
+
+def test_covering_oids():
+    assert snmp_subtrees.covering_oids([
+        IF_ENTRY + ".2",
+        ".1.3.6.1.2.1.1.1.0",
+        IF_ENTRY,
+        IF_ENTRY + ".10",
+        ".1.3.6.1.2.1.2.2.10",
+        IF_ENTRY,
+        ".1.3.6.1.2.1.1.1",
+    ]) == [ IF_ENTRY, ".1.3.6.1.2.1.2.2.10", ".1.3.6.1.2.1.1.1" ]
+
+
+def test_covering_oids_are_not_string_prefixes():
+    assert snmp_subtrees.covering_oids([ ".1.3.6.1.2.1.1", ".1.3.6.1.2.1.10" ]) \
+        == [ ".1.3.6.1.2.1.1", ".1.3.6.1.2.1.10" ]
+
+
+def test_covering_oids_mixed_forms():
+    assert snmp_subtrees.covering_oids([ IF_ENTRY + ".2", "1.3.6.1.2.1.2", IF_ENTRY[1:] ]) \
+        == [ ".1.3.6.1.2.1.2" ]
+    assert snmp_subtrees.covering_oids([ ".1.3.6.1.2.1.2", IF_ENTRY[1:], "1.3.6.1.2.1.1" ]) \
+        == [ ".1.3.6.1.2.1.2", ".1.3.6.1.2.1.1" ]
+
+
+def test_find_covering_oid():
+    oids = set([ IF_ENTRY, ".1.3.6.1.2.1.1.1.0" ])
+    assert snmp_subtrees.find_covering_oid(IF_ENTRY, oids) == IF_ENTRY
+    assert snmp_subtrees.find_covering_oid(IF_ENTRY + ".2", oids) == IF_ENTRY
+    assert snmp_subtrees.find_covering_oid(".1.3.6.1.2.1.1.1.0", oids) == ".1.3.6.1.2.1.1.1.0"
+    assert snmp_subtrees.find_covering_oid(".1.3.6.1.2.1.1.1", oids) is None
+    assert snmp_subtrees.find_covering_oid(".1.3.6.1.2.1.2.2.10", oids) is None
+
+
+def test_find_covering_oid_without_leading_dot():
+    oids = snmp_subtrees.covering_oids([ ".1.3.6.1.2.1.2", IF_ENTRY[1:] ])
+    assert snmp_subtrees.find_covering_oid(IF_ENTRY[1:], oids) == ".1.3.6.1.2.1.2"
+    assert snmp_subtrees.find_covering_oid("1.3.6.1.2.1.2", oids) == ".1.3.6.1.2.1.2"
+    assert snmp_subtrees.find_covering_oid("1.3.6.1.2.1.1", oids) is None
+
+
+def test_rows_of_subtree():
+    subtree = snmp_subtrees.Subtree(IF_ENTRY, ROWS)
+    assert subtree.rows_of(IF_ENTRY) is ROWS
+    assert subtree.rows_of(IF_ENTRY + ".2") == [ (IF_ENTRY + ".2.1", "eth0"),
+                                                 (IF_ENTRY + ".2.2", "eth1") ]
+    assert subtree.rows_of(IF_ENTRY + ".10.2") == [ (IF_ENTRY + ".10.2", "200") ]
+    assert subtree.rows_of(IF_ENTRY + ".10.20") == [ (IF_ENTRY + ".10.20", "300") ]
+    assert subtree.rows_of(IF_ENTRY + ".3") == []
+
+
+def test_rows_of_foreign_oid():
+    with pytest.raises(ValueError):
+        snmp_subtrees.Subtree(IF_ENTRY, ROWS).rows_of(IF_ENTRY + "0")
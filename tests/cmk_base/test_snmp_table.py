@@ -0,0 +1,177 @@
+# encoding: utf-8
+
+import copy
+import random
+import pytest
+
+import cmk_base.snmp_table as snmp_table
+
+
+# The former implementation of modules/snmp.py, used as reference
+def legacy_sanitize_columns(columns):
+    def extract_end_oid(prefix, complete):
+        return complete[len(prefix):].lstrip('.')
+
+    def oid_to_intlist(oid):
+        if oid:
+            return map(int, oid.split('.'))
+        else:
+            return []
+
+    def cmp_oids(o1, o2):
+        return cmp(oid_to_intlist(o1), oid_to_intlist(o2))
+
+    def cmp_oid_pairs(pair1, pair2):
+        return cmp(oid_to_intlist(pair1[0].lstrip('.')),
+                   oid_to_intlist(pair2[0].lstrip('.')))
+
+    def are_ascending_oids(oid_list):
+        for a in range(len(oid_list) - 1):
+            if cmp_oids(oid_list[a], oid_list[a + 1]) > 0:
+                return False
+        return True
+
+    endoids = []
+    for fetchoid, column, value_encoding in columns:
+        for o, value in column:
+            endoid = extract_end_oid(fetchoid, o)
+            if endoid not in endoids:
+                endoids.append(endoid)
+
+    if not are_ascending_oids(endoids):
+        endoids.sort(cmp = cmp_oids)
+        need_sort = True
+    else:
+        need_sort = False
+
+    new_columns = []
+    for fetchoid, column, value_encoding in columns:
+        if need_sort:
+            column.sort(cmp = cmp_oid_pairs)
+
+        i = 0
+        new_column = []
+        for o, value in column:
+            eo = extract_end_oid(fetchoid, o)
+            if len(column) != len(endoids):
+                while i < len(endoids) and endoids[i] != eo:
+                    new_column.append("")
+                    i += 1
+            new_column.append(value)
+            i += 1
+
+        while i < len(endoids):
+            new_column.append("")
+            i += 1
+        new_columns.append((new_column, value_encoding))
+
+    return new_columns
+
+
+def legacy_construct_rows(columns):
+    if not columns:
+        return []
+
+    new_info = []
+    for index in range(len(columns[0])):
+        row = [ c[index] for c in columns ]
+        new_info.append(row)
+    return new_info
+
+
+def synthetic_table(num_rows, num_columns, gap_ratio=0.0, shuffle=False, rand=random):
+    columns = []
+    for colno in range(num_columns):
+        fetchoid = ".1.3.6.1.2.1.31.1.1.1.%d" % (colno + 1)
+        column = []
+        for row in range(num_rows):
+            if gap_ratio and rand.random() < gap_ratio:
+                continue
+            column.append(("%s.%d.%d" % (fetchoid, row / 256, row % 256), "value %d/%d" % (colno, row)))
+        if shuffle:
+            rand.shuffle(column)
+        columns.append((fetchoid, column, "string"))
+    return columns
+
+
+def assert_same_result(columns):
+    expected = legacy_sanitize_columns(copy.deepcopy(columns))
+    assert snmp_table.sanitize_columns(columns) == expected
+
+    values = [ values for values, _unused_encoding in expected ]
+    try:
+        expected_rows = legacy_construct_rows(values)
+    except IndexError:
+        with pytest.raises(IndexError):
+            snmp_table.construct_rows(values)
+    else:
+        assert snmp_table.construct_rows(values) == expected_rows
+
+
+def test_complete_table():
+    columns = synthetic_table(100, 3)
+    assert_same_result(columns)
+    assert snmp_table.construct_rows([ v for v, _e in snmp_table.sanitize_columns(columns) ])[1] \
+        == [ "value 0/1", "value 1/1", "value 2/1" ]
+
+
+def test_gaps_are_filled():
+    columns = [
+        (".1.2.1", [ (".1.2.1.1", "a1"), (".1.2.1.3", "a3") ], "string"),
+        (".1.2.2", [ (".1.2.2.1", "b1"), (".1.2.2.2", "b2"), (".1.2.2.3", "b3") ], "binary"),
+        (".1.2.3", [ (".1.2.3.2", "c2") ], "string"),
+    ]
+    assert snmp_table.sanitize_columns(columns) == [
+        ([ "a1", "", "a3" ], "string"),
+        ([ "b1", "b2", "b3" ], "binary"),
+        ([ "", "c2", "" ], "string"),
+    ]
+    assert_same_result(columns)
+
+
+def test_index_column():
+    # The index columns of OID_END/OID_BIN contain the end OIDs as values
+    columns = [
+        (".1.2.1", [ (".1.2.1.10", "10"), (".1.2.1.9", "9") ], "string"),
+        (".1.2.1", [ (".1.2.1.10", "x10"), (".1.2.1.9", "x9") ], "string"),
+        (".1.2.2", [ (".1.2.2.9", "y9") ], "string"),
+    ]
+    assert snmp_table.sanitize_columns(columns) == [
+        ([ "9", "10" ], "string"),
+        ([ "x9", "x10" ], "string"),
+        ([ "y9", "" ], "string"),
+    ]
+    assert_same_result(columns)
+
+
+def test_empty_tables():
+    assert_same_result([])
+    assert_same_result([ (".1.2", [], "string") ])
+    assert_same_result([ (".1.2.1.0", [ (".1.2.1.0", "scalar") ], "string") ])
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_same_result_as_former_implementation(seed):
+    rand = random.Random(seed)
+    columns = synthetic_table(rand.randint(1, 60), rand.randint(1, 4),
+                              gap_ratio=rand.choice([ 0, 0.1, 0.5 ]),
+                              shuffle=rand.random() < 0.3, rand=rand)
+
+    # Broken agents: duplicate and foreign OIDs
+    if seed % 5 == 0 and columns[0][1]:
+        columns[-1][1].append(columns[0][1][0])
+    if seed % 7 == 0 and columns[0][1]:
+        columns[0][1].insert(0, columns[0][1].pop())
+
+    assert_same_result(columns)
+
+
+def test_large_tables():
+    for gap_ratio, shuffle in [ (0, False), (0.05, False), (0.05, True) ]:
+        columns = synthetic_table(2000, 4, gap_ratio=gap_ratio, shuffle=shuffle,
+                                  rand=random.Random(0))
+        num_rows = len(set([ oid[len(fetchoid):] for fetchoid, column, _unused_encoding in columns
+                                                 for oid, _unused_value in column ]))
+        rows = snmp_table.construct_rows([ values for values, _unused_encoding
+                                           in snmp_table.sanitize_columns(columns) ])
+        assert len(rows) == num_rows
@@ -0,0 +1,101 @@
+# encoding: utf-8
+
+import os
+import random
+import pytest
+
+import cmk_base.stored_walk as stored_walk
+
+WALK = """.1.3.6.1.2.1.1.1.0 "Linux box"
+.1.3.6.1.2.1.1.2.0 .1.3.6.1.4.1.8072.3.2.10
+.1.3.6.1.2.1.1.10.0 10
+.1.3.6.1.2.1.2.2.1.1.1 1
+.1.3.6.1.2.1.2.2.1.1.2 2
+.1.3.6.1.2.1.2.2.1.2.1 "lo"
+.1.3.6.1.2.1.2.2.1.2.2 "eth0"
+.1.3.6.1.2.1.2.2.1.6.1
+.1.3.6.1.2.1.2.2.1.10.2 4294967295"""
+
+
+@pytest.fixture()
+def walk_path(tmpdir):
+    path = "%s/host" % tmpdir
+    file(path, "w").write(WALK)
+    return path
+
+
+def _walk(walk_path):
+    return stored_walk.StoredWalk(walk_path, walk_path + ".idx")
+
+
+def test_rows(walk_path):
+    walk = _walk(walk_path)
+    assert walk.rows(".1.3.6.1.2.1.2.2.1.2") == [ (".1.3.6.1.2.1.2.2.1.2.1", '"lo"\n'),
+                                                  (".1.3.6.1.2.1.2.2.1.2.2", '"eth0"\n') ]
+    assert walk.rows("1.3.6.1.2.1.1.1.0") == [ (".1.3.6.1.2.1.1.1.0", '"Linux box"\n') ]
+    assert [ oid for oid, _unused_value in walk.rows(".1.3.6.1.2.1.1") ] \
+        == [ ".1.3.6.1.2.1.1.1.0", ".1.3.6.1.2.1.1.2.0", ".1.3.6.1.2.1.1.10.0" ]
+    assert walk.rows(".1.3.6.1.2.1.2.2.1.6") == [ (".1.3.6.1.2.1.2.2.1.6.1", "") ]
+    assert walk.rows(".1.3.6.1.2.1.2.2.1.10") == [ (".1.3.6.1.2.1.2.2.1.10.2", "4294967295") ]
+    assert walk.rows(".1.3.6.1.2.1.2.2.1.3") == []
+    assert walk.rows(".1.3.6.1.2.1.1.1.0", include_oid=False) == []
+    walk.close()
+
+
+def test_first_row_below(walk_path):
+    walk = _walk(walk_path)
+    assert walk.first_row_below(".1.3.6.1.2.1.2.2.1.2") == (".1.3.6.1.2.1.2.2.1.2.1", '"lo"\n')
+    assert walk.first_row_below(".1.3.6.1.2.1.1.1.0") is None
+    assert walk.first_row_below(".1.3.6.1.4") is None
+    walk.close()
+
+
+def test_invalid_oid(walk_path):
+    with pytest.raises(ValueError):
+        _walk(walk_path).rows(".1.3.x")
+
+
+def test_index_is_reused_and_rebuilt(walk_path):
+    _walk(walk_path).close()
+    index_mtime = os.stat(walk_path + ".idx").st_mtime
+
+    _walk(walk_path).close()
+    assert os.stat(walk_path + ".idx").st_mtime == index_mtime
+
+    file(walk_path, "a").write("\n.1.3.6.1.2.1.2.2.1.10.3 17\n")
+    assert len(_walk(walk_path).rows(".1.3.6.1.2.1.2.2.1.10")) == 2
+
+
+def test_broken_index_is_rebuilt(walk_path):
+    file(walk_path + ".idx", "w").write("CMKWALKX garbage")
+    assert len(_walk(walk_path).rows(".1.3.6.1.2.1.2.2.1.1")) == 2
+
+
+def test_unsorted_walk(tmpdir):
+    lines = [ ".1.3.6.1.2.1.31.1.1.1.%d.%d %d" % (column, row, row)
+              for column in range(1, 4) for row in range(1, 200) ]
+    random.Random(0).shuffle(lines)
+    path = "%s/unsorted" % tmpdir
+    file(path, "w").write("\n".join(lines) + "\n")
+
+    rows = _walk(path).rows(".1.3.6.1.2.1.31.1.1.1.2")
+    assert [ oid for oid, _unused_value in rows ] \
+        == [ ".1.3.6.1.2.1.31.1.1.1.2.%d" % row for row in range(1, 200) ]
+
+
+def test_empty_walk(tmpdir):
+    path = "%s/empty" % tmpdir
+    file(path, "w").write("")
+    assert _walk(path).rows(".1.3") == []
+
+
+def test_index_dir_is_created(walk_path, tmpdir):
+    index_path = "%s/index/host" % tmpdir
+    stored_walk.StoredWalk(walk_path, index_path).close()
+    assert os.path.exists(index_path)
+
+
+def test_index_dir_not_writable(walk_path, tmpdir):
+    file("%s/index" % tmpdir, "w").write("") # directory can not be created
+    walk = stored_walk.StoredWalk(walk_path, "%s/index/host" % tmpdir)
+    assert len(walk.rows(".1.3.6.1.2.1.2.2.1.1")) == 2
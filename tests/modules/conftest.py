@@ -0,0 +1,14 @@
+# encoding: utf-8
+
+import pytest
+
+import cmk.log
+
+from testlib.cmk_modules import load_modules
+
+
+# The namespace of the Check_MK modules, loaded for each test
+@pytest.yield_fixture()
+def cmk_modules(monkeypatch, tmpdir):
+    yield load_modules(monkeypatch, "%s/site" % tmpdir)
+    cmk.log.set_verbosity(verbosity=0)
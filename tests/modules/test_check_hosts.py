@@ -0,0 +1,59 @@
+# encoding: utf-8
+
+import pytest
+
+import cmk.debug
+
+from testlib.cmk_modules import set_config
+
+HOSTS = [ "host%02d" % nr for nr in range(12) ]
+
+
+# Runs --check-hosts with stubs for fetching and checking. The check of
+# the hosts in errors raises the given exception.
+def _check_hosts(cmk_modules, monkeypatch, errors):
+    set_config(cmk_modules, all_hosts=HOSTS, max_num_processes=1)
+
+    checked, flushed = [], []
+    def do_check(hostname, ipaddress, only_check_types):
+        checked.append(hostname)
+        if hostname in errors:
+            raise errors[hostname]
+        return 0
+
+    monkeypatch.setitem(cmk_modules, "lookup_ip_address", lambda hostname: "127.0.0.1")
+    monkeypatch.setitem(cmk_modules, "fetch_agent_outputs", lambda hosts, max_concurrent: None)
+    monkeypatch.setitem(cmk_modules, "fetch_snmp_tables", lambda hosts, only_check_types: None)
+    monkeypatch.setitem(cmk_modules, "do_check", do_check)
+    monkeypatch.setitem(cmk_modules, "flush_check_results", lambda: flushed.append(checked[-1]))
+
+    exit_status = cmk_modules["do_check_hosts"]([])
+    return exit_status, checked, flushed
+
+
+def test_check_hosts(cmk_modules, monkeypatch):
+    exit_status, checked, flushed = _check_hosts(cmk_modules, monkeypatch, {})
+    assert exit_status == 0
+    assert checked == HOSTS
+    # The results are submitted per chunk of 10 hosts
+    assert flushed == [ "host09", "host11" ]
+
+
+def test_check_hosts_error(cmk_modules, monkeypatch, capsys):
+    exit_status, checked, flushed = _check_hosts(cmk_modules, monkeypatch, {
+        "host02" : IOError("Connection reset"),
+        "host05" : cmk_modules["MKTimeout"](),
+    })
+    assert exit_status == 3
+    assert checked == HOSTS
+    assert flushed == [ "host09", "host11" ]
+
+    output = capsys.readouterr()[0]
+    assert "host02: UNKNOWN - Connection reset\n" in output
+    assert "host05: UNKNOWN - MKTimeout\n" in output
+
+
+def test_check_hosts_error_debug(cmk_modules, monkeypatch):
+    monkeypatch.setattr(cmk.debug, "debug_mode", True)
+    with pytest.raises(IOError):
+        _check_hosts(cmk_modules, monkeypatch, { "host02" : IOError("Connection reset") })
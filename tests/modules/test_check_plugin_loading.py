@@ -0,0 +1,172 @@
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from testlib.cmk_modules import load_modules
+
+PLUGINS = {
+    "foo.include" : """
+foo_default_levels = (80, 90)
+
+def parse_foo(info):
+    return info
+""",
+    "foo" : """
+def check_foo(item, params, info):
+    return 0, "OK"
+
+check_info["foo"] = {
+    "parse_function"      : parse_foo,
+    "check_function"      : check_foo,
+    "service_description" : "Foo %s",
+    "has_perfdata"        : False,
+}
+""",
+    "bar" : """
+factory_settings["bar_default_levels"] = { "levels" : (1, 2) }
+
+def check_bar(item, params, info):
+    return 0, "OK"
+
+check_info["bar"] = {
+    "check_function"          : check_bar,
+    "service_description"     : "Bar %s",
+    "has_perfdata"            : False,
+    "default_levels_variable" : "bar_default_levels",
+}
+""",
+    "baz" : """
+baz_levels = (3, 4)
+
+def check_baz(item, params, info):
+    return 0, "OK"
+
+check_info["baz"] = {
+    "check_function"      : check_baz,
+    "service_description" : "Baz",
+    "has_perfdata"        : False,
+}
+""",
+}
+
+
+@pytest.fixture()
+def checks_dir(tmpdir):
+    for name, source in PLUGINS.items():
+        tmpdir.join("checks", name).write(source, ensure=True)
+    return "%s/checks" % tmpdir
+
+
+# Loads the modules like a new Check_MK process does and the check
+# plugins on demand, if possible
+@pytest.fixture()
+def new_process(monkeypatch, tmpdir, checks_dir):
+    def load(lazy=True):
+        namespace = load_modules(monkeypatch, "%s/site" % tmpdir, checks_dir=checks_dir)
+        namespace["load_checks"](lazy=lazy)
+        return namespace
+    return load
+
+
+def _loaded(namespace):
+    lazy = namespace["g_lazy_check_plugins"]
+    return sorted([ os.path.basename(f) for f in lazy["loaded"] ])
+
+
+def _change_plugin(checks_dir, name, source):
+    path = "%s/%s" % (checks_dir, name)
+    file(path, "a").write(source)
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_index_is_written(new_process, checks_dir):
+    namespace = new_process(lazy=False)
+    filelist = namespace["check_plugin_filelist"]()
+    index = namespace["read_check_plugin_index"](namespace["check_plugin_files_state"](filelist))
+
+    plugins = index["plugins"]
+    assert index["order"] == [ checks_dir + "/foo.include", checks_dir + "/bar",
+                               checks_dir + "/baz", checks_dir + "/foo" ]
+    assert plugins[checks_dir + "/foo"]["depends"] == [ checks_dir + "/foo.include" ]
+    assert plugins[checks_dir + "/bar"]["depends"] == []
+    assert "foo_default_levels" in plugins[checks_dir + "/foo.include"]["variables"]
+    assert plugins[checks_dir + "/bar"]["dict_keys"]["factory_settings"] == [ "bar_default_levels" ]
+
+
+def test_no_index(new_process):
+    namespace = new_process()
+    assert namespace["g_lazy_check_plugins"] is None
+    assert sorted(namespace["check_info"].keys()) == [ "bar", "baz", "foo" ]
+
+
+def test_lookup_loads_plugins(new_process):
+    new_process(lazy=False)
+    namespace = new_process()
+    check_info = namespace["check_info"]
+    assert isinstance(check_info, namespace["LazyCheckPluginDict"])
+    assert dict.keys(check_info) == []
+
+    assert check_info["foo"]["check_function"](None, None, None) == (0, "OK")
+    assert _loaded(namespace) == [ "foo", "foo.include" ]
+
+    assert "missing" not in check_info
+    assert check_info.get("missing") is None
+    with pytest.raises(KeyError):
+        check_info.__getitem__("missing")
+    assert _loaded(namespace) == [ "foo", "foo.include" ]
+
+    assert namespace["factory_settings"]["bar_default_levels"] == { "levels" : (1, 2) }
+    assert _loaded(namespace) == [ "bar", "foo", "foo.include" ]
+
+    # Iterating loads all plugins
+    assert sorted(check_info) == [ "bar", "baz", "foo" ]
+    assert _loaded(namespace) == [ "bar", "baz", "foo", "foo.include" ]
+
+
+def test_plugins_referenced_by_config(new_process, tmpdir):
+    new_process(lazy=False)
+    tmpdir.join("site", "etc", "check_mk", "main.mk").write("baz_levels = (5, 6)\n")
+    namespace = new_process()
+    namespace["read_config_files"]()
+
+    assert _loaded(namespace) == [ "baz" ]
+    # The plugin has been loaded before the configuration
+    assert namespace["baz_levels"] == (5, 6)
+
+
+def test_plugins_referenced_by_autochecks(new_process, tmpdir):
+    new_process(lazy=False)
+    tmpdir.join("site", "var", "check_mk", "autochecks", "host1.mk").write(
+        "[\n  ('foo', 'x', foo_default_levels),\n]\n", ensure=True)
+    namespace = new_process()
+
+    assert namespace["read_raw_autochecks_of"]("host1") == [ ("foo", u"x", (80, 90)) ]
+    assert _loaded(namespace) == [ "foo.include" ]
+
+
+def test_index_rebuilt_on_changed_plugin(new_process, checks_dir):
+    new_process(lazy=False)
+    _change_plugin(checks_dir, "baz", "baz_extra_levels = (1, 2)\n")
+
+    # The outdated index is not used, all plugins are loaded
+    namespace = new_process()
+    assert namespace["g_lazy_check_plugins"] is None
+    assert namespace["baz_extra_levels"] == (1, 2)
+
+    namespace = new_process()
+    assert namespace["g_lazy_check_plugins"] is not None
+    namespace["load_check_plugins_referenced_by"]("baz_extra_levels = (3, 4)")
+    assert _loaded(namespace) == [ "baz" ]
+
+
+def test_index_rebuilt_on_new_plugin(new_process, checks_dir):
+    new_process(lazy=False)
+    file(checks_dir + "/qux", "w").write(PLUGINS["baz"].replace("baz", "qux"))
+
+    assert new_process()["g_lazy_check_plugins"] is None
+    namespace = new_process()
+    assert "qux" in namespace["check_info"]
+    assert _loaded(namespace) == [ "qux" ]
@@ -0,0 +1,152 @@
+# encoding: utf-8
+
+import os
+
+import pytest
+
+import cmk.log
+
+from testlib.cmk_modules import load_modules, set_config
+
+PLUGIN = """
+foo_default_levels = (80, 90)
+
+def check_foo(item, params, info):
+    return 0, "OK"
+
+check_info["foo"] = {
+    "check_function"      : check_foo,
+    "service_description" : "Foo %s",
+    "has_perfdata"        : False,
+}
+"""
+
+HOSTS = [ "host1|lnx|prod", "host2|lnx|prod" ]
+
+
+class _NotMarshallable(object):
+    def __repr__(self):
+        return "_NotMarshallable()"
+
+
+@pytest.fixture()
+def site(tmpdir):
+    tmpdir.join("checks", "foo").write(PLUGIN, ensure=True)
+    for hostname in [ "host1", "host2" ]:
+        _write_autochecks(tmpdir, hostname, [ "a", "b" ])
+    return tmpdir
+
+
+def _write_autochecks(tmpdir, hostname, items):
+    tmpdir.join("site", "var", "check_mk", "autochecks", hostname + ".mk").write(
+        "[\n%s]\n" % "".join([ "  ('foo', %r, foo_default_levels),\n" % item
+                               for item in items ]), ensure=True)
+
+
+# Loads the modules like a new Check_MK process and returns the
+# namespace and the list of the hosts whose check tables are computed
+@pytest.fixture()
+def new_process(monkeypatch, site):
+    def load(**config):
+        namespace = load_modules(monkeypatch, "%s/site" % site, checks_dir="%s/checks" % site)
+        namespace["load_checks"]()
+        namespace["read_config_files"]()
+        set_config(namespace, **dict({ "all_hosts" : HOSTS }, **config))
+
+        computed = []
+        compute_check_table_rows = namespace["compute_check_table_rows"]
+        def compute(hostname, world, skip_autochecks):
+            computed.append(hostname)
+            return compute_check_table_rows(hostname, world, skip_autochecks)
+        monkeypatch.setitem(namespace, "compute_check_table_rows", compute)
+        return namespace, computed
+    return load
+
+
+# Gets the check tables of both hosts and stores them like a
+# Check_MK process does when it terminates
+def _check_tables(namespace):
+    tables = [ sorted(namespace["get_check_table"](hostname).items())
+               for hostname in [ "host1", "host2" ] ]
+    namespace["save_persistent_caches"]()
+    return tables
+
+
+def test_stored_tables_reused(new_process):
+    namespace, computed = new_process()
+    tables = _check_tables(namespace)
+    assert computed == [ "host1", "host2" ]
+    assert [ item for (_unused_check_type, item), _unused_entry in tables[0] ] == [ u"a", u"b" ]
+
+    namespace, computed = new_process()
+    assert _check_tables(namespace) == tables
+    assert computed == []
+
+
+def test_autochecks_changed(new_process, site):
+    _check_tables(new_process()[0])
+    _write_autochecks(site, "host1", [ "a", "b", "c" ])
+
+    namespace, computed = new_process()
+    tables = _check_tables(namespace)
+    assert computed == [ "host1" ]
+    assert len(tables[0]) == 3
+
+
+def test_referenced_variable_changed(new_process, site):
+    main_mk = site.join("site", "etc", "check_mk", "main.mk")
+    main_mk.write("foo_default_levels = (1.0, 2.0)\n", ensure=True)
+    tables = _check_tables(new_process()[0])
+    assert tables[0][0] == (("foo", u"a"), ((1.0, 2.0), u"Foo a", []))
+
+    main_mk.write("foo_default_levels = (7.0, 9.0)\n")
+    namespace, computed = new_process()
+    tables = _check_tables(namespace)
+    assert computed == [ "host1", "host2" ]
+    assert tables[0][0] == (("foo", u"a"), ((7.0, 9.0), u"Foo a", []))
+
+
+def test_host_tags_changed(new_process):
+    _check_tables(new_process()[0])
+
+    namespace, computed = new_process(all_hosts=[ "host1|lnx|test", "host2|lnx|prod" ])
+    _check_tables(namespace)
+    assert computed == [ "host1" ]
+
+
+def test_rule_changed(new_process):
+    _check_tables(new_process()[0])
+
+    namespace, computed = new_process(ignored_services=[ ( [ "host2" ], [ "Foo b" ] ) ])
+    tables = _check_tables(namespace)
+    assert computed == [ "host2" ]
+    assert [ item for (_unused_check_type, item), _unused_entry in tables[1] ] == [ u"a" ]
+
+    namespace, computed = new_process(ignored_services=[ ( [ "prod" ], [ "@all" ], [ "Foo a" ] ) ])
+    _check_tables(namespace)
+    assert computed == [ "host1", "host2" ]
+
+
+def test_manual_checks_changed(new_process):
+    _check_tables(new_process()[0])
+
+    namespace, computed = new_process(checks=[ ( "host2", "foo", "x", (1, 2) ) ])
+    tables = _check_tables(namespace)
+    assert computed == [ "host2" ]
+    assert len(tables[1]) == 3
+
+
+def test_parameters_not_storable(new_process, capsys):
+    checks = [ ( "host1", "foo", "x", _NotMarshallable() ) ]
+    namespace, computed = new_process(checks=checks)
+    cmk.log.set_verbosity(verbosity=1)
+    _check_tables(namespace)
+    assert "Not storing check table of host1" in capsys.readouterr()[0]
+
+    store_dir = namespace["check_table_store_dir"]("config")
+    assert os.listdir(store_dir) == [ "host2" ]
+    assert namespace["g_check_table_store_changes"] == {}
+
+    namespace, computed = new_process(checks=checks)
+    _check_tables(namespace)
+    assert computed == [ "host1" ]
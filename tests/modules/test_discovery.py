@@ -0,0 +1,139 @@
+# encoding: utf-8
+
+import os
+import sys
+
+import cmk.log
+
+from testlib.cmk_modules import set_config
+
+HOSTS = [ "host%d" % nr for nr in range(7) ]
+
+
+# Returns the process ID as result, so the tests can tell which
+# worker has discovered a host
+def _discover(errors=None):
+    def discover(hostname):
+        sys.stdout.write("output of %s\n" % hostname)
+        return os.getpid(), (errors or {}).get(hostname)
+    return discover
+
+
+def _configure(cmk_modules, discovery_processes, hosts=HOSTS):
+    set_config(cmk_modules, all_hosts=hosts, discovery_processes=discovery_processes)
+
+
+def test_sequential(cmk_modules, capsys):
+    _configure(cmk_modules, 1)
+    results = cmk_modules["discover_hosts"](HOSTS[:3], _discover())
+    assert results == [ (hostname, os.getpid()) for hostname in HOSTS[:3] ]
+    assert capsys.readouterr()[0] == "".join([ "output of %s\n" % hostname
+                                               for hostname in HOSTS[:3] ])
+
+
+def test_round_robin(cmk_modules):
+    _configure(cmk_modules, 3)
+    results = cmk_modules["discover_hosts"](HOSTS, _discover())
+    assert [ hostname for hostname, _unused_pid in results ] == HOSTS
+
+    pids = [ pid for _unused_hostname, pid in results ]
+    assert os.getpid() not in pids
+    assert len(set(pids)) == 3
+    for nr, pid in enumerate(pids):
+        assert pid == pids[nr % 3]
+
+
+def test_more_processes_than_hosts(cmk_modules):
+    _configure(cmk_modules, 8)
+    results = cmk_modules["discover_hosts"](HOSTS[:2], _discover())
+    assert [ hostname for hostname, _unused_pid in results ] == HOSTS[:2]
+    assert len(set([ pid for _unused_hostname, pid in results ])) == 2
+
+
+def test_output_in_host_order(cmk_modules, capsys):
+    _configure(cmk_modules, 3)
+    cmk_modules["discover_hosts"](HOSTS, _discover())
+    assert capsys.readouterr()[0] == "".join([ "output of %s\n" % hostname
+                                               for hostname in HOSTS ])
+
+
+def test_summary_succeeded(cmk_modules, capsys):
+    _configure(cmk_modules, 2)
+    cmk.log.set_verbosity(verbosity=1)
+    cmk_modules["discover_hosts"](HOSTS, _discover())
+    output = capsys.readouterr()[0]
+    assert "Time needed per host:\n" in output
+    assert "Discovery succeeded on all 7 hosts.\n" in output
+
+
+def test_summary_failed(cmk_modules, capsys):
+    _configure(cmk_modules, 2)
+    cmk.log.set_verbosity(verbosity=1)
+    cmk_modules["discover_hosts"](HOSTS, _discover({ "host1" : "", "host4" : "SNMP timeout" }))
+    output = capsys.readouterr()[0]
+    assert "Discovery failed on 2 of 7 hosts:\n" in output
+    failed = output.split("Discovery failed on 2 of 7 hosts:\n")[1].splitlines()
+    assert [ line.split() for line in failed ] == [
+        [ "host1", "host", "is", "offline" ],
+        [ "host4", "SNMP", "timeout" ],
+    ]
+
+
+# The parameters of the automatic rediscovery of the hosts
+def _rediscovery_params(group_time=0):
+    return {
+        "inventory_check_do_scan" : True,
+        "inventory_rediscovery"   : {
+            "mode"          : 0,
+            "group_time"    : group_time,
+            "excluded_time" : [],
+            "activation"    : False,
+        },
+    }
+
+
+def _discover_marked_hosts(cmk_modules, monkeypatch, hosts, marked, params, results):
+    _configure(cmk_modules, 2, hosts)
+    autodiscovery_dir = cmk_modules["cmk"].paths.var_dir + "/autodiscovery"
+    os.makedirs(autodiscovery_dir)
+    for hostname in marked:
+        file(autodiscovery_dir + "/" + hostname, "w").close()
+
+    scheduled = []
+    monkeypatch.setitem(cmk_modules, "discovery_check_parameters",
+                        lambda hostname: params.get(hostname, _rediscovery_params()))
+    monkeypatch.setitem(cmk_modules, "discover_on_host",
+                        lambda mode, hostname, do_snmp_scan, use_caches, service_filter: results[hostname])
+    monkeypatch.setitem(cmk_modules, "schedule_inventory_check", scheduled.append)
+
+    cmk_modules["discover_marked_hosts"]()
+    return sorted(os.listdir(autodiscovery_dir)), scheduled
+
+
+def test_discover_marked_hosts(cmk_modules, monkeypatch):
+    marks, scheduled = _discover_marked_hosts(cmk_modules, monkeypatch,
+        hosts   = [ "changed", "unchanged", "failed", "skipped" ],
+        marked  = [ "changed", "unchanged", "failed", "skipped", "removed" ],
+        params  = { "skipped" : _rediscovery_params(group_time=86400) },
+        results = {
+            "changed"   : ((1, 0, 2, 3), None),
+            "unchanged" : ((0, 0, 2, 2), None),
+            "failed"    : (None, "SNMP timeout"),
+        })
+
+    # The marks of skipped hosts are kept for the next run
+    assert marks == [ "skipped" ]
+    assert scheduled == [ "changed" ]
+
+
+def test_discover_marked_hosts_timeout(cmk_modules, monkeypatch, capsys):
+    monkeypatch.setitem(cmk_modules, "marked_host_discovery_timeout", -1)
+    marks, scheduled = _discover_marked_hosts(cmk_modules, monkeypatch,
+        hosts   = [ "host1", "host2", "host3" ],
+        marked  = [ "host1", "host2", "host3" ],
+        params  = {},
+        results = {})
+
+    assert marks == [ "host1", "host2", "host3" ]
+    assert scheduled == []
+    assert capsys.readouterr()[0].count("Timeout of -1 seconds reached") == 1
@@ -0,0 +1,96 @@
+# encoding: utf-8
+
+import pytest
+
+from testlib.cmk_modules import load_modules, set_config
+
+# A check plugin recording the calls of its discovery function
+PLUGIN = """
+foo_discovery_calls = []
+
+def inventory_foo(info):
+    foo_discovery_calls.append(info)
+    return [ (line[0], None) for line in info ]
+
+def check_foo(item, params, info):
+    return 0, "OK"
+
+check_info["foo"] = {
+    "inventory_function"  : inventory_foo,
+    "check_function"      : check_foo,
+    "service_description" : "Foo %s",
+    "has_perfdata"        : False,
+}
+"""
+
+
+@pytest.fixture()
+def site(tmpdir):
+    tmpdir.join("checks", "foo").write(PLUGIN, ensure=True)
+    return tmpdir
+
+
+# Loads the modules like a new Check_MK process. The agent sections of
+# the host are taken from the given dictionary.
+@pytest.fixture()
+def new_process(monkeypatch, site):
+    def load(sections):
+        namespace = load_modules(monkeypatch, "%s/site" % site, checks_dir="%s/checks" % site)
+        namespace["load_checks"]()
+        set_config(namespace, all_hosts=[ "host1" ])
+        monkeypatch.setitem(namespace, "get_realhost_info",
+            lambda hostname, ipaddress, section_name, max_cache_age, **kwargs: \
+                sections.get(section_name))
+        return namespace
+    return load
+
+
+# Discovers the check type like the periodic discovery check does (see
+# get_host_services_incremental()). Returns the discovered services and
+# the number of calls of the discovery function.
+def _discover(namespace):
+    namespace["g_discovery_fingerprints"] = {}
+    try:
+        result = namespace["discover_check_type"]("host1", "127.0.0.1", "foo", True, "raise")
+        namespace["save_discovery_fingerprints"]()
+    finally:
+        namespace["g_discovery_fingerprints"] = None
+    return result, len(namespace["foo_discovery_calls"])
+
+
+def test_unchanged_sections(new_process):
+    sections = { "foo" : [ [ "a" ], [ "b" ] ] }
+    assert _discover(new_process(sections)) == ([ (u"a", None), (u"b", None) ], 1)
+
+    # The stored result is used, the discovery function is not called
+    assert _discover(new_process(sections)) == ([ (u"a", None), (u"b", None) ], 0)
+    assert _discover(new_process(sections)) == ([ (u"a", None), (u"b", None) ], 0)
+
+
+def test_changed_sections(new_process):
+    _discover(new_process({ "foo" : [ [ "a" ], [ "b" ] ] }))
+    assert _discover(new_process({ "foo" : [ [ "a" ] ] })) == ([ (u"a", None) ], 1)
+    assert _discover(new_process({ "foo" : [ [ "a" ] ] })) == ([ (u"a", None) ], 0)
+
+
+def test_missing_section(new_process):
+    _discover(new_process({ "foo" : [ [ "a" ] ] }))
+    assert _discover(new_process({})) == ([], 0)
+    assert _discover(new_process({ "foo" : [ [ "a" ] ] })) == ([ (u"a", None) ], 1)
+
+
+def test_changed_configuration(new_process, site):
+    sections = { "foo" : [ [ "a" ] ] }
+    _discover(new_process(sections))
+    site.join("site", "etc", "check_mk", "main.mk").write("# changed\n")
+    assert _discover(new_process(sections)) == ([ (u"a", None) ], 1)
+
+
+def test_not_incremental(new_process):
+    sections = { "foo" : [ [ "a" ] ] }
+    _discover(new_process(sections))
+
+    namespace = new_process(sections)
+    assert namespace["discover_check_type"]("host1", "127.0.0.1", "foo", True, "raise") \
+        == [ (u"a", None) ]
+    assert len(namespace["foo_discovery_calls"]) == 1
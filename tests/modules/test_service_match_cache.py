@@ -0,0 +1,91 @@
+# encoding: utf-8
+
+import os
+
+from testlib.cmk_modules import set_config
+
+ALL_HOSTS = [ "@all" ]
+
+RULESET = [
+    ( [ "prod" ], ALL_HOSTS, [ "CPU" ] ),
+    ( [ "@physical" ], [ "Memory" ] ),
+]
+
+
+def _configure(cmk_modules, all_hosts, clusters=None):
+    set_config(cmk_modules, all_hosts=all_hosts, clusters=clusters or {})
+
+
+# Matches like a new Check_MK process started with the given configuration
+def _matches(cmk_modules, hostname, service, ruleset=RULESET):
+    return cmk_modules["in_boolean_serviceconf_list"](hostname, service, ruleset)
+
+
+def _cached_services(cmk_modules, hostname, ruleset=RULESET):
+    return sorted(cmk_modules["service_match_bitmaps"](hostname, ruleset))
+
+
+def test_cache_is_stored(cmk_modules):
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _matches(cmk_modules, "host1", "CPU load")
+    assert not _matches(cmk_modules, "host1", "Uptime")
+    cmk_modules["save_service_match_caches"]()
+    assert os.path.exists(cmk_modules["service_match_cache_dir"]() + "/host1")
+
+    # Unchanged configuration: the next process reuses the results
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _cached_services(cmk_modules, "host1") == [ "CPU load", "Uptime" ]
+    assert _matches(cmk_modules, "host1", "CPU load")
+
+
+def test_host_tags_changed(cmk_modules):
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _matches(cmk_modules, "host1", "CPU load")
+    cmk_modules["save_service_match_caches"]()
+
+    _configure(cmk_modules, [ "host1|lnx|test" ])
+    assert _cached_services(cmk_modules, "host1") == []
+    assert not _matches(cmk_modules, "host1", "CPU load")
+
+
+def test_other_hosts_changed(cmk_modules):
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _matches(cmk_modules, "host1", "CPU load")
+    cmk_modules["save_service_match_caches"]()
+
+    _configure(cmk_modules, [ "host1|lnx|prod", "host2|win" ])
+    assert _cached_services(cmk_modules, "host1") == [ "CPU load" ]
+
+
+def test_host_became_cluster(cmk_modules):
+    _configure(cmk_modules, [ "host1|lnx", "node1|lnx" ])
+    assert _matches(cmk_modules, "host1", "Memory")
+    cmk_modules["save_service_match_caches"]()
+
+    _configure(cmk_modules, [ "node1|lnx" ], { "host1|lnx" : [ "node1" ] })
+    assert _cached_services(cmk_modules, "host1") == []
+    assert not _matches(cmk_modules, "host1", "Memory")
+
+
+def test_ruleset_changed(cmk_modules):
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _matches(cmk_modules, "host1", "CPU load")
+    cmk_modules["save_service_match_caches"]()
+
+    ruleset = [ ( [ "test" ], ALL_HOSTS, [ "CPU" ] ) ]
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _cached_services(cmk_modules, "host1", ruleset) == []
+    assert not _matches(cmk_modules, "host1", "CPU load", ruleset)
+
+
+def test_outdated_process(cmk_modules):
+    # A process still running with the former configuration stores its
+    # results after the configuration has been changed
+    _configure(cmk_modules, [ "host1|lnx|test" ])
+    open(cmk_modules["cmk"].paths.main_config_file, "a").write("# changed\n")
+    assert not _matches(cmk_modules, "host1", "CPU load")
+    cmk_modules["save_service_match_caches"]()
+
+    _configure(cmk_modules, [ "host1|lnx|prod" ])
+    assert _cached_services(cmk_modules, "host1") == []
+    assert _matches(cmk_modules, "host1", "CPU load")
@@ -0,0 +1,48 @@
+# encoding: utf-8
+
+IF_ENTRY = ".1.3.6.1.2.1.2.2.1"
+
+ROWS = [
+    (IF_ENTRY + ".1.1", "1"),
+    (IF_ENTRY + ".2.1", "eth0"),
+    (IF_ENTRY + ".10.1", "100"),
+]
+
+
+# Walks the given OIDs through walk_snmp_subtrees() and returns the rows
+# and the OIDs really walked
+def _walk(cmk_modules, monkeypatch, fetchoids, planned=None):
+    walked = []
+    def walk_snmp_oids(hostname, ip, check_type, base_oid, oids, context_name):
+        walked.extend(oids)
+        return dict([ (oid, [ row for row in ROWS if (row[0] + ".").startswith(oid + ".") ])
+                      for oid in oids ])
+    monkeypatch.setitem(cmk_modules, "walk_snmp_oids", walk_snmp_oids)
+
+    if planned is not None:
+        cmk_modules["g_snmp_walk_plans"][("host1", None)] = planned
+    rowinfos = cmk_modules["walk_snmp_subtrees"]("host1", "127.0.0.1", "if", IF_ENTRY,
+                                                 fetchoids, None)
+    return rowinfos, walked
+
+
+def test_walk_mixed_forms(cmk_modules, monkeypatch):
+    rowinfos, walked = _walk(cmk_modules, monkeypatch, [ IF_ENTRY, IF_ENTRY[1:] + ".2" ])
+    assert walked == [ IF_ENTRY ]
+    assert rowinfos == {
+        IF_ENTRY             : ROWS,
+        IF_ENTRY[1:] + ".2"  : [ (IF_ENTRY + ".2.1", "eth0") ],
+    }
+
+
+def test_walk_planned_without_leading_dot(cmk_modules, monkeypatch):
+    planned = cmk_modules["cmk_base"].snmp_subtrees.covering_oids([ IF_ENTRY[1:],
+                                                                     IF_ENTRY + ".10" ])
+    rowinfos, walked = _walk(cmk_modules, monkeypatch, [ IF_ENTRY[1:] + ".10" ], planned)
+    assert walked == [ IF_ENTRY ]
+    assert rowinfos == { IF_ENTRY[1:] + ".10" : [ (IF_ENTRY + ".10.1", "100") ] }
+
+    # Later walks are served from the walked subtree
+    rowinfos, walked = _walk(cmk_modules, monkeypatch, [ IF_ENTRY + ".2", IF_ENTRY[1:] + ".1" ])
+    assert walked == []
+    assert rowinfos[IF_ENTRY[1:] + ".1"] == [ (IF_ENTRY + ".1.1", "1") ]
@@ -0,0 +1,68 @@
+# encoding: utf-8
+#
+# Loads the Check_MK modules (modules/*.py) into a namespace, the way
+# modules/check_mk.py does, but without executing the main program.
+# The functions of the modules can then be tested against a site
+# directory created below a temporary directory.
+
+import os
+import sys
+
+import cmk.paths
+
+from testlib import cmk_path
+
+
+# Creates the parts of the site directory which do not exist yet
+def create_site(omd_root):
+    for path in [ "etc/check_mk/conf.d", "var/check_mk", "tmp/check_mk" ]:
+        if not os.path.exists("%s/%s" % (omd_root, path)):
+            os.makedirs("%s/%s" % (omd_root, path))
+
+    if not os.path.exists("%s/etc/check_mk/main.mk" % omd_root):
+        file("%s/etc/check_mk/main.mk" % omd_root, "w").write("")
+
+    if not os.path.lexists("%s/version" % omd_root):
+        os.symlink("versions/1.4.0i1", "%s/version" % omd_root)
+
+
+# Returns the namespace of the loaded modules. The monkeypatch fixture
+# is used to restore the paths and the command line after the test.
+# Loading the modules again for the same site is like starting another
+# Check_MK process. The check plugins are read from checks_dir, which
+# defaults to the checks of the repository.
+def load_modules(monkeypatch, omd_root, argv=None, checks_dir=None):
+    create_site(omd_root)
+    monkeypatch.setenv("OMD_ROOT", omd_root)
+    monkeypatch.setattr(sys, "argv", [ "cmk" ] + (argv or []))
+    for name in dir(cmk.paths):
+        if not name.startswith("_"):
+            monkeypatch.setattr(cmk.paths, name, getattr(cmk.paths, name))
+
+    cmk.paths._set_paths()
+    cmk.paths.modules_dir = cmk_path() + "/modules"
+    cmk.paths.checks_dir  = checks_dir or cmk_path() + "/checks"
+
+    # check_mk_base removes the first entry of the module search path,
+    # which is the directory of the Check_MK program when it is executed
+    monkeypatch.setattr(sys, "path", [ cmk.paths.modules_dir ] + sys.path)
+
+    path = cmk.paths.modules_dir + "/check_mk.py"
+    source = file(path).read()
+    source = source[:source.index("\nregister_sigint_handler()\n")]
+
+    namespace = { "__name__" : "cmk_modules" }
+    exec compile(source, path, "exec") in namespace
+    return namespace
+
+
+# Sets the given configuration variables and derives the host tags
+# from all_hosts, like read_config_files() does. The caches depending
+# on the configuration are reset, like in keepalive mode.
+def set_config(namespace, **config):
+    namespace.update(config)
+    namespace["hosttags"].clear()
+    namespace["collect_hosttags"]()
+    namespace["reset_global_caches"]()
+    namespace["all_hosts_untagged"] = None
+    namespace["all_clusters_untagged"] = None
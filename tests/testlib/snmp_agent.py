@@ -0,0 +1,135 @@
+# encoding: utf-8
+#
+# A minimal SNMP agent for testing the built-in SNMP engine
+
+import bisect
+import socket
+import threading
+
+import cmk_base.snmp_engine as snmp_engine
+from cmk_base.snmp_engine import PDU, USMUser, oid_to_tuple, \
+                                 OCTET_STRING, INTEGER, OBJECT_ID, COUNTER32, \
+                                 IP_ADDRESS, TIMETICKS
+
+ENGINE_ID = "\x80\x00\x1f\x88\x04agent"
+
+MIB = [
+    (".1.3.6.1.2.1.1.1.0",        OCTET_STRING, "Linux box 4.9.0"),
+    (".1.3.6.1.2.1.1.2.0",        OBJECT_ID,    ".1.3.6.1.4.1.8072.3.2.10"),
+    (".1.3.6.1.2.1.1.3.0",        TIMETICKS,    123456),
+    (".1.3.6.1.2.1.2.2.1.1.1",    INTEGER,      1),
+    (".1.3.6.1.2.1.2.2.1.1.2",    INTEGER,      2),
+    (".1.3.6.1.2.1.2.2.1.1.10",   INTEGER,      10),
+    (".1.3.6.1.2.1.2.2.1.2.1",    OCTET_STRING, "lo"),
+    (".1.3.6.1.2.1.2.2.1.2.2",    OCTET_STRING, "eth0"),
+    (".1.3.6.1.2.1.2.2.1.2.10",   OCTET_STRING, "eth1"),
+    (".1.3.6.1.2.1.2.2.1.6.2",    OCTET_STRING, "\x00\x1a\x2b\x3c\x4d\x5e"),
+    (".1.3.6.1.2.1.2.2.1.10.1",   COUNTER32,    4294967295),
+    (".1.3.6.1.2.1.2.2.1.10.2",   COUNTER32,    17),
+    (".1.3.6.1.2.1.2.2.1.10.10",  COUNTER32,    0),
+    (".1.3.6.1.2.1.4.20.1.1.127.0.0.1", IP_ADDRESS, "127.0.0.1"),
+]
+
+
+# Answers from MIB on a local UDP port
+class Agent(threading.Thread):
+    # max_varbinds: truncate GETBULK responses to this number of variables
+    def __init__(self, credentials="public", delay=0, max_varbinds=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.credentials = credentials
+        self.delay = delay
+        self.max_varbinds = max_varbinds
+        self.usm_user = type(credentials) == tuple and USMUser(credentials) or None
+        self.mib = sorted(MIB, key=lambda entry: oid_to_tuple(entry[0]))
+        self.keys = [ oid_to_tuple(entry[0]) for entry in self.mib ]
+        self.num_requests = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except socket.error:
+                return
+            self.num_requests += 1
+            answer = self.handle(data)
+            if answer and self.delay:
+                threading.Timer(self.delay, self.socket.sendto, (answer, address)).start()
+            elif answer:
+                self.socket.sendto(answer, address)
+
+
+    def handle(self, data):
+        if snmp_engine.message_version(data) != 3:
+            version, community, request = snmp_engine.decode_community_message(data)
+            if community != self.credentials:
+                return None
+            return snmp_engine.encode_community_message(version, community,
+                                                        self.respond(request, version == 0))
+
+        try:
+            message = self.usm_user.decode_message(data)
+        except snmp_engine.SNMPError:
+            return self.report(snmp_engine.message_request_id(data), ".1.3.6.1.6.3.15.1.1.5.0")
+
+        if not message["engine_id"]:
+            return self.report(message["msg_id"], ".1.3.6.1.6.3.15.1.1.4.0")
+
+        return self.usm_user.encode_message(message["msg_id"], message["flags"] & 0x03,
+                                            ENGINE_ID, 1, 1000,
+                                            self.scoped(self.respond(message["pdu"], False)))
+
+
+    def report(self, msg_id, oid):
+        report = PDU(snmp_engine.REPORT, [ (oid, COUNTER32, 1) ], msg_id)
+        return USMUser(("noAuthNoPriv", "")).encode_message(msg_id, 0, ENGINE_ID, 1, 1000,
+                                                            self.scoped(report))
+
+
+    def scoped(self, pdu):
+        return snmp_engine.encode_tlv(snmp_engine.SEQUENCE,
+                      snmp_engine.encode_tlv(OCTET_STRING, ENGINE_ID)
+                    + snmp_engine.encode_tlv(OCTET_STRING, "")
+                    + pdu.encode())
+
+
+    def respond(self, request, v1):
+        varbinds = []
+        if request.pdu_type == snmp_engine.GET_BULK_REQUEST:
+            non_repeaters, repetitions = request.error_status, request.error_index
+            current = [ oid for oid, _unused_tag, _unused_value in request.varbinds[non_repeaters:] ]
+            for _unused_repetition in range(repetitions):
+                entries = [ self.next_entry(oid) for oid in current ]
+                varbinds += entries
+                current = [ oid for oid, _unused_tag, _unused_value in entries ]
+            return PDU(snmp_engine.RESPONSE, varbinds[:self.max_varbinds], request.request_id)
+
+        for index, (oid, _unused_tag, _unused_value) in enumerate(request.varbinds):
+            if request.pdu_type == snmp_engine.GET_NEXT_REQUEST:
+                varbind = self.next_entry(oid)
+            else:
+                varbind = self.lookup(oid)
+
+            if v1 and varbind[1] >= 0x80:
+                return PDU(snmp_engine.RESPONSE, request.varbinds, request.request_id,
+                           snmp_engine.ERROR_NO_SUCH_NAME, index + 1)
+            varbinds.append(varbind)
+        return PDU(snmp_engine.RESPONSE, varbinds, request.request_id)
+
+
+    def next_entry(self, oid):
+        index = bisect.bisect_right(self.keys, oid_to_tuple(oid))
+        if index >= len(self.mib):
+            return oid, snmp_engine.END_OF_MIB_VIEW, None
+        return self.mib[index]
+
+
+    def lookup(self, oid):
+        index = bisect.bisect_left(self.keys, oid_to_tuple(oid))
+        if index < len(self.mib) and self.keys[index] == oid_to_tuple(oid):
+            return self.mib[index]
+        return oid, snmp_engine.NO_SUCH_INSTANCE, None
@@ -25,6 +25,7 @@
 # Boston, MA 02110-1301 USA.
 
 import os
+import struct
 import time
 
 import cmk.paths
@@ -103,7 +104,7 @@ def page_graph():
 
     # Get prediction data
     path = dir + "/" + timegroup["name"]
-    tg_data = store.load_data_from_file(path)
+    tg_data = load_prediction(path)
     if tg_data == None:
         raise MKGeneralException(_("Missing prediction data."))
 
@@ -255,6 +256,37 @@ def get_rrd_data(hostname, service_description, varname, cf, fromtime, untiltime
     return step, values
 
 
+# Reads the binary prediction files written by cmk_base/prediction.py,
+# keep in sync with load_prediction() there. Predictions of former
+# versions are Python literals.
+def load_prediction(path):
+    try:
+        data = file(path).read()
+    except IOError:
+        return None
+
+    header_size, point_size = struct.calcsize("!7sHII"), struct.calcsize("!4d")
+    if not data.startswith("CMKPRED"):
+        return store.load_data_from_file(path)
+    elif len(data) < header_size:
+        return None
+
+    _unused_magic, version, num_points, step = struct.unpack("!7sHII", data[:header_size])
+    if version != 1 or len(data) != header_size + num_points * point_size:
+        return None
+
+    points = []
+    for offset in xrange(header_size, len(data), point_size):
+        points.append([ (v if v == v else None) # NaN -> None
+                        for v in struct.unpack("!4d", data[offset:offset + point_size]) ])
+    return {
+        "num_points" : num_points,
+        "step"       : step,
+        "columns"    : [ "average", "min", "max", "stdev" ],
+        "points"     : points,
+    }
+
+
 # Compute check levels from prediction data and check parameters
 def swap_and_compute_levels(tg_data, tg_info):
     columns = tg_data["columns"]